@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""Инкрементные резервные копии: снимки из блоков, адресуемых по содержимому.
+
+Каталог копий:
+  objects/ab/abcd….gz    — блок записей (NDJSON), имя — sha256 несжатого содержимого;
+  snapshots/<время>.json — манифест снимка: список блоков по порядку.
+
+Записи делятся на блоки по диапазонам id, поэтому правка одной записи меняет
+один блок, а остальные блоки нового снимка уже лежат на диске и не пишутся
+повторно. Каждый манифест описывает базу целиком: восстановление любого
+снимка — чтение его блоков, без проигрывания цепочки изменений.
+"""
+
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+
+from persistence import write_atomic
+from records import ID_FIELD
+
+# Сжатие блоков: имя -> (расширение файла, сжать, распаковать)
+COMPRESSORS = {
+    "gzip": (".gz", gzip.compress, gzip.decompress),
+    "lzma": (".xz", lzma.compress, lzma.decompress),
+    "none": ("", bytes, bytes),
+}
+CHUNK_IDS = 256     # ширина диапазона id одного блока
+_TIME_FORMAT = "%Y%m%d_%H%M%S"
+
+
+class SnapshotInfo(NamedTuple):
+    name: str
+    created: datetime
+    records: int
+    label: str
+
+
+class BackupResult(NamedTuple):
+    snapshot: Optional[SnapshotInfo]    # None — данные не менялись с прошлого снимка
+    chunks: int
+    new_chunks: int
+    new_bytes: int
+
+
+def _encode_chunk(records: List[Dict[str, Any]]) -> bytes:
+    lines = (json.dumps(record, ensure_ascii=False, separators=(",", ":")) for record in records)
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class BackupStore:
+    """Хранилище снимков базы с дедупликацией блоков и ротацией.
+
+    Все методы блокирующие (вызываются из пула ввода-вывода) и выполняются
+    под общей блокировкой, чтобы сборка мусора не удалила блок, на который
+    ещё пишется манифест.
+    """
+
+    def __init__(self, root: str, compression: str = "gzip", chunk_ids: int = CHUNK_IDS):
+        if compression not in COMPRESSORS:
+            raise ValueError(f"Неизвестное сжатие резервных копий: {compression}")
+        self.root = root
+        self.compression = compression
+        self.chunk_ids = chunk_ids
+        self.objects_dir = os.path.join(root, "objects")
+        self.snapshots_dir = os.path.join(root, "snapshots")
+        self._lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+
+    # -------------------------
+    # Блоки
+    # -------------------------
+    def _object_base(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _find_object(self, digest: str) -> Optional[str]:
+        """Путь к блоку (он мог быть записан с другим сжатием)"""
+        base = self._object_base(digest)
+        for ext, _, _ in COMPRESSORS.values():
+            if os.path.exists(base + ext):
+                return base + ext
+        return None
+
+    def _put_object(self, payload: bytes) -> Optional[int]:
+        """Сохранить блок; возвращает записанный размер или None, если блок уже есть"""
+        digest = hashlib.sha256(payload).hexdigest()
+        if self._find_object(digest) is not None:
+            return None
+        ext, compress, _ = COMPRESSORS[self.compression]
+        path = self._object_base(digest) + ext
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = compress(payload)
+        write_atomic(path, data)
+        return len(data)
+
+    def _read_object(self, digest: str) -> bytes:
+        path = self._find_object(digest)
+        if path is None:
+            raise ValueError(f"Блок {digest[:12]} отсутствует")
+        with open(path, "rb") as f:
+            data = f.read()
+        for ext, _, decompress in COMPRESSORS.values():
+            if ext and path.endswith(ext):
+                data = decompress(data)
+                break
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Блок {digest[:12]} повреждён")
+        return data
+
+    # -------------------------
+    # Снимки
+    # -------------------------
+    def _manifest_path(self, name: str) -> str:
+        return os.path.join(self.snapshots_dir, name + ".json")
+
+    def _read_manifest(self, name: str) -> Dict[str, Any]:
+        if not name or os.path.basename(name) != name:
+            raise ValueError(f"Некорректное имя снимка: {name}")
+        path = self._manifest_path(name)
+        if not os.path.exists(path):
+            raise ValueError(f"Снимок {name} не найден")
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _new_name(self, created: datetime) -> str:
+        name = base = created.strftime(_TIME_FORMAT)
+        suffix = 1
+        while os.path.exists(self._manifest_path(name)):
+            name, suffix = f"{base}_{suffix}", suffix + 1
+        return name
+
+    def snapshots(self) -> List[SnapshotInfo]:
+        """Снимки от новых к старым"""
+        found = []
+        for filename in os.listdir(self.snapshots_dir):
+            if not filename.endswith(".json"):
+                continue
+            name = filename[:-len(".json")]
+            try:
+                manifest = self._read_manifest(name)
+                found.append(SnapshotInfo(name, datetime.fromisoformat(manifest["created"]),
+                                          manifest["records"], manifest.get("label", "")))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Пропущен повреждённый снимок {name}: {e}")
+        found.sort(key=lambda info: (info.created, info.name), reverse=True)
+        return found
+
+    def create(self, records: List[Dict[str, Any]], label: str = "",
+               skip_unchanged: bool = False) -> BackupResult:
+        """Сохранить снимок записей; пишутся только блоки, которых ещё нет"""
+        groups: Dict[int, List[Dict[str, Any]]] = {}
+        for record in sorted(records, key=lambda item: item[ID_FIELD]):
+            groups.setdefault(record[ID_FIELD] // self.chunk_ids, []).append(record)
+        payloads = [_encode_chunk(groups[key]) for key in sorted(groups)]
+        digests = [hashlib.sha256(payload).hexdigest() for payload in payloads]
+
+        with self._lock:
+            if skip_unchanged:
+                latest = self.snapshots()
+                if latest and self._read_manifest(latest[0].name)["chunks"] == digests:
+                    return BackupResult(None, len(digests), 0, 0)
+            new_chunks = new_bytes = 0
+            for payload in payloads:
+                written = self._put_object(payload)
+                if written is not None:
+                    new_chunks += 1
+                    new_bytes += written
+            created = datetime.now().replace(microsecond=0)
+            name = self._new_name(created)
+            manifest = {"created": created.isoformat(), "label": label,
+                        "records": len(records), "chunks": digests}
+            write_atomic(self._manifest_path(name), json.dumps(manifest).encode("utf-8"))
+        return BackupResult(SnapshotInfo(name, created, len(records), label),
+                            len(digests), new_chunks, new_bytes)
+
+    def load(self, name: str) -> List[Dict[str, Any]]:
+        """Записи снимка"""
+        with self._lock:
+            manifest = self._read_manifest(name)
+            records = []
+            for digest in manifest["chunks"]:
+                for line in self._read_object(digest).decode("utf-8").splitlines():
+                    if line:
+                        records.append(json.loads(line))
+        return records
+
+    # -------------------------
+    # Ротация
+    # -------------------------
+    def prune(self, keep_last: int = 10, keep_hourly: int = 24, keep_daily: int = 30):
+        """Удалить лишние снимки и блоки, на которые никто не ссылается.
+
+        Остаются keep_last последних снимков, а также самый новый снимок
+        каждого из keep_hourly последних часов и keep_daily последних дней.
+        Возвращает (удалено снимков, удалено блоков).
+        """
+        with self._lock:
+            snapshots = self.snapshots()
+            keep = {info.name for info in snapshots[:keep_last]}
+            for period, count in (("%Y%m%d%H", keep_hourly), ("%Y%m%d", keep_daily)):
+                buckets: Set[str] = set()
+                for info in snapshots:
+                    bucket = info.created.strftime(period)
+                    if bucket in buckets:
+                        continue
+                    if len(buckets) >= count:
+                        break
+                    buckets.add(bucket)
+                    keep.add(info.name)
+
+            removed = 0
+            for info in snapshots:
+                if info.name not in keep:
+                    os.remove(self._manifest_path(info.name))
+                    removed += 1
+            return removed, self._collect_garbage()
+
+    def _collect_garbage(self) -> int:
+        used: Set[str] = set()
+        for filename in os.listdir(self.snapshots_dir):
+            if filename.endswith(".json"):
+                try:
+                    used.update(self._read_manifest(filename[:-len(".json")])["chunks"])
+                except (OSError, ValueError, KeyError):
+                    # нечитаемый манифест: блоки не трогаем, вдруг он нужен
+                    return 0
+        removed = 0
+        for prefix in os.listdir(self.objects_dir):
+            directory = os.path.join(self.objects_dir, prefix)
+            for filename in os.listdir(directory):
+                if filename.split(".", 1)[0] not in used:
+                    os.remove(os.path.join(directory, filename))
+                    removed += 1
+        return removed
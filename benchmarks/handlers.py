@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""Задержка и пропускная способность обработчиков на синтетической базе.
+
+    python -m benchmarks.handlers [--records 1000 10000 100000] [--backend json]
+                                  [--out results.json] [--baseline old.json]
+
+Апдейты подаются прямо в dp.feed_update, сессия бота подменена заглушкой,
+поэтому измеряется только код бота (обработчики, индексы, FSM, запись на
+диск), без сети. Каждый размер базы прогоняется в отдельном процессе во
+временном каталоге: main читает данные при импорте.
+"""
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from benchmarks.synthetic import MATERIALS, SUBJECTS, TEACHERS, generate
+
+BENCH_TOKEN = "123456:BENCHMARK-TOKEN"
+ADMIN_ID = 1
+USERS = 1000                  # разные пользователи для пользовательских сценариев
+SCENARIOS = ("start", "nav_class", "nav_semester", "nav_subject", "nav_exam", "nav_card", "back",
+             "search", "stats", "add", "edit", "delete")
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], wall: float) -> Dict[str, float]:
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "ops_per_sec": len(values) / wall if wall else 0.0,
+        "mean_ms": statistics.fmean(values) * 1000,
+        "p50_ms": _percentile(values, 0.50) * 1000,
+        "p99_ms": _percentile(values, 0.99) * 1000,
+        "max_ms": values[-1] * 1000,
+    }
+
+
+# -------------------------
+# Прогон в отдельном процессе
+# -------------------------
+def _configure(backend: str):
+    """Настройки бенчмарка поверх config.py: до импорта main"""
+    import config
+    config.BOT_TOKEN = BENCH_TOKEN
+    config.ADMIN_IDS = [ADMIN_ID]
+    config.STORAGE_BACKEND = backend
+    config.BACKUP_INTERVAL = 0
+    config.DATA_RELOAD_INTERVAL = 0
+    config.METRICS_PORT = 0
+    config.WORKERS = 1
+    # пользователи бенчмарка шлют апдейты чаще лимита — меряем обработчики, а не защиту от флуда
+    config.THROTTLE_MESSAGE_RATE = 0
+    config.THROTTLE_CALLBACK_RATE = 0
+
+
+def measure(count: int, backend: str, iterations: int, concurrency: int, seed: int) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="bench")
+    os.chdir(workdir)
+    records = [dict(record, id=i) for i, record in enumerate(generate(count, seed), 1)]
+    with open("schedule_data.json", "w", encoding="utf-8") as f:
+        json.dump(records, f, ensure_ascii=False)
+    _configure(backend)
+
+    started = time.perf_counter()
+    import main
+    load_seconds = time.perf_counter() - started
+    return asyncio.run(_run(main, records, load_seconds, iterations, concurrency, seed))
+
+
+async def _run(main, records, load_seconds, iterations, concurrency, seed) -> Dict[str, Any]:
+    from aiogram.client.session.base import BaseSession
+    from aiogram.fsm.storage.base import StorageKey
+    from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+    ids = itertools.count(1)
+
+    class StubSession(BaseSession):
+        """Ответы Bot API без сети: сообщения — фиктивные, остальное — True"""
+
+        async def close(self):
+            pass
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            yield b""
+
+        async def make_request(self, bot, method, timeout=None):
+            returning = str(method.__returning__)
+            if "Message" in returning:
+                chat_id = getattr(method, "chat_id", None) or ADMIN_ID
+                return Message(message_id=next(ids), date=datetime.datetime.now(),
+                               chat=Chat(id=chat_id, type="private"), text="x")
+            return True
+
+    bot, dp = main.bot, main.dp
+    bot.session = StubSession()
+    rng = random.Random(seed)
+
+    def message(text: str, user_id: int) -> Update:
+        user = User(id=user_id, is_bot=False, first_name="bench")
+        return Update(update_id=next(ids), message=Message(
+            message_id=next(ids), date=datetime.datetime.now(), chat=Chat(id=user_id, type="private"),
+            from_user=user, text=text))
+
+    def callback(data: str, user_id: int) -> Update:
+        user = User(id=user_id, is_bot=False, first_name="bench")
+        shown = Message(message_id=next(ids), date=datetime.datetime.now(),
+                        chat=Chat(id=user_id, type="private"), text="x")
+        return Update(update_id=next(ids), callback_query=CallbackQuery(
+            id=str(next(ids)), from_user=user, chat_instance="bench", message=shown, data=data))
+
+    async def admin_state(state, data: Dict[str, Any]):
+        key = StorageKey(bot_id=bot.id, chat_id=ADMIN_ID, user_id=ADMIN_ID)
+        await dp.storage.set_state(key, state)
+        await dp.storage.set_data(key, data)
+
+    paths = [tuple(record[level] for level in main.LEVELS) for record in records]
+    live_ids = [record["id"] for record in records]
+    states = main.AdminStates
+
+    def user() -> int:
+        return rng.randint(2, USERS + 1)
+
+    def nav(depth: int) -> Callable[[], Tuple[Update, None]]:
+        return lambda: (callback(main.nav_token(rng.choice(paths)[:depth]), user()), None)
+
+    async def prepare_add():
+        await admin_state(states.adding_link, {
+            "new_class": "5А", "new_semester": "1", "new_subject": rng.choice(SUBJECTS),
+            "new_exam": "Бенчмарк", "new_material_type": rng.choice(MATERIALS),
+            "new_info": "Добавлено бенчмарком"})
+
+    async def prepare_edit():
+        await admin_state(states.editing_value, {"edit_id": rng.choice(live_ids), "edit_field": "информация"})
+
+    async def prepare_delete():
+        record_id = live_ids.pop(rng.randrange(len(live_ids)))
+        await admin_state(states.deleting_confirm, {"delete_id": record_id})
+
+    # сценарий: (апдейт, подготовка FSM перед ним); подготовка в замер не входит
+    scenarios: Dict[str, Callable[[], Tuple[Update, Any]]] = {
+        "start": lambda: (message("/start", user()), None),
+        "nav_class": nav(1),
+        "nav_semester": nav(2),
+        "nav_subject": nav(3),
+        "nav_exam": nav(4),
+        "nav_card": nav(5),
+        # «⬅️ К типам материалов» с карточки — токен навигации на родительский узел
+        "back": lambda: (callback(main.nav_token(rng.choice(paths)[:-1]), user()), None),
+        "search": lambda: (message(f"/search {rng.choice(SUBJECTS + [t.split()[0] for t in TEACHERS])}",
+                                   user()), None),
+        "stats": lambda: (message("/stats", ADMIN_ID), None),
+        "add": lambda: (message("нет", ADMIN_ID), prepare_add),
+        "edit": lambda: (message(f"правка {rng.random():.6f}", ADMIN_ID), prepare_edit),
+        "delete": lambda: (message("ДА", ADMIN_ID), prepare_delete),
+    }
+
+    async def feed(update: Update) -> float:
+        started = time.perf_counter()
+        await dp.feed_update(bot, update)
+        return time.perf_counter() - started
+
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    results: Dict[str, Any] = {}
+    try:
+        for name in SCENARIOS:
+            make = scenarios[name]
+            # сценарии админа идут через одну FSM-сессию — только последовательно
+            parallel = 1 if name in ("add", "edit", "delete") else concurrency
+            for _ in range(min(20, iterations)):
+                update, prepare = make()
+                if prepare is not None:
+                    await prepare()
+                await feed(update)
+
+            latencies: List[float] = []
+            wall = 0.0
+            if parallel == 1:
+                for _ in range(iterations):
+                    update, prepare = make()
+                    if prepare is not None:
+                        await prepare()
+                    latency = await feed(update)
+                    latencies.append(latency)
+                    wall += latency
+            else:
+                updates = [make()[0] for _ in range(iterations)]
+                slots = asyncio.Semaphore(parallel)
+
+                async def limited(update):
+                    async with slots:
+                        latencies.append(await feed(update))
+
+                started = time.perf_counter()
+                await asyncio.gather(*(limited(update) for update in updates))
+                wall = time.perf_counter() - started
+            results[name] = summarize(latencies, wall)
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+    return {"records": len(records), "backend": main.STORAGE_BACKEND,
+            "load_seconds": load_seconds, "scenarios": results}
+
+
+# -------------------------
+# Отчёт и сравнение
+# -------------------------
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def print_result(result: Dict[str, Any]):
+    print(f"\nЗаписей: {result['records']} ({result['backend']}), загрузка {result['load_seconds']:.2f} с")
+    print(f"{'сценарий':<14}{'оп/с':>10}{'p50, мс':>10}{'p99, мс':>10}{'макс, мс':>10}")
+    for name, stats in result["scenarios"].items():
+        print(f"{name:<14}{stats['ops_per_sec']:>10.0f}{stats['p50_ms']:>10.2f}"
+              f"{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Сценарии, у которых p50 вырос больше чем на tolerance (доля) относительно baseline"""
+    previous = {(run["records"], run["backend"]): run for run in baseline.get("results", [])}
+    regressions = []
+    for run in current["results"]:
+        old = previous.get((run["records"], run["backend"]))
+        if old is None:
+            continue
+        for name, stats in run["scenarios"].items():
+            before = old["scenarios"].get(name)
+            if not before or not before["p50_ms"]:
+                continue
+            change = stats["p50_ms"] / before["p50_ms"] - 1
+            if change > tolerance:
+                regressions.append(f"{run['records']} {name}: p50 {before['p50_ms']:.2f} -> "
+                                   f"{stats['p50_ms']:.2f} мс (+{change:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, nargs="+", default=[1000, 10_000, 100_000])
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--iterations", type=int, default=200, help="апдейтов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="одновременных апдейтов в пользовательских сценариях")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимый рост p50 (доля)")
+    args = parser.parse_args()
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": args.iterations,
+        "concurrency": args.concurrency,
+        "seed": args.seed,
+        "results": [],
+    }
+    context = multiprocessing.get_context("spawn")
+    for count in args.records:
+        with context.Pool(1) as pool:
+            result = pool.apply(measure, (count, args.backend, args.iterations, args.concurrency, args.seed))
+        print_result(result)
+        report["results"].append(result)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты: {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("\n⚠️ Замедление относительно", args.baseline)
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print(f"\nБез замедлений относительно {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""Нагрузочный тест по настоящему HTTP: бот в отдельном процессе и заглушка Bot API.
+
+    python -m benchmarks.loadtest [--mode polling|webhook] [--users 1000] [--duration 30]
+                                  [--api-latency 0.05] [--rate-limit 0.01] [--out loadtest.json]
+
+Заглушка отвечает на getMe, getUpdates, sendMessage, editMessageText,
+answerCallbackQuery, sendDocument (остальные методы — True). Пользователи
+ходят по дереву расписания: /start, затем нажимают случайную кнопку
+навигации из последнего полученного сообщения. Задержка — от появления
+апдейта (в очереди getUpdates или POST на webhook) до сообщения бота в
+этот чат. Бот запускается из main как обычно, только с BOT_API_SERVER,
+указывающим на заглушку.
+"""
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional
+
+from aiohttp import ClientSession, TCPConnector, web
+
+from benchmarks.handlers import summarize
+from benchmarks.synthetic import generate
+
+TOKEN = "123456:LOADTEST-TOKEN"
+BOT_ID = 123456
+SECRET = "loadtest-secret"
+WEBHOOK_PATH = "/webhook"
+# методы, которые заглушка может «ограничить» ответом 429
+LIMITED_METHODS = {"sendMessage", "editMessageText", "answerCallbackQuery", "sendDocument"}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# -------------------------
+# Заглушка Bot API
+# -------------------------
+class FakeBotAPI:
+    """Bot API в памяти: очередь апдейтов для getUpdates и приём ответов бота"""
+
+    def __init__(self, latency: float = 0.0, rate_limit: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rng = random.Random(seed)
+        self.calls: Counter = Counter()
+        self.limited = 0
+        self.polled = asyncio.Event()     # бот начал забирать апдейты
+        self._updates: deque = deque()
+        self._arrived = asyncio.Event()
+        self._message_ids = itertools.count(1)
+        self._waiters: Dict[int, asyncio.Future] = {}
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    # апдейты
+    def push(self, update: Dict[str, Any]):
+        self._updates.append(update)
+        self._arrived.set()
+
+    def expect(self, chat_id: int) -> asyncio.Future:
+        """Future с телом следующего sendMessage/editMessageText в этот чат"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id] = waiter
+        return waiter
+
+    async def _get_updates(self, params) -> List[Dict[str, Any]]:
+        self.polled.set()
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.popleft()
+        if not self._updates and timeout:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(itertools.islice(self._updates, limit))
+
+    # ответы бота
+    def _message(self, params) -> Dict[str, Any]:
+        chat_id = int(params.get("chat_id") or 0)
+        message_id = int(params.get("message_id") or next(self._message_ids))
+        message = {"message_id": message_id, "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "private"}, "text": params.get("text") or "x"}
+        waiter = self._waiters.pop(chat_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(params)
+        return message
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] += 1
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method in LIMITED_METHODS and self.rate_limit and self.rng.random() < self.rate_limit:
+            self.limited += 1
+            return web.json_response({"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                      "parameters": {"retry_after": 1}}, status=429)
+        if method == "getMe":
+            result: Any = {"id": BOT_ID, "is_bot": True, "first_name": "Load test", "username": "loadtest_bot"}
+        elif method in ("sendMessage", "editMessageText", "sendDocument"):
+            result = self._message(params)
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+# -------------------------
+# Пользователи
+# -------------------------
+class LoadTest:
+    def __init__(self, api: FakeBotAPI, mode: str, webhook_url: str, users: int, think: float,
+                 reply_timeout: float, seed: int):
+        self.api = api
+        self.mode = mode
+        self.webhook_url = webhook_url
+        self.users = users
+        self.think = think
+        self.reply_timeout = reply_timeout
+        self.rng = random.Random(seed)
+        self.ids = itertools.count(1)
+        self.latencies: List[float] = []
+        self.timeouts = 0
+        self.waiting = 0        # запросы, ожидающие ответа прямо сейчас
+        self.in_flight = 0      # ... и в момент окончания замера
+        self.recording = False
+        self._http: Optional[ClientSession] = None
+
+    def _message_update(self, chat_id: int, text: str) -> Dict[str, Any]:
+        user = {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"}
+        return {"update_id": next(self.ids), "message": {
+            "message_id": next(self.ids), "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+            "from": user, "text": text}}
+
+    def _callback_update(self, chat_id: int, message_id: int, data: str) -> Dict[str, Any]:
+        user = {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"}
+        return {"update_id": next(self.ids), "callback_query": {
+            "id": str(next(self.ids)), "from": user, "chat_instance": str(chat_id), "data": data,
+            "message": {"message_id": message_id, "date": int(time.time()),
+                        "chat": {"id": chat_id, "type": "private"}, "text": "x"}}}
+
+    async def _deliver(self, update: Dict[str, Any]):
+        if self.mode == "polling":
+            self.api.push(update)
+            return
+        async with self._http.post(self.webhook_url, json=update,
+                                   headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}) as response:
+            await response.read()
+
+    async def _request(self, chat_id: int, update: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        waiter = self.api.expect(chat_id)
+        started = time.perf_counter()
+        await self._deliver(update)
+        self.waiting += 1
+        try:
+            reply = await asyncio.wait_for(waiter, self.reply_timeout)
+        except asyncio.TimeoutError:
+            if self.recording:
+                self.timeouts += 1
+            return None
+        finally:
+            self.waiting -= 1
+        if self.recording:
+            self.latencies.append(time.perf_counter() - started)
+        return reply
+
+    def _buttons(self, reply: Dict[str, Any]) -> List[str]:
+        try:
+            markup = json.loads(reply.get("reply_markup") or "{}")
+        except ValueError:
+            return []
+        return [button["callback_data"] for row in markup.get("inline_keyboard", []) for button in row
+                if button.get("callback_data", "").startswith("nav:")]
+
+    async def user(self, chat_id: int, stop: float):
+        await asyncio.sleep(self.rng.random() * min(1.0, self.think or 1.0))
+        buttons: List[str] = []
+        message_id = 0
+        while time.monotonic() < stop:
+            if not buttons or self.rng.random() < 0.05:
+                reply = await self._request(chat_id, self._message_update(chat_id, "/start"))
+                message_id = 0
+            else:
+                reply = await self._request(chat_id, self._callback_update(chat_id, message_id,
+                                                                          self.rng.choice(buttons)))
+            if reply is None:
+                buttons = []
+                continue
+            message_id = int(reply.get("message_id") or message_id or 1)
+            buttons = self._buttons(reply)
+            if self.think:
+                await asyncio.sleep(self.rng.random() * self.think)
+
+    async def run(self, duration: float, warmup: float) -> float:
+        self._http = ClientSession(connector=TCPConnector(limit=200))
+        try:
+            started = time.monotonic()
+            stop = started + warmup + duration
+            users = [asyncio.create_task(self.user(chat_id, stop)) for chat_id in range(1000, 1000 + self.users)]
+            await asyncio.sleep(warmup)
+            self.recording = True
+            measured = time.monotonic()
+            await asyncio.sleep(stop - measured)
+            # ответы и таймауты после stop не считаются: иначе хвост ожидания до
+            # reply_timeout попадает во время замера и занижает пропускную способность
+            self.recording = False
+            self.in_flight = self.waiting
+            for task in users:
+                task.cancel()
+            await asyncio.gather(*users, return_exceptions=True)
+            return stop - measured
+        finally:
+            await self._http.close()
+
+
+# -------------------------
+# Процесс бота
+# -------------------------
+def serve_bot(args: argparse.Namespace):
+    """Запуск бота (в дочернем процессе) против заглушки Bot API"""
+    from benchmarks.handlers import _configure
+
+    os.chdir(args.workdir)
+    records = [dict(record, id=i) for i, record in enumerate(generate(args.records, args.seed), 1)]
+    with open("schedule_data.json", "w", encoding="utf-8") as f:
+        json.dump(records, f, ensure_ascii=False)
+    _configure(args.backend)
+    import config
+    config.BOT_TOKEN = TOKEN
+    config.BOT_API_SERVER = args.api
+
+    import main
+    if args.mode == "polling":
+        asyncio.run(main.run_polling())
+    else:
+        main.run_webhook(main.parse_args(["--mode", "webhook", "--host", "127.0.0.1", "--port", str(args.port),
+                                          "--path", WEBHOOK_PATH, "--secret", SECRET]))
+
+
+async def _wait_port(port: int, process: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Бот завершился при запуске")
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Бот не начал принимать webhook")
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    api = FakeBotAPI(args.api_latency, args.rate_limit, args.seed)
+    runner = web.AppRunner(api.app(), access_log=None)
+    await runner.setup()
+    api_port = _free_port()
+    await web.TCPSite(runner, "127.0.0.1", api_port).start()
+
+    workdir = tempfile.mkdtemp(prefix="loadtest")
+    bot_port = _free_port()
+    command = [sys.executable, "-m", "benchmarks.loadtest", "--serve-bot", "--workdir", workdir,
+               "--api", f"http://127.0.0.1:{api_port}", "--mode", args.mode, "--port", str(bot_port),
+               "--records", str(args.records), "--backend", args.backend, "--seed", str(args.seed)]
+    with open(os.path.join(workdir, "bot.log"), "wb") as log:
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT,
+                                   cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        if args.mode == "polling":
+            await asyncio.wait_for(api.polled.wait(), 60)
+        else:
+            await _wait_port(bot_port, process)
+        test = LoadTest(api, args.mode, f"http://127.0.0.1:{bot_port}{WEBHOOK_PATH}", args.users,
+                        args.think, args.reply_timeout, args.seed)
+        wall = await test.run(args.duration, args.warmup)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        await runner.cleanup()
+
+    result = summarize(test.latencies, wall) if test.latencies else {"count": 0, "ops_per_sec": 0.0}
+    result.update({"timeouts": test.timeouts, "in_flight": test.in_flight, "rate_limited": api.limited, "api_calls": dict(api.calls),
+                   "bot_log": os.path.join(workdir, "bot.log")})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--users", type=int, default=1000, help="одновременных пользователей")
+    parser.add_argument("--duration", type=float, default=30.0, help="секунд замера")
+    parser.add_argument("--warmup", type=float, default=5.0, help="секунд разгона без замера")
+    parser.add_argument("--think", type=float, default=0.5, help="пауза пользователя между нажатиями, до N секунд")
+    parser.add_argument("--reply-timeout", type=float, default=10.0, help="сколько ждать ответа бота")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, секунд")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="доля ответов 429 на отправку")
+    parser.add_argument("--records", type=int, default=10_000)
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="loadtest_results.json")
+    # внутренние флаги процесса бота
+    parser.add_argument("--serve-bot", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--api", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_bot:
+        serve_bot(args)
+        return
+
+    result = asyncio.run(run(args))
+    report = {"created": datetime.datetime.now().isoformat(timespec="seconds"),
+              "settings": {key: value for key, value in vars(args).items()
+                           if key not in ("serve_bot", "workdir", "api", "port", "out")},
+              "result": result}
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"Режим: {args.mode}, пользователей: {args.users}, записей: {args.records}")
+    print(f"Апдейтов с ответом: {result['count']} ({result['ops_per_sec']:.0f} в секунду)")
+    if result["count"]:
+        print(f"Задержка p50 / p99 / макс: {result['p50_ms']:.1f} / {result['p99_ms']:.1f} / "
+              f"{result['max_ms']:.1f} мс")
+    print(f"Без ответа: {result['timeouts']}, ждали ответа при остановке: {result['in_flight']}, "
+          f"ответов 429: {result['rate_limited']}")
+    print(f"Вызовы Bot API: {result['api_calls']}")
+    print(f"Результаты: {args.out}, лог бота: {result['bot_log']}")
+
+
+if __name__ == "__main__":
+    main()
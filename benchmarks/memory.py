@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Память на запись: словари из json.load против Record со __slots__ и интернированием.
+
+    python -m benchmarks.memory [--records 100000]
+"""
+
+import argparse
+import gc
+import json
+import tracemalloc
+
+from benchmarks.synthetic import generate
+from records import Record
+
+
+def _traced() -> int:
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def measure(count: int) -> dict:
+    payload = json.dumps(generate(count), ensure_ascii=False)
+
+    tracemalloc.start()
+    base = _traced()
+    dicts = json.loads(payload)
+    dict_bytes = _traced() - base
+
+    records = [Record.from_dict(item) for item in dicts]
+    del dicts
+    record_bytes = _traced() - base
+    tracemalloc.stop()
+
+    assert len(records) == count
+    return {
+        "records": count,
+        "dict_bytes_per_record": dict_bytes / count,
+        "slots_bytes_per_record": record_bytes / count,
+        "ratio": dict_bytes / record_bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=100_000)
+    args = parser.parse_args()
+
+    result = measure(args.records)
+    print(f"Записей: {result['records']}")
+    print(f"dict:   {result['dict_bytes_per_record']:.0f} байт/запись")
+    print(f"Record: {result['slots_bytes_per_record']:.0f} байт/запись")
+    print(f"Экономия: x{result['ratio']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Генератор синтетической базы расписания заданного размера."""
+
+import random
+from typing import Any, Dict, List
+
+CLASSES = [f"{number}{letter}" for number in range(5, 12) for letter in "АБВГД"]
+SEMESTERS = ["1", "2"]
+SUBJECTS = [
+    "Математика", "Алгебра", "Геометрия", "Физика", "Химия", "Биология", "География",
+    "История", "Обществознание", "Русский язык", "Литература", "Английский язык",
+    "Немецкий язык", "Информатика", "Физкультура", "ОБЖ", "Музыка", "ИЗО", "Технология",
+    "Астрономия",
+]
+EXAMS = ["Зачёт", "Семестровая", "Контрольная", "Экзамен", "Тест"]
+MATERIALS = ["Формулы", "Таблицы", "Конспекты", "Билеты", "Презентации", "Задачник", "Словарь"]
+TEACHERS = ["Иванов И.И.", "Петрова А.С.", "Сидоров П.П.", "Кузнецова Е.В.", "Смирнов О.Н."]
+
+
+def generate(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Детерминированная база из count записей в JSON-схеме бота"""
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        subject = rng.choice(SUBJECTS)
+        records.append({
+            "класс": rng.choice(CLASSES),
+            "полугодие": rng.choice(SEMESTERS),
+            "предмет": subject,
+            "экзамен": rng.choice(EXAMS),
+            "тип_материалов": rng.choice(MATERIALS),
+            "информация": (
+                f"Учебник: {subject} (издание {rng.randint(2010, 2025)})\n"
+                f"Учитель: {rng.choice(TEACHERS)}\n"
+                f"Кабинет: {rng.randint(100, 450)}"
+            ),
+            "ссылка": f"https://example.com/materials/{i}" if rng.random() < 0.7 else "",
+        })
+    return records
@@ -0,0 +1,568 @@
+# -*- coding: utf-8 -*-
+"""Рассылки: реестр пользователей бота, подписки на разделы и отправка с ограничением скорости."""
+
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from aiogram.exceptions import (
+    TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from schedule_index import LEVELS, node_id
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscribers (
+    chat_id INTEGER PRIMARY KEY,
+    active INTEGER NOT NULL DEFAULT 1,
+    updated REAL NOT NULL
+);
+-- рассылки; cursor — все получатели с chat_id <= cursor уже обработаны
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL,
+    sender INTEGER NOT NULL,
+    message_id INTEGER,
+    recipients TEXT,
+    total INTEGER NOT NULL DEFAULT 0,
+    cursor INTEGER,
+    sent INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'running',
+    created REAL NOT NULL,
+    finished REAL
+);
+-- подписки на узлы дерева навигации (node_id из schedule_index)
+CREATE TABLE IF NOT EXISTS subscriptions (
+    node_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (node_id, chat_id)
+);
+"""
+
+# Итог отправки одного сообщения
+SENT, BLOCKED, FAILED = "sent", "blocked", "failed"
+# Отправитель служебных рассылок (уведомления подписчикам): отчёт не отправляется
+SYSTEM_SENDER = 0
+
+
+# -------------------------
+# Реестр
+# -------------------------
+class SubscriberRegistry:
+    """Чаты, которые писали боту, и история рассылок (SQLite).
+
+    Все известные chat_id держатся в памяти, поэтому отметка о пользователе
+    на каждом апдейте — проверка по словарю. Новые и изменённые записи
+    копятся и пишутся пачкой раз в ``flush_interval`` секунд.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        # одно соединение и один поток, как в FSM-хранилище
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="broadcast")
+        self._conn = self._executor.submit(self._open).result()
+        rows = self._executor.submit(
+            lambda: self._conn.execute("SELECT chat_id, active FROM subscribers").fetchall()
+        ).result()
+        self._known: Dict[int, bool] = {chat_id: bool(active) for chat_id, active in rows}
+        self._dirty: Dict[int, bool] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        # инвертированный индекс подписок: узел -> чаты, и обратно для списка подписок чата
+        self._node_chats: Dict[int, Set[int]] = {}
+        self._chat_nodes: Dict[int, Set[int]] = {}
+        self._paths: Dict[int, Tuple[str, ...]] = {}
+        rows = self._executor.submit(
+            lambda: self._conn.execute("SELECT node_id, chat_id, path FROM subscriptions").fetchall()
+        ).result()
+        for nid, chat_id, path in rows:
+            self._add_subscription(nid, chat_id, tuple(json.loads(path)))
+        # при нескольких воркерах: сообщить остальным процессам об изменении (см. apply_peer)
+        self.publish: Optional[Callable[[Dict[str, Any]], None]] = None
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # подписчики
+    def _set(self, chat_id: int, active: bool):
+        if self._known.get(chat_id) == active:
+            return
+        self._known[chat_id] = active
+        self._dirty[chat_id] = active
+        if self._flusher is None:
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_worker())
+        if self.publish is not None:
+            self.publish({"type": "chat", "chat": chat_id, "active": active})
+
+    def touch(self, chat_id: int):
+        """Чат пишет боту: запоминаем его (или возвращаем в рассылку)"""
+        self._set(chat_id, True)
+
+    def deactivate(self, chat_id: int):
+        """Бот заблокирован или чат удалён — больше не отправляем"""
+        self._set(chat_id, False)
+
+    def active_chats(self) -> List[int]:
+        return sorted(chat_id for chat_id, active in self._known.items() if active)
+
+    def __len__(self) -> int:
+        return sum(self._known.values())
+
+    async def _flush_worker(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Ошибка сохранения подписчиков: {e}")
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        batch, self._dirty = list(self._dirty.items()), {}
+        await self._run(self._write, batch, time.time())
+
+    def _write(self, batch, now: float):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO subscribers (chat_id, active, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(chat_id) DO UPDATE SET active = excluded.active, updated = excluded.updated",
+                [(chat_id, int(active), now) for chat_id, active in batch],
+            )
+
+    # подписки
+    def _add_subscription(self, nid: int, chat_id: int, path: Tuple[str, ...]):
+        self._node_chats.setdefault(nid, set()).add(chat_id)
+        self._chat_nodes.setdefault(chat_id, set()).add(nid)
+        self._paths[nid] = path
+
+    def _remove_subscription(self, nid: int, chat_id: int) -> bool:
+        chats = self._node_chats.get(nid)
+        if not chats or chat_id not in chats:
+            return False
+        chats.discard(chat_id)
+        if not chats:
+            del self._node_chats[nid]
+            del self._paths[nid]
+        nodes = self._chat_nodes[chat_id]
+        nodes.discard(nid)
+        if not nodes:
+            del self._chat_nodes[chat_id]
+        return True
+
+    def is_subscribed(self, chat_id: int, path) -> bool:
+        return chat_id in self._node_chats.get(node_id(tuple(path)), ())
+
+    def subscriptions(self, chat_id: int) -> List[Tuple[str, ...]]:
+        """Пути узлов, на которые подписан чат"""
+        return sorted(self._paths[nid] for nid in self._chat_nodes.get(chat_id, ()))
+
+    async def subscribe(self, chat_id: int, path) -> bool:
+        """Подписать чат на узел; False — подписка уже была"""
+        path = tuple(path)
+        nid = node_id(path)
+        if chat_id in self._node_chats.get(nid, ()):
+            return False
+        self._add_subscription(nid, chat_id, path)
+        self.touch(chat_id)
+        await self._run(self._write_subscription, nid, chat_id, path)
+        if self.publish is not None:
+            self.publish({"type": "subscribe", "chat": chat_id, "path": list(path)})
+        return True
+
+    def _write_subscription(self, nid: int, chat_id: int, path: Tuple[str, ...]):
+        with self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO subscriptions (node_id, chat_id, path) VALUES (?, ?, ?)",
+                               (nid, chat_id, json.dumps(path, ensure_ascii=False)))
+
+    async def unsubscribe(self, chat_id: int, path) -> bool:
+        """Отписать чат от узла; False — подписки не было"""
+        nid = node_id(tuple(path))
+        if not self._remove_subscription(nid, chat_id):
+            return False
+        await self._run(self._delete_subscription, nid, chat_id)
+        if self.publish is not None:
+            self.publish({"type": "unsubscribe", "chat": chat_id, "path": list(path)})
+        return True
+
+    def _delete_subscription(self, nid: int, chat_id: int):
+        with self._conn:
+            self._conn.execute("DELETE FROM subscriptions WHERE node_id = ? AND chat_id = ?", (nid, chat_id))
+
+    def apply_peer(self, message: Dict[str, Any]):
+        """Изменение из другого воркера: оно уже в базе, обновляем только память"""
+        chat_id = message["chat"]
+        if message["type"] == "chat":
+            self._known[chat_id] = message["active"]
+            self._dirty.pop(chat_id, None)
+        elif message["type"] == "subscribe":
+            path = tuple(message["path"])
+            self._add_subscription(node_id(path), chat_id, path)
+            self._known[chat_id] = True
+        elif message["type"] == "unsubscribe":
+            self._remove_subscription(node_id(tuple(message["path"])), chat_id)
+
+    def subscribers_of(self, record) -> Set[int]:
+        """Активные чаты, подписанные на любой узел на пути записи (от класса до карточки)"""
+        path = tuple(record[level] for level in LEVELS)
+        chats: Set[int] = set()
+        for depth in range(1, len(path) + 1):
+            chats.update(self._node_chats.get(node_id(path[:depth]), ()))
+        return {chat_id for chat_id in chats if self._known.get(chat_id, True)}
+
+    # рассылки
+    async def create_job(self, job: "BroadcastJob"):
+        def run():
+            with self._conn:
+                cursor = self._conn.execute(
+                    "INSERT INTO broadcasts (text, sender, message_id, recipients, total, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (job.text, job.sender, job.message_id,
+                     None if job.recipients is None else json.dumps(job.recipients), job.total, job.created),
+                )
+            return cursor.lastrowid
+        job.id = await self._run(run)
+
+    async def save_job(self, job: "BroadcastJob"):
+        def run():
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE broadcasts SET cursor = ?, sent = ?, blocked = ?, failed = ?, status = ?, "
+                    "finished = ? WHERE id = ?",
+                    (job.cursor, job.sent, job.blocked, job.failed, job.status, job.finished, job.id),
+                )
+        await self._run(run)
+
+    async def unfinished_jobs(self) -> List["BroadcastJob"]:
+        rows = await self._run(lambda: self._conn.execute(
+            "SELECT id, text, sender, message_id, recipients, total, cursor, sent, blocked, failed, created "
+            "FROM broadcasts WHERE status = 'running' ORDER BY id").fetchall())
+        jobs = []
+        for job_id, text, sender, message_id, recipients, total, cursor, sent, blocked, failed, created in rows:
+            job = BroadcastJob(text, sender, message_id, None if recipients is None else json.loads(recipients))
+            job.id, job.total, job.cursor, job.created = job_id, total, cursor, created
+            job.sent, job.blocked, job.failed = sent, blocked, failed
+            jobs.append(job)
+        return jobs
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        if self._conn is None:
+            return
+        await self.flush()
+        await self._run(self._conn.close)
+        self._conn = None
+        self._executor.shutdown(wait=True)
+
+
+# -------------------------
+# Ограничение скорости
+# -------------------------
+class TokenBucket:
+    """Не больше rate сообщений в секунду в среднем, всплеск — до capacity"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Telegram попросил подождать (RetryAfter): останавливаем всех отправителей"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self):
+        # под блокировкой ждущие получают токены по очереди
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ChatRateLimiter:
+    """Не чаще сообщения в interval секунд в личный чат и в group_interval — в группу"""
+
+    def __init__(self, interval: float = 1.0, group_interval: float = 3.0, max_chats: int = 10_000):
+        self.interval = interval
+        self.group_interval = group_interval
+        self.max_chats = max_chats
+        self._next: Dict[int, float] = {}
+
+    async def wait(self, chat_id: int):
+        now = time.monotonic()
+        at = self._next.get(chat_id, 0.0)
+        # слот занимаем до ожидания, чтобы параллельные отправки в тот же чат встали за ним
+        self._next[chat_id] = max(at, now) + (self.group_interval if chat_id < 0 else self.interval)
+        if len(self._next) > self.max_chats:
+            self._next = {chat: moment for chat, moment in self._next.items() if moment > now}
+        if at > now:
+            await asyncio.sleep(at - now)
+
+
+# -------------------------
+# Рассылка
+# -------------------------
+class BroadcastJob:
+    """Состояние одной рассылки (хранится в таблице broadcasts)"""
+
+    def __init__(self, text: str, sender: int, message_id: Optional[int] = None,
+                 recipients: Optional[List[int]] = None):
+        self.id: Optional[int] = None
+        self.text = text
+        self.sender = sender
+        self.message_id = message_id
+        self.recipients = recipients        # None — все активные пользователи
+        self.total = 0
+        self.cursor: Optional[int] = None
+        self.sent = self.blocked = self.failed = 0
+        self.status = "running"
+        self.created = time.time()
+        self.finished: Optional[float] = None
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.blocked + self.failed
+
+    def count(self, outcome: str):
+        if outcome == SENT:
+            self.sent += 1
+        elif outcome == BLOCKED:
+            self.blocked += 1
+        else:
+            self.failed += 1
+
+
+ReportCallback = Callable[[BroadcastJob, bool], Awaitable[None]]
+
+
+class Broadcaster:
+    """Отправка рассылок: общий token bucket, лимит на чат, concurrency воркеров.
+
+    Получатели обходятся по возрастанию chat_id; в базу периодически пишется
+    курсор — наибольший chat_id, до которого всё уже отправлено. После
+    перезапуска незавершённые рассылки продолжаются с курсора (повторно
+    могут получить сообщение лишь те, что были в отправке в момент остановки).
+    """
+
+    def __init__(self, bot, registry: SubscriberRegistry, rate: float = 25.0, concurrency: int = 10,
+                 max_retries: int = 3, progress_interval: float = 5.0,
+                 report: Optional[ReportCallback] = None):
+        self.bot = bot
+        self.registry = registry
+        self.bucket = TokenBucket(rate)
+        self.chat_limiter = ChatRateLimiter()
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.progress_interval = progress_interval
+        self.report = report
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    async def start(self):
+        """Продолжить рассылки, прерванные остановкой бота"""
+        for job in await self.registry.unfinished_jobs():
+            self._spawn(job)
+
+    async def close(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def broadcast(self, text: str, sender: int, message_id: Optional[int] = None,
+                        recipients: Optional[Iterable[int]] = None) -> BroadcastJob:
+        """Запустить рассылку в фоне; прогресс и итог уходят в report"""
+        job = BroadcastJob(text, sender, message_id, None if recipients is None else sorted(set(recipients)))
+        job.total = len(self._recipients(job))
+        await self.registry.create_job(job)
+        self._spawn(job)
+        return job
+
+    def _spawn(self, job: BroadcastJob):
+        task = asyncio.get_running_loop().create_task(self._run(job))
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.id, None))
+
+    def _recipients(self, job: BroadcastJob) -> List[int]:
+        chats = self.registry.active_chats() if job.recipients is None else job.recipients
+        if job.cursor is None:
+            return chats
+        return [chat_id for chat_id in chats if chat_id > job.cursor]
+
+    async def send(self, chat_id: int, text: str, **kwargs) -> str:
+        """Одно сообщение с учётом лимитов и повторов; возвращает SENT/BLOCKED/FAILED"""
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            await self.chat_limiter.wait(chat_id)
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+                return SENT
+            except TelegramRetryAfter as e:
+                self.bucket.pause(e.retry_after)
+            except TelegramForbiddenError:
+                self.registry.deactivate(chat_id)
+                return BLOCKED
+            except TelegramBadRequest as e:
+                if "chat not found" in e.message.lower():
+                    self.registry.deactivate(chat_id)
+                    return BLOCKED
+                return FAILED
+            except (TelegramNetworkError, TelegramServerError):
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except TelegramAPIError:
+                return FAILED
+        return FAILED
+
+    async def _run(self, job: BroadcastJob):
+        queue: asyncio.Queue = asyncio.Queue(self.concurrency * 2)
+        in_flight = set()
+        dispatched = job.cursor
+        last_report = time.monotonic()
+
+        def cursor():
+            return min(in_flight) - 1 if in_flight else dispatched
+
+        async def worker():
+            nonlocal last_report
+            while True:
+                chat_id = await queue.get()
+                if chat_id is None:
+                    return
+                outcome = await self.send(chat_id, job.text)
+                # прерванная отправка остаётся в in_flight и повторится после перезапуска
+                in_flight.discard(chat_id)
+                job.count(outcome)
+                if time.monotonic() - last_report >= self.progress_interval:
+                    last_report = time.monotonic()
+                    job.cursor = cursor()
+                    await self.registry.save_job(job)
+                    await self._report(job, False)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            for chat_id in self._recipients(job):
+                in_flight.add(chat_id)
+                await queue.put(chat_id)
+                dispatched = chat_id
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            job.status, job.finished = "done", time.time()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # при остановке бота сохраняем курсор, чтобы продолжить после запуска
+            job.cursor = cursor()
+            await self.registry.save_job(job)
+        await self._report(job, True)
+
+    async def _report(self, job: BroadcastJob, final: bool):
+        if self.report is None or job.sender == SYSTEM_SENDER:
+            return
+        try:
+            await self.report(job, final)
+        except Exception as e:
+            print(f"Ошибка отчёта о рассылке #{job.id}: {e}")
+
+
+# -------------------------
+# Уведомления подписчикам
+# -------------------------
+class ChangeNotifier:
+    """Уведомления об изменениях в разделах, на которые подписаны пользователи.
+
+    Слушатель изменений хранилища: новые и изменённые записи копятся delay
+    секунд (импорт тысяч записей — одно сообщение, а не тысячи), затем чаты
+    с одинаковым набором изменений получают общую рассылку через Broadcaster.
+    Получатели ищутся по индексу подписок — без обхода всех пользователей.
+    """
+
+    def __init__(self, registry: SubscriberRegistry, broadcaster: Broadcaster,
+                 delay: float = 5.0, max_lines: int = 10):
+        self.registry = registry
+        self.broadcaster = broadcaster
+        self.delay = delay
+        self.max_lines = max_lines
+        self._pending: Dict[int, Dict[int, Tuple[str, Tuple[str, ...]]]] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+    def record_changed(self, old, new):
+        """Слушатель repo.add_listener: удаления не рассылаются"""
+        if new is None:
+            return
+        chats = self.registry.subscribers_of(new)
+        if old is not None:
+            chats |= self.registry.subscribers_of(old)
+        if not chats:
+            return
+        change = ("added" if old is None else "edited", tuple(new[level] for level in LEVELS))
+        for chat_id in chats:
+            changes = self._pending.setdefault(chat_id, {})
+            # запись, добавленную в этом же окне, по-прежнему показываем как новую
+            kind = changes[new.id][0] if new.id in changes else change[0]
+            changes[new.id] = (kind, change[1])
+        if self._flusher is None:
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self._flusher = None
+        await self.flush()
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        groups: Dict[Tuple, List[int]] = {}
+        for chat_id, changes in pending.items():
+            groups.setdefault(tuple(sorted(changes.items())), []).append(chat_id)
+        for changes, chats in groups.items():
+            try:
+                await self.broadcaster.broadcast(self.format(changes), SYSTEM_SENDER, recipients=chats)
+            except Exception as e:
+                print(f"Ошибка рассылки уведомлений подписчикам: {e}")
+
+    def format(self, changes) -> str:
+        lines = []
+        for _, (kind, path) in changes[:self.max_lines]:
+            mark = "🆕" if kind == "added" else "✏️"
+            lines.append(f"{mark} {' / '.join(path)}")
+        if len(changes) > self.max_lines:
+            lines.append(f"… и ещё {len(changes) - self.max_lines}")
+        return "🔔 Обновления в разделах, на которые вы подписаны:\n\n" + "\n".join(lines)
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        # накопленное ставим в рассылку: незавершённая продолжится после запуска
+        await self.flush()
@@ -2,4 +2,64 @@
 BOT_TOKEN = ""
 
 # Список ID администраторов (замените на свои ID)
-ADMIN_IDS = []  # Добавьте сюда ID администраторов
\ No newline at end of file
+ADMIN_IDS = []  # Добавьте сюда ID администраторов
+
+# Хранилище данных: "json" (файл schedule_data.json) или "sqlite" (для больших баз,
+# данные не загружаются целиком в память)
+STORAGE_BACKEND = "json"
+SQLITE_PATH = "schedule_data.db"
+
+# Хранилище состояний диалогов (FSM): "sqlite" — переживает перезапуск бота,
+# "memory" — как раньше, всё теряется при остановке
+FSM_STORAGE = "sqlite"
+FSM_DB_PATH = "fsm_state.db"
+FSM_SESSION_TTL = 7 * 24 * 3600  # секунд бездействия, после которых сессия удаляется
+
+# Резервные копии (/backup, /restore): сжатие блоков — "gzip", "lzma" или "none";
+# период автоматических копий в секундах (0 — только вручную) и ротация снимков
+BACKUP_COMPRESSION = "gzip"
+BACKUP_INTERVAL = 3600
+BACKUP_KEEP_LAST = 10     # последних снимков
+BACKUP_KEEP_HOURLY = 24   # плюс по одному за каждый из стольких последних часов
+BACKUP_KEEP_DAILY = 30    # и за каждый из стольких последних дней
+
+# Рассылки (/notify): база подписчиков, сообщений в секунду (лимит Telegram ~30)
+# и сколько сообщений отправляется параллельно
+BROADCAST_DB_PATH = "broadcast.db"
+BROADCAST_RATE = 25
+BROADCAST_CONCURRENCY = 10
+NOTIFY_DELAY = 5.0        # секунд, за которые изменения собираются в одно уведомление подписчикам
+
+# Получение апдейтов: "polling" (по умолчанию) или "webhook" — aiohttp-сервер за reverse proxy.
+# Всё можно переопределить при запуске: python main.py --mode webhook --port 8080 ...
+RUN_MODE = "polling"
+WEBHOOK_HOST = "127.0.0.1"
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_URL = ""      # внешний адрес, например "https://bot.example.com"; пусто — setWebhook не вызывается
+WEBHOOK_SECRET = ""   # секрет X-Telegram-Bot-Api-Secret-Token; пусто при заданном URL — случайный на запуск
+BOT_API_SERVER = ""   # свой сервер Bot API, например "http://127.0.0.1:8081"; пусто — api.telegram.org
+
+# Несколько процессов webhook-сервера на одном порту (SO_REUSEPORT); нужны RUN_MODE = "webhook",
+# STORAGE_BACKEND = "sqlite" и FSM_STORAGE = "sqlite". Воркеры сообщают друг другу об изменениях
+# через unix-сокеты в каталоге IPC_DIR
+WORKERS = 1
+IPC_DIR = "ipc"
+
+# Бэкенд "json": как часто (в секундах) проверять, не заменили ли schedule_data.json
+# вне бота; изменённый файл перечитывается без перезапуска. 0 — не следить
+DATA_RELOAD_INTERVAL = 2.0
+
+# Метрики (время обработчиков, FSM, записи на диск) в формате Prometheus:
+# http://METRICS_HOST:METRICS_PORT/metrics; краткая сводка — команда /perf. 0 — не запускать
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
+
+# Защита от флуда: сколько апдейтов в секунду (и какой всплеск подряд) допускается от одного
+# пользователя — отдельно для сообщений и для нажатий кнопок; 0 — без ограничения.
+# Повторное нажатие той же кнопки в течение DOUBLE_TAP_WINDOW секунд отбрасывается
+THROTTLE_MESSAGE_RATE = 1.0
+THROTTLE_MESSAGE_BURST = 5
+THROTTLE_CALLBACK_RATE = 3.0
+THROTTLE_CALLBACK_BURST = 10
+DOUBLE_TAP_WINDOW = 1.0
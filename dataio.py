@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""Импорт и экспорт данных: потоковое чтение файлов, пакетная проверка, upsert и выгрузка в CSV."""
+
+import codecs
+import csv
+import io
+import json
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from records import FIELDS, ID_FIELD, parse_id
+from schedule_index import LEVELS
+
+# Поля, без которых запись не принимается (ссылка необязательна)
+REQUIRED_FIELDS = LEVELS + ("информация",)
+
+IMPORT_MODES = ("merge", "replace")
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 10
+
+# Столбцы CSV: id и поля записи в порядке схемы JSON
+CSV_COLUMNS = (ID_FIELD,) + FIELDS
+# Excel с русской локалью делит столбцы точкой с запятой
+CSV_DELIMITER = ";"
+CSV_DELIMITERS = (";", ",", "\t")
+
+
+# -------------------------
+# Чтение
+# -------------------------
+class JsonRecordReader:
+    """Потоковое чтение записей из JSON-массива или NDJSON (объект на строку).
+
+    Файл читается кусками по ``chunk_size`` байт, в памяти — только текущий
+    кусок и готовая пачка записей, поэтому размер файла не важен.
+    """
+
+    def __init__(self, path: str, chunk_size: int = 64 * 1024):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.size = os.path.getsize(path)
+        self.bytes_read = 0
+        self.count = 0
+        self._fh = open(path, "rb")
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._json = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._started = False
+        self._array = False
+        self._done = False
+
+    def close(self):
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _fill(self):
+        chunk = self._fh.read(self.chunk_size)
+        self.bytes_read += len(chunk)
+        self._eof = not chunk
+        self._buf = self._buf[self._pos:] + self._decoder.decode(chunk, final=self._eof)
+        self._pos = 0
+
+    def read_batch(self, size: int) -> List[Any]:
+        """Следующие size записей (пустой список — файл закончился)"""
+        batch: List[Any] = []
+        while len(batch) < size and not self._done:
+            buf, pos = self._buf, self._pos
+            while pos < len(buf) and (buf[pos].isspace() or (self._array and buf[pos] == ",")):
+                pos += 1
+            self._pos = pos
+            if pos >= len(buf):
+                if not self._eof:
+                    self._fill()
+                elif self._array:
+                    raise ValueError("Файл оборван: нет закрывающей скобки ]")
+                else:
+                    self._done = True
+                continue
+
+            if not self._started:
+                self._started = True
+                if buf[pos] == "[":
+                    self._array = True
+                    self._pos += 1
+                    continue
+            if self._array and buf[pos] == "]":
+                self._done = True
+                break
+
+            try:
+                item, end = self._json.raw_decode(buf, pos)
+            except ValueError as e:
+                # запись могла не поместиться в прочитанный кусок
+                if not self._eof:
+                    self._fill()
+                    continue
+                raise ValueError(f"Ошибка JSON в записи #{self.count + 1}: {e}") from None
+            if end == len(buf) and not self._eof:
+                # число на границе куска может быть неполным — дочитываем и разбираем заново
+                self._fill()
+                continue
+            batch.append(item)
+            self._pos = end
+            self.count += 1
+        return batch
+
+
+def _csv_column(name: str) -> str:
+    """«Тип материалов» в заголовке таблицы -> тип_материалов"""
+    return name.strip().casefold().replace(" ", "_")
+
+
+class CsvRecordReader:
+    """Потоковое чтение записей из CSV с заголовком (выгрузка из таблицы).
+
+    Разделитель (; , или табуляция) определяется по строке заголовка, названия
+    столбцов — без учёта регистра. Пустые строки таблицы пропускаются.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.count = 0
+        self._raw = open(path, "rb")
+        self._fh = io.TextIOWrapper(self._raw, encoding="utf-8-sig", newline="")
+        try:
+            header_line = self._fh.readline()
+            delimiter = max(CSV_DELIMITERS, key=header_line.count)
+            self._rows = csv.reader(self._fh, delimiter=delimiter)
+            self._columns = [_csv_column(name) for name in next(csv.reader([header_line], delimiter=delimiter), [])]
+        except (UnicodeDecodeError, csv.Error) as e:
+            self.close()
+            raise ValueError(f"Не удалось прочитать заголовок CSV: {e}") from None
+        missing = [field for field in REQUIRED_FIELDS if field not in self._columns]
+        if missing:
+            self.close()
+            raise ValueError("В CSV нет столбцов: " + ", ".join(missing))
+
+    @property
+    def bytes_read(self) -> int:
+        return self._raw.tell()
+
+    def close(self):
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read_batch(self, size: int) -> List[Any]:
+        """Следующие size записей (пустой список — файл закончился)"""
+        batch: List[Any] = []
+        try:
+            for row in self._rows:
+                if not any(cell.strip() for cell in row):
+                    continue
+                # короткие строки дополняются пустыми ячейками, лишние ячейки отбрасываются
+                batch.append(dict(zip(self._columns, row + [""] * (len(self._columns) - len(row)))))
+                self.count += 1
+                if len(batch) >= size:
+                    break
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise ValueError(f"Ошибка CSV после записи #{self.count}: {e}") from None
+        return batch
+
+
+def open_reader(path: str, filename: str = ""):
+    """Читатель для загруженного файла: формат — по расширению исходного имени"""
+    if os.path.splitext(filename or path)[1].lower() in (".csv", ".tsv"):
+        return CsvRecordReader(path)
+    return JsonRecordReader(path)
+
+
+# -------------------------
+# Проверка
+# -------------------------
+def validate_record(raw: Any) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Очищенная запись или текст ошибки"""
+    if not isinstance(raw, dict):
+        return None, "ожидается объект с полями записи"
+    missing = [field for field in REQUIRED_FIELDS if field not in raw]
+    if missing:
+        return None, "нет полей: " + ", ".join(missing)
+
+    record: Dict[str, Any] = {}
+    for field in FIELDS:
+        value = raw.get(field)
+        if value is None:
+            value = ""
+        elif isinstance(value, (dict, list)):
+            return None, f"поле «{field}» должно быть строкой"
+        record[field] = str(value).strip()
+    empty = [field for field in LEVELS if not record[field]]
+    if empty:
+        return None, "пустые поля: " + ", ".join(empty)
+    record_id = parse_id(raw.get(ID_FIELD))
+    if record_id is not None:
+        record[ID_FIELD] = record_id
+    return record, None
+
+
+def validate_batch(batch: List[Any], start: int) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """Проверить пачку; start — номер первой записи пачки в файле (с нуля)"""
+    valid, errors = [], []
+    for number, raw in enumerate(batch, start + 1):
+        record, error = validate_record(raw)
+        if error is None:
+            valid.append(record)
+        else:
+            errors.append(f"#{number}: {error}")
+    return valid, errors
+
+
+def read_valid_batch(reader, size: int) -> Tuple[List[Dict[str, Any]], List[str], int]:
+    """Прочитать и проверить следующую пачку (выполняется в пуле ввода-вывода)"""
+    start = reader.count
+    batch = reader.read_batch(size)
+    valid, errors = validate_batch(batch, start)
+    return valid, errors, len(batch)
+
+
+# -------------------------
+# Импорт
+# -------------------------
+class ImportReport:
+    """Итог импорта"""
+
+    def __init__(self, mode: str, dry_run: bool):
+        self.mode = mode
+        self.dry_run = dry_run
+        self.total = 0
+        self.added = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.deleted = 0
+        self.errors: List[str] = []
+        self.error_count = 0
+
+    @property
+    def failed(self) -> bool:
+        return self.error_count > 0
+
+
+ProgressCallback = Callable[[str, int, int, int], Awaitable[None]]
+
+
+async def import_file(repo, path: str, mode: str, run_io, dry_run: bool = False, filename: str = "",
+                      progress: Optional[ProgressCallback] = None,
+                      batch_size: int = IMPORT_BATCH_SIZE) -> ImportReport:
+    """Импортировать файл в хранилище.
+
+    Первый проход проверяет весь файл; если есть ошибки, данные не меняются.
+    Второй проход пачками делает upsert по естественному ключу
+    (класс, полугодие, предмет, экзамен, тип материалов). В режиме replace
+    после этого удаляются записи, которых нет в файле; dry_run только считает.
+    Чтение и разбор идут в пуле run_io, event loop занят лишь применением пачек.
+    """
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"Неизвестный режим импорта: {mode}")
+    report = ImportReport(mode, dry_run)
+
+    reader = await run_io(open_reader, path, filename)
+    try:
+        while True:
+            valid, errors, read = await run_io(read_valid_batch, reader, batch_size)
+            if not read:
+                break
+            report.total += read
+            report.error_count += len(errors)
+            report.errors.extend(errors[:MAX_REPORTED_ERRORS - len(report.errors)])
+            if progress is not None:
+                await progress("check", reader.bytes_read, reader.size, report.total)
+    finally:
+        await run_io(reader.close)
+    if report.failed:
+        return report
+
+    existing = set(await repo.ids()) if mode == "replace" else None
+    reader = await run_io(open_reader, path, filename)
+    try:
+        done = 0
+        while True:
+            valid, _, read = await run_io(read_valid_batch, reader, batch_size)
+            if not read:
+                break
+            result = await repo.upsert(valid, dry_run=dry_run)
+            report.added += result.added
+            report.updated += result.updated
+            report.unchanged += result.unchanged
+            if existing is not None:
+                existing.difference_update(result.ids)
+            done += read
+            if progress is not None:
+                await progress("apply", reader.bytes_read, reader.size, done)
+    finally:
+        await run_io(reader.close)
+
+    if existing:
+        # удаляем только то, что было в базе до начала импорта
+        report.deleted = await repo.delete_many(existing, dry_run=dry_run)
+    return report
+
+
+# -------------------------
+# Экспорт
+# -------------------------
+def encode_csv_rows(rows) -> bytes:
+    """Строки CSV (кортежи значений) в байтах UTF-8"""
+    buffer = io.StringIO()
+    csv.writer(buffer, delimiter=CSV_DELIMITER, lineterminator="\r\n").writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+def _record_rows(records):
+    return [(record.id, *record.values()) for record in records]
+
+
+async def export_csv(repo, run_io, filters: Optional[Dict[str, str]] = None) -> Tuple[bytes, int]:
+    """CSV с записями хранилища (фильтры — как в list_page): (содержимое, число записей).
+
+    Записи читаются пачками и сразу кодируются в общий буфер, поэтому список
+    всех записей в виде словарей не строится и основной файл данных не пишется.
+    BOM в начале нужен Excel, чтобы он открыл файл как UTF-8.
+    """
+    buffer = io.BytesIO()
+    buffer.write(codecs.BOM_UTF8 + encode_csv_rows([CSV_COLUMNS]))
+    count = 0
+    async for batch in repo.iter_records(filters):
+        buffer.write(await run_io(encode_csv_rows, _record_rows(batch)))
+        count += len(batch)
+    return buffer.getvalue(), count
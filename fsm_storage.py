@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""Постоянное FSM-хранилище: SQLite на диске + LRU-кэш в памяти."""
+
+import asyncio
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Mapping, Optional
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL DEFAULT '{}',
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fsm_updated ON fsm (updated);
+"""
+
+
+class _Entry:
+    __slots__ = ("state", "data", "touched", "dirty")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None,
+                 touched: float = 0.0):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.touched = touched
+        self.dirty = False
+
+
+class SqliteStorage(BaseStorage):
+    """FSM-хранилище, переживающее перезапуск бота.
+
+    Горячие сессии живут в LRU-кэше, поэтому обычный callback не ходит на диск.
+    Изменения копятся и пишутся в SQLite пачкой раз в ``flush_interval`` секунд
+    (и при остановке бота). Сессии без активности дольше ``ttl`` удаляются.
+
+    ``shared=True`` — базу используют несколько процессов: кэш не доверяется,
+    каждое чтение идёт в SQLite, а каждое изменение записывается сразу.
+    """
+
+    def __init__(self, path: str, cache_size: int = 10_000, ttl: float = 7 * 24 * 3600,
+                 flush_interval: float = 1.0, key_builder: Optional[KeyBuilder] = None,
+                 shared: bool = False):
+        self.path = path
+        self.shared = shared
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        # одно соединение и один поток: запросы к базе выполняются строго по очереди
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm")
+        self._conn = self._executor.submit(self._open).result()
+        self._cache: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._dirty: Dict[str, _Entry] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self._last_sweep = time.time()
+        self.flushes = 0
+        # колбэк (операция, секунды) для метрик: "load" — чтение сессии, "flush" — запись пачки
+        self.on_timing: Optional[Callable[[str, float], None]] = None
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def _timed(self, operation: str, func, *args):
+        started = time.perf_counter()
+        try:
+            return await self._run(func, *args)
+        finally:
+            if self.on_timing is not None:
+                self.on_timing(operation, time.perf_counter() - started)
+
+    # -------------------------
+    # Кэш
+    # -------------------------
+    async def _entry(self, key: StorageKey) -> _Entry:
+        name = self.key_builder.build(key)
+        now = time.time()
+        entry = self._cache.get(name)
+        if entry is not None and not self.shared and now - entry.touched <= self.ttl:
+            self._cache.move_to_end(name)
+            entry.touched = now
+            return entry
+
+        row = await self._timed("load", self._load, name)
+        # пока читали с диска, сессию могли уже записать
+        entry = self._cache.get(name)
+        stale = entry is not None and self.shared and not entry.dirty
+        if entry is None or stale or now - entry.touched > self.ttl:
+            entry = _Entry()
+            if row is not None and now - row[2] <= self.ttl:
+                entry.state, entry.data = row[0], json.loads(row[1])
+            self._cache[name] = entry
+        self._cache.move_to_end(name)
+        entry.touched = now
+        self._evict()
+        return entry
+
+    def _load(self, name: str):
+        return self._conn.execute("SELECT state, data, updated FROM fsm WHERE key = ?", (name,)).fetchone()
+
+    async def _mark_dirty(self, key: StorageKey, entry: _Entry):
+        entry.dirty = True
+        self._dirty[self.key_builder.build(key)] = entry
+        if self.shared:
+            # следующий апдейт пользователя может прийти в другой процесс
+            await self.flush()
+        elif self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_worker())
+
+    def _evict(self):
+        # грязные записи не выбрасываем, пока они не попали на диск
+        while len(self._cache) > self.cache_size:
+            name, entry = next(iter(self._cache.items()))
+            if entry.dirty:
+                break
+            del self._cache[name]
+
+    # -------------------------
+    # Пакетная запись
+    # -------------------------
+    async def _flush_worker(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Ошибка сохранения FSM: {e}")
+
+    async def flush(self):
+        """Записать накопленные изменения одной транзакцией и удалить устаревшие сессии"""
+        now = time.time()
+        sweep = now - self._last_sweep >= min(self.ttl, 3600)
+        if not self._dirty and not sweep:
+            return
+        batch = [(name, entry.state, json.dumps(entry.data, ensure_ascii=False), entry.touched)
+                 for name, entry in self._dirty.items()]
+        for entry in self._dirty.values():
+            entry.dirty = False
+        self._dirty = {}
+        expire_before = now - self.ttl if sweep else None
+        await self._timed("flush", self._write, batch, expire_before)
+        if sweep:
+            self._last_sweep = now
+            for name in [name for name, entry in self._cache.items()
+                         if not entry.dirty and entry.touched < now - self.ttl]:
+                del self._cache[name]
+        self._evict()
+        self.flushes += 1
+
+    def _write(self, batch, expire_before: Optional[float]):
+        with self._conn:
+            for name, state, data, touched in batch:
+                if state is None and data == "{}":
+                    self._conn.execute("DELETE FROM fsm WHERE key = ?", (name,))
+                else:
+                    self._conn.execute(
+                        "INSERT INTO fsm (key, state, data, updated) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET state = excluded.state, "
+                        "data = excluded.data, updated = excluded.updated",
+                        (name, state, data, touched),
+                    )
+            if expire_before is not None:
+                self._conn.execute("DELETE FROM fsm WHERE updated < ?", (expire_before,))
+
+    # -------------------------
+    # BaseStorage
+    # -------------------------
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        await self._mark_dirty(key, entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._entry(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(
+                f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            )
+        entry = await self._entry(key)
+        entry.data = data.copy()
+        await self._mark_dirty(key, entry)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._entry(key)).data.copy()
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        if self._conn is None:
+            return
+        await self.flush()
+        await self._run(self._conn.close)
+        self._conn = None
+        self._executor.shutdown(wait=True)
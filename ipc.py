@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""Обмен сообщениями между процессами-воркерами на одной машине.
+
+Каждый воркер слушает unix datagram сокет ``<каталог>/<pid>.sock`` и рассылает
+сообщения всем остальным сокетам каталога. Сокеты упавших процессов
+удаляются при первой неудачной отправке.
+"""
+
+import asyncio
+import json
+import os
+import socket
+from typing import Any, Callable, Dict, List, Optional
+
+# Сообщения одного тика event loop склеиваются в датаграмму до этого размера
+MAX_DATAGRAM = 32 * 1024
+
+
+class PeerChannel:
+    """Широковещательный канал «один воркер → все остальные».
+
+    publish() ничего не ждёт: сообщения копятся до конца текущего тика
+    event loop и уходят пачкой (импорт тысяч записей — десятки датаграмм,
+    а не тысячи). Если очередь получателя переполнена, отправка
+    повторяется чуть позже.
+    """
+
+    def __init__(self, directory: str, handler: Callable[[Dict[str, Any]], None],
+                 retry_delay: float = 0.01, max_retries: int = 100):
+        self.directory = directory
+        self.handler = handler
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self.path = os.path.join(directory, f"{os.getpid()}.sock")
+        self._sock: Optional[socket.socket] = None
+        self._outbox: List[Dict[str, Any]] = []
+        self._flush_scheduled = False
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(self.path)
+        sock.setblocking(False)
+        self._sock = sock
+        asyncio.get_running_loop().add_reader(sock.fileno(), self._receive)
+
+    def close(self):
+        if self._sock is None:
+            return
+        self._flush()
+        asyncio.get_running_loop().remove_reader(self._sock.fileno())
+        self._sock.close()
+        self._sock = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    # -------------------------
+    # Приём
+    # -------------------------
+    def _receive(self):
+        while True:
+            try:
+                data, _, flags, _ = self._sock.recvmsg(MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                return
+            if flags & socket.MSG_TRUNC:
+                print(f"Сообщение воркера длиннее {MAX_DATAGRAM} байт обрезано и отброшено")
+                continue
+            try:
+                messages = json.loads(data.decode("utf-8"))
+            except ValueError as e:
+                print(f"Повреждённое сообщение воркера ({len(data)} байт) отброшено: {e}")
+                continue
+            for message in messages:
+                try:
+                    self.handler(message)
+                except Exception as e:
+                    print(f"Ошибка обработки сообщения воркера: {e}")
+
+    # -------------------------
+    # Отправка
+    # -------------------------
+    def publish(self, message: Dict[str, Any]):
+        if self._sock is None:
+            return
+        self._outbox.append(message)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    def _peers(self) -> List[str]:
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return [os.path.join(self.directory, name) for name in names
+                if name.endswith(".sock") and os.path.join(self.directory, name) != self.path]
+
+    def _packets(self, messages) -> List[bytes]:
+        """JSON-массивы сообщений, каждый не длиннее MAX_DATAGRAM байт"""
+        packets, batch, size = [], [], 2
+        for message in messages:
+            encoded = json.dumps(message, ensure_ascii=False).encode("utf-8")
+            if len(encoded) + 2 > MAX_DATAGRAM:
+                # не помещается даже в отдельную датаграмму — получатель бы его обрезал
+                print(f"Сообщение воркерам длиннее {MAX_DATAGRAM} байт не отправлено: {message.get('type')}")
+                continue
+            if batch and size + len(encoded) + 1 > MAX_DATAGRAM:
+                packets.append(b"[" + b",".join(batch) + b"]")
+                batch, size = [], 2
+            batch.append(encoded)
+            size += len(encoded) + 1
+        if batch:
+            packets.append(b"[" + b",".join(batch) + b"]")
+        return packets
+
+    def _flush(self):
+        self._flush_scheduled = False
+        if not self._outbox or self._sock is None:
+            return
+        messages, self._outbox = self._outbox, []
+        peers = self._peers()
+        if not peers:
+            return
+        for packet in self._packets(messages):
+            for peer in peers:
+                self._send(packet, peer, 0)
+
+    def _send(self, packet: bytes, peer: str, attempt: int):
+        if self._sock is None:
+            return
+        try:
+            self._sock.sendto(packet, peer)
+        except (BlockingIOError, InterruptedError):
+            # получатель не успевает читать — повторим, не блокируя event loop
+            if attempt < self.max_retries:
+                asyncio.get_running_loop().call_later(self.retry_delay, self._send, packet, peer, attempt + 1)
+            else:
+                print(f"Воркер {os.path.basename(peer)} не принимает сообщения, пакет потерян")
+        except (ConnectionRefusedError, FileNotFoundError):
+            # процесс завершился, не убрав за собой сокет
+            try:
+                os.remove(peer)
+            except OSError:
+                pass
@@ -1,16 +1,28 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import argparse
 import asyncio
+import hashlib
 import json
 import os
-from datetime import datetime
-from typing import List, Dict, Any
-
+import secrets
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+
+from aiohttp import web
 from aiogram import Bot, Dispatcher, F
-from aiogram.filters import CommandStart, Command
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import CommandStart, Command, ExceptionTypeFilter
 from aiogram.types import (
-    Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, InputFile
+    Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, BufferedInputFile, ErrorEvent
 )
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -20,11 +32,60 @@ from aiogram.fsm.storage.memory import MemoryStorage
 # BOT_TOKEN = "ТОКЕН"
 # ADMIN_IDS = [12345678, 87654321]
 from config import ADMIN_IDS, BOT_TOKEN
+import config
+from repository import VersionConflict, create_repository, natural_key
+from backup import BackupStore
+from broadcast import Broadcaster, ChangeNotifier, SubscriberRegistry, TokenBucket
+from dataio import IMPORT_MODES, export_csv, import_file
+from schedule_index import LEVELS, node_id
+from render_cache import RenderCache
+from fsm_storage import SqliteStorage
+from ipc import PeerChannel
+from metrics import HandlerMetricsMiddleware, Metrics, UpdateMetricsMiddleware, start_metrics_server
+from persistence import PersistenceError, write_atomic
+from records import Record
+from throttling import ThrottlingMiddleware
+from webhook import create_webhook_app
+
+# Необязательные настройки: старые config.py без них продолжают работать
+STORAGE_BACKEND = getattr(config, "STORAGE_BACKEND", "json")
+SQLITE_PATH = getattr(config, "SQLITE_PATH", "schedule_data.db")
+FSM_STORAGE = getattr(config, "FSM_STORAGE", "sqlite")
+FSM_DB_PATH = getattr(config, "FSM_DB_PATH", "fsm_state.db")
+FSM_SESSION_TTL = getattr(config, "FSM_SESSION_TTL", 7 * 24 * 3600)
+
+# Режим получения апдейтов: "polling" или "webhook" (можно переопределить флагами, см. parse_args)
+RUN_MODE = getattr(config, "RUN_MODE", "polling")
+WEBHOOK_HOST = getattr(config, "WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = getattr(config, "WEBHOOK_PORT", 8080)
+WEBHOOK_PATH = getattr(config, "WEBHOOK_PATH", "/webhook")
+WEBHOOK_URL = getattr(config, "WEBHOOK_URL", "")
+WEBHOOK_SECRET = getattr(config, "WEBHOOK_SECRET", "")
+WEBHOOK_DRAIN_TIMEOUT = getattr(config, "WEBHOOK_DRAIN_TIMEOUT", 10.0)
+# Свой сервер Bot API (локальный telegram-bot-api или заглушка нагрузочного теста); пусто — api.telegram.org
+BOT_API_SERVER = getattr(config, "BOT_API_SERVER", "")
+
+# Несколько процессов на одном порту (только webhook + SQLite); воркеры
+# обмениваются сбросом кэшей через unix-сокеты в каталоге IPC_DIR
+WORKERS = getattr(config, "WORKERS", 1)
+IPC_DIR = getattr(config, "IPC_DIR", "ipc")
+
+# Метрики Prometheus на локальном адресе (у воркера N порт METRICS_PORT + N); 0 — не запускать
+METRICS_HOST = getattr(config, "METRICS_HOST", "127.0.0.1")
+METRICS_PORT = getattr(config, "METRICS_PORT", 9464)
+
+# Защита от флуда: апдейтов в секунду и размер всплеска на пользователя, отдельно
+# для сообщений и нажатий кнопок (0 — без ограничения); администраторы не ограничиваются
+THROTTLE_MESSAGE_RATE = getattr(config, "THROTTLE_MESSAGE_RATE", 1.0)
+THROTTLE_MESSAGE_BURST = getattr(config, "THROTTLE_MESSAGE_BURST", 5)
+THROTTLE_CALLBACK_RATE = getattr(config, "THROTTLE_CALLBACK_RATE", 3.0)
+THROTTLE_CALLBACK_BURST = getattr(config, "THROTTLE_CALLBACK_BURST", 10)
+DOUBLE_TAP_WINDOW = getattr(config, "DOUBLE_TAP_WINDOW", 1.0)   # секунд, повтор той же кнопки отбрасывается
 
 # -------------------------
 # Данные по умолчанию
 # -------------------------
-schedule_data: List[Dict[str, Any]] = [
+DEFAULT_DATA: List[Dict[str, Any]] = [
     {
         "класс": "9А",
         "полугодие": "1",
@@ -37,19 +98,41 @@ schedule_data: List[Dict[str, Any]] = [
 ]
 
 DATA_FILE = "schedule_data.json"
+DATA_RELOAD_INTERVAL = getattr(config, "DATA_RELOAD_INTERVAL", 2.0)  # секунд между проверками файла, 0 — выкл.
+ADMINS_FILE = "admins.json"   # администраторы, добавленные через /addadmin
 BACKUP_DIR = "backups"
+BACKUP_COMPRESSION = getattr(config, "BACKUP_COMPRESSION", "gzip")
+BACKUP_INTERVAL = getattr(config, "BACKUP_INTERVAL", 3600)   # секунд между автоматическими копиями, 0 — выкл.
+BACKUP_KEEP_LAST = getattr(config, "BACKUP_KEEP_LAST", 10)
+BACKUP_KEEP_HOURLY = getattr(config, "BACKUP_KEEP_HOURLY", 24)
+BACKUP_KEEP_DAILY = getattr(config, "BACKUP_KEEP_DAILY", 30)
+RESTORE_LIST_SIZE = 10
+
+# Рассылки /notify: лимиты Telegram — около 30 сообщений в секунду на бота
+BROADCAST_DB_PATH = getattr(config, "BROADCAST_DB_PATH", "broadcast.db")
+BROADCAST_RATE = getattr(config, "BROADCAST_RATE", 25)
+BROADCAST_CONCURRENCY = getattr(config, "BROADCAST_CONCURRENCY", 10)
+NOTIFY_DELAY = getattr(config, "NOTIFY_DELAY", 5.0)   # окно группировки уведомлений подписчикам
+
+# Компактация журнала изменений в снимок
+COMPACT_INTERVAL = 300      # секунд между плановыми компактациями
+COMPACT_THRESHOLD = 1000    # или раньше, если в журнале накопилось столько операций
+COMPACT_CHECK_PERIOD = 5
+
+# Дисковый ввод-вывод выполняется вне event loop
+IO_WORKERS = 4
+WRITE_QUEUE_SIZE = 256      # сколько изменений может ждать записи, дальше — back-pressure
+WRITE_COALESCE_DELAY = 0.02 # окно группировки изменений в один fsync
+
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+
+# Готовые экраны навигации (LRU по узлам дерева)
+RENDER_CACHE_SIZE = 5000
+render_cache = RenderCache(RENDER_CACHE_SIZE)
 
 # -------------------------
 # FSM состояния
 # -------------------------
-class ScheduleStates(StatesGroup):
-    choosing_class = State()
-    choosing_semester = State()
-    choosing_subject = State()
-    choosing_exam = State()
-    choosing_material_type = State()
-
-
 class AdminStates(StatesGroup):
     adding_class = State()
     adding_semester = State()
@@ -71,42 +154,59 @@ class AdminStates(StatesGroup):
     importing_data = State()
     exporting_data = State()
     backup_create = State()
+    restoring_select = State()
+    restoring_confirm = State()
 
 # -------------------------
 # Инициализация бота
 # -------------------------
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+def create_fsm_storage():
+    """FSM-хранилище: SQLite с LRU-кэшем (по умолчанию) или в памяти"""
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    return SqliteStorage(FSM_DB_PATH, ttl=FSM_SESSION_TTL)
+
+
+def create_bot() -> Bot:
+    if BOT_API_SERVER:
+        return Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_SERVER)))
+    return Bot(token=BOT_TOKEN)
+
+
+bot = create_bot()
+storage = create_fsm_storage()
 dp = Dispatcher(storage=storage)
 
+metrics = Metrics()
+metrics.describe("bot_fsm_seconds", "histogram", "Операции FSM-хранилища: чтение сессии и запись пачки")
+metrics.describe("bot_storage_seconds", "histogram", "Запись данных на диск: журнал, компактация, транзакции SQLite")
+metrics_runner: Optional[web.AppRunner] = None
+dp.update.outer_middleware(UpdateMetricsMiddleware(metrics))
+dp.message.middleware(HandlerMetricsMiddleware(metrics))
+dp.callback_query.middleware(HandlerMetricsMiddleware(metrics))
+if isinstance(storage, SqliteStorage):
+    storage.on_timing = metrics.observer("bot_fsm_seconds")
+
 # -------------------------
 # Хелперы сохранения/загрузки
 # -------------------------
-def save_data():
-    """Сохранить данные в файл"""
-    try:
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(schedule_data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"Ошибка сохранения данных: {e}")
+async def run_io(func, *args):
+    """Выполнить блокирующую функцию в пуле ввода-вывода"""
+    return await asyncio.get_running_loop().run_in_executor(io_executor, func, *args)
 
 
 def load_data():
-    """Загрузить данные из файла"""
-    global schedule_data
-    try:
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                schedule_data = json.load(f)
-        else:
-            save_data()
-    except Exception as e:
-        print(f"Ошибка загрузки данных: {e}")
+    """Открыть хранилище (JSON-файл или SQLite, см. STORAGE_BACKEND)"""
+    return create_repository(
+        STORAGE_BACKEND, io_executor, DATA_FILE, SQLITE_PATH, default=DEFAULT_DATA,
+        write_queue_size=WRITE_QUEUE_SIZE, coalesce_delay=WRITE_COALESCE_DELAY,
+        compact_interval=COMPACT_INTERVAL, compact_threshold=COMPACT_THRESHOLD,
+        compact_check_period=COMPACT_CHECK_PERIOD, reload_interval=DATA_RELOAD_INTERVAL,
+    )
 
 
-def ensure_backup_dir():
-    if not os.path.exists(BACKUP_DIR):
-        os.makedirs(BACKUP_DIR)
+def dump_json_bytes(data) -> bytes:
+    return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
 
 
 # -------------------------
@@ -116,60 +216,172 @@ def is_admin(user_id: int) -> bool:
     return user_id in ADMIN_IDS
 
 
-def get_unique_classes():
-    return sorted(list({item["класс"] for item in schedule_data}))
+def load_admins():
+    """Добавить к ADMIN_IDS из config.py администраторов, сохранённых /addadmin"""
+    if not os.path.exists(ADMINS_FILE):
+        return
+    try:
+        with open(ADMINS_FILE, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+    except Exception as e:
+        print(f"Ошибка загрузки {ADMINS_FILE}: {e}")
+        return
+    for admin_id in saved:
+        if admin_id not in ADMIN_IDS:
+            ADMIN_IDS.append(admin_id)
+
+
+def save_admins():
+    write_atomic(ADMINS_FILE, json.dumps(ADMIN_IDS).encode("utf-8"))
 
 
-def get_unique_semesters(class_name):
-    semesters = [item["полугодие"] for item in schedule_data if item["класс"] == class_name]
-    return sorted(list(set(semesters)))
+load_admins()
 
 
-def get_unique_subjects(class_name, semester):
-    subjects = [
-        item["предмет"] for item in schedule_data
-        if item["класс"] == class_name and item["полугодие"] == semester
-    ]
-    return sorted(list(set(subjects)))
+async def get_unique_classes():
+    return await repo.children()
 
 
-def get_unique_exams(class_name, semester, subject):
-    exams = [
-        item["экзамен"] for item in schedule_data
-        if item["класс"] == class_name and item["полугодие"] == semester and item["предмет"] == subject
-    ]
-    return sorted(list(set(exams)))
+# Длинные аргументы кнопок (запрос поиска, фильтр списка) не помещаются
+# в callback_data (64 байта), поэтому хранятся в LRU под коротким ключом
+CALLBACK_ARGS_SIZE = 1000
+MESSAGE_LIMIT = 4096
+callback_args: "OrderedDict[str, str]" = OrderedDict()
 
 
-def get_unique_material_types(class_name, semester, subject, exam):
-    materials = [
-        item["тип_материалов"] for item in schedule_data
-        if (item["класс"] == class_name and item["полугодие"] == semester and
-            item["предмет"] == subject and item["экзамен"] == exam)
-    ]
-    return sorted(list(set(materials)))
+def store_arg(key: str, text: str):
+    callback_args[key] = text
+    callback_args.move_to_end(key)
+    while len(callback_args) > CALLBACK_ARGS_SIZE:
+        callback_args.popitem(last=False)
 
 
-def get_full_info(class_name, semester, subject, exam, material_type):
-    for item in schedule_data:
-        if (item["класс"] == class_name and item["полугодие"] == semester and
-                item["предмет"] == subject and item["экзамен"] == exam and
-                item["тип_материалов"] == material_type):
-            return item
-    return None
+def remember_arg(text: str) -> str:
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=6).hexdigest()
+    if callback_args.get(key) != text:
+        # нажатие кнопки может прийти в другой воркер
+        publish_to_peers({"type": "arg", "key": key, "text": text})
+    store_arg(key, text)
+    return key
 
 
-def create_keyboard(items: List[str], callback_prefix: str, add_back=True) -> InlineKeyboardMarkup:
+# -------------------------
+# Навигация: путь по дереву зашит в callback_data
+# -------------------------
+# Формат кнопки: "nav:<версия>:<id узла в base36>". Идентификатор узла вычисляется
+# из пути (schedule_index.node_id), поэтому токен не зависит от перезагрузки данных
+# и не требует FSM. При смене формата увеличьте NAV_VERSION.
+NAV_PREFIX = "nav"
+NAV_VERSION = "1"
+SUB_PREFIX = "sub"       # "sub:<id узла>" — подписаться/отписаться
+UNSUB_PREFIX = "unsub"   # "unsub:<id узла>" — отписка из списка /subscriptions
+_B36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+# Строки заголовка для уже выбранных уровней и подсказка для следующего
+PATH_LABELS = ("🏫 <b>Класс:</b>", "📅 <b>Полугодие:</b>", "📚 <b>Предмет:</b>", "📝 <b>Экзамен:</b>")
+LEVEL_PROMPTS = (
+    "📚 Выберите класс:",
+    "📅 Выберите полугодие:",
+    "📚 Выберите предмет:",
+    "📝 Выберите тип экзамена:",
+    "📄 Выберите тип справочных материалов:",
+)
+LEVEL_EMPTY = (
+    "❌ <b>База данных пуста</b>\n\nОбратитесь к администратору.",
+    "❌ Данные о полугодиях отсутствуют",
+    "❌ Предметы не найдены",
+    "❌ Типы экзаменов не найдены",
+    "❌ Типы справочных материалов не найдены",
+)
+
+
+def node_digits(path) -> str:
+    """Идентификатор узла в base36 (короче для callback_data)"""
+    nid = node_id(tuple(path))
+    digits = ""
+    while True:
+        nid, rest = divmod(nid, 36)
+        digits = _B36[rest] + digits
+        if not nid:
+            break
+    return digits
+
+
+def nav_token(path) -> str:
+    return f"{NAV_PREFIX}:{NAV_VERSION}:{node_digits(path)}"
+
+
+def parse_nav_token(data: str) -> Optional[int]:
+    parts = data.split(":")
+    if len(parts) != 3 or parts[0] != NAV_PREFIX or parts[1] != NAV_VERSION:
+        return None
+    try:
+        return int(parts[2], 36)
+    except ValueError:
+        return None
+
+
+def subscribe_button(path) -> InlineKeyboardButton:
+    # экран общий для всех, поэтому кнопка переключает подписку, а не показывает её состояние
+    return InlineKeyboardButton(text="🔔 Подписка на раздел", callback_data=f"{SUB_PREFIX}:{node_digits(path)}")
+
+
+def create_keyboard(path, items: List[str], add_back=True) -> InlineKeyboardMarkup:
     keyboard = []
     for item in items:
-        keyboard.append([InlineKeyboardButton(text=item, callback_data=f"{callback_prefix}:{item}")])
+        keyboard.append([InlineKeyboardButton(text=item, callback_data=nav_token((*path, item)))])
 
-    if add_back and callback_prefix != "class":
-        keyboard.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="back")])
+    if path:
+        keyboard.append([subscribe_button(path)])
+    if add_back and path:
+        keyboard.append([InlineKeyboardButton(text="⬅️ Назад", callback_data=nav_token(path[:-1]))])
 
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 
+def format_node_header(path) -> str:
+    if len(path) == 1:
+        return f"✅ <b>Выбран класс:</b> <code>{path[0]}</code>\n\n"
+    if not path:
+        return ""
+    lines = [f"{label} <code>{value}</code>" for label, value in zip(PATH_LABELS, path)]
+    return "\n".join(lines) + "\n\n"
+
+
+async def render_node(path) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Текст и клавиатура для узла дерева (из кэша, если экран уже строился)"""
+    key = node_id(path)
+    cached = render_cache.get(key)
+    if cached is not None:
+        return cached
+    version = render_cache.version
+    screen = await build_node_screen(path)
+    render_cache.put(key, screen, version)
+    return screen
+
+
+async def build_node_screen(path) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Текст и клавиатура для узла дерева (или карточка записи для листа)"""
+    if len(path) == len(LEVELS):
+        record = await repo.get(*path)
+        if not record:
+            return "❌ Информация не найдена", None
+
+        keyboard_buttons = [
+            [subscribe_button(path)],
+            [InlineKeyboardButton(text="⬅️ К типам материалов", callback_data=nav_token(path[:-1]))],
+            [InlineKeyboardButton(text="🏠 В начало", callback_data=nav_token(()))]
+        ]
+        if record.get('ссылка'):
+            keyboard_buttons.insert(0, [InlineKeyboardButton(text="🔗 Получить материалы", url=record['ссылка'])])
+        return format_info_card(record), InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+
+    items = await repo.children(*path)
+    if not items:
+        return LEVEL_EMPTY[len(path)], None
+    return format_node_header(path) + LEVEL_PROMPTS[len(path)], create_keyboard(path, items)
+
+
 def format_info_card(record: Dict[str, Any]) -> str:
     card = (
         "╔═══════════════════════════╗\n"
@@ -194,8 +406,76 @@ def format_info_card(record: Dict[str, Any]) -> str:
 # -------------------------
 # Загрузка данных при старте
 # -------------------------
-load_data()
-ensure_backup_dir()
+def invalidate_screens(old, new):
+    """Сбросить готовые экраны на путях изменённой записи (старом и новом)"""
+    render_cache.invalidate_record(old)
+    render_cache.invalidate_record(new)
+
+
+# -------------------------
+# Несколько воркеров
+# -------------------------
+worker_index = 0                       # 0 — основной процесс (резервные копии, докачка рассылок)
+peers: Optional[PeerChannel] = None    # канал к остальным воркерам, если они есть
+
+
+def publish_to_peers(message: Dict[str, Any]):
+    if peers is not None:
+        peers.publish(message)
+
+
+def publish_change(old, new):
+    """Сообщить воркерам об изменении записи: им нужен только путь в дереве"""
+    publish_to_peers({"type": "changed",
+                      "old": None if old is None else {level: old[level] for level in LEVELS},
+                      "new": None if new is None else {level: new[level] for level in LEVELS}})
+
+
+def apply_peer_message(message: Dict[str, Any]):
+    kind = message["type"]
+    if kind == "changed":
+        repo.apply_peer_change(message["old"], message["new"])
+        invalidate_screens(message["old"], message["new"])
+    elif kind == "arg":
+        store_arg(message["key"], message["text"])
+    elif kind == "admins":
+        load_admins()
+    else:
+        subscribers.apply_peer(message)
+
+
+repo = load_data()
+repo.on_timing = metrics.observer("bot_storage_seconds")
+repo.add_listener(invalidate_screens)
+repo.add_listener(publish_change)
+backup_store = BackupStore(BACKUP_DIR, BACKUP_COMPRESSION)
+backup_task: Optional[asyncio.Task] = None
+subscribers = SubscriberRegistry(BROADCAST_DB_PATH)
+
+
+@dp.update.outer_middleware()
+async def remember_chat(handler, event, data):
+    """Каждый чат, написавший боту, попадает в список рассылки"""
+    chat = data.get("event_chat")
+    if chat is not None:
+        subscribers.touch(chat.id)
+    return await handler(event, data)
+
+
+def count_throttled(kind: str):
+    return lambda reason: metrics.inc("bot_throttled_total", kind=kind, reason=reason)
+
+
+metrics.describe("bot_throttled_total", "counter", "Апдейты, отброшенные защитой от флуда")
+if THROTTLE_MESSAGE_RATE > 0:
+    dp.message.outer_middleware(ThrottlingMiddleware(
+        THROTTLE_MESSAGE_RATE, THROTTLE_MESSAGE_BURST, "⏳ Слишком много сообщений, подождите немного.",
+        exempt=is_admin, on_drop=count_throttled("message")))
+if THROTTLE_CALLBACK_RATE > 0:
+    dp.callback_query.outer_middleware(ThrottlingMiddleware(
+        THROTTLE_CALLBACK_RATE, THROTTLE_CALLBACK_BURST, "⏳ Не так быстро",
+        double_tap_window=DOUBLE_TAP_WINDOW, exempt=is_admin, on_drop=count_throttled("callback")))
+
 
 # -------------------------
 # Основные handlers
@@ -203,7 +483,7 @@ ensure_backup_dir()
 @dp.message(CommandStart())
 async def cmd_start(message: Message, state: FSMContext):
     await state.clear()
-    classes = get_unique_classes()
+    classes = await get_unique_classes()
 
     if not classes:
         await message.answer("❌ <b>База данных пуста</b>\n\nОбратитесь к администратору.", parse_mode="HTML")
@@ -225,10 +505,12 @@ async def cmd_start(message: Message, state: FSMContext):
             "/import - Импорт данных\n"
             "/addadmin - Добавить админа\n"
             "/listadmins - Список админов\n"
-            "/backup - Резервная копия"
+            "/perf - Производительность\n"
+            "/backup - Резервная копия\n"
+            "/restore - Восстановление из копии"
         )
 
-    keyboard = create_keyboard(classes, "class", add_back=False)
+    keyboard = create_keyboard((), classes, add_back=False)
 
     welcome_text = (
         "╔═══════════════════════════╗\n"
@@ -240,238 +522,94 @@ async def cmd_start(message: Message, state: FSMContext):
     )
 
     await message.answer(welcome_text, reply_markup=keyboard, parse_mode="HTML")
-    await state.set_state(ScheduleStates.choosing_class)
-
-
-# выбор класса -> полугодие
-@dp.callback_query(F.data.startswith("class:"))
-async def process_class_selection(callback: CallbackQuery, state: FSMContext):
-    class_name = callback.data.split(":", 1)[1]
-    await state.update_data(class_name=class_name)
-
-    semesters = get_unique_semesters(class_name)
-    if not semesters:
-        await callback.message.edit_text("❌ Данные о полугодиях отсутствуют")
-        await callback.answer()
-        return
-
-    keyboard = create_keyboard(semesters, "semester")
-    await callback.message.edit_text(
-        f"✅ <b>Выбран класс:</b> <code>{class_name}</code>\n\n"
-        f"📅 Выберите полугодие:",
-        reply_markup=keyboard,
-        parse_mode="HTML"
-    )
-    await state.set_state(ScheduleStates.choosing_semester)
-    await callback.answer()
-
-
-# выбор полугодия -> предмет
-@dp.callback_query(F.data.startswith("semester:"))
-async def process_semester_selection(callback: CallbackQuery, state: FSMContext):
-    semester = callback.data.split(":", 1)[1]
-    data = await state.get_data()
-    class_name = data.get("class_name")
-
-    await state.update_data(semester=semester)
-
-    subjects = get_unique_subjects(class_name, semester)
-    if not subjects:
-        await callback.message.edit_text("❌ Предметы не найдены")
-        await callback.answer()
-        return
-
-    keyboard = create_keyboard(subjects, "subject")
-    await callback.message.edit_text(
-        f"🏫 <b>Класс:</b> <code>{class_name}</code>\n"
-        f"📅 <b>Полугодие:</b> <code>{semester}</code>\n\n"
-        f"📚 Выберите предмет:",
-        reply_markup=keyboard,
-        parse_mode="HTML"
-    )
-    await state.set_state(ScheduleStates.choosing_subject)
-    await callback.answer()
-
-
-# выбор предмета -> тип экзамена
-@dp.callback_query(F.data.startswith("subject:"))
-async def process_subject_selection(callback: CallbackQuery, state: FSMContext):
-    subject = callback.data.split(":", 1)[1]
-    data = await state.get_data()
-    class_name = data.get("class_name")
-    semester = data.get("semester")
-
-    await state.update_data(subject=subject)
-
-    exams = get_unique_exams(class_name, semester, subject)
-    if not exams:
-        await callback.message.edit_text("❌ Типы экзаменов не найдены")
-        await callback.answer()
-        return
 
-    keyboard = create_keyboard(exams, "exam")
-    await callback.message.edit_text(
-        f"🏫 <b>Класс:</b> <code>{class_name}</code>\n"
-        f"📅 <b>Полугодие:</b> <code>{semester}</code>\n"
-        f"📚 <b>Предмет:</b> <code>{subject}</code>\n\n"
-        f"📝 Выберите тип экзамена:",
-        reply_markup=keyboard,
-        parse_mode="HTML"
-    )
-    await state.set_state(ScheduleStates.choosing_exam)
-    await callback.answer()
 
+# переход по дереву: класс -> полугодие -> предмет -> экзамен -> тип материалов -> карточка
+@dp.callback_query(F.data.startswith(f"{NAV_PREFIX}:"))
+async def process_navigation(callback: CallbackQuery):
+    nid = parse_nav_token(callback.data)
+    path = await repo.resolve(nid) if nid is not None else None
+    notice = None
+    if path is None:
+        # раздел удалён или кнопка из старой версии бота — начинаем сначала
+        notice = "Раздел больше не существует, начните сначала"
+        path = ()
 
-# выбор экзамена -> тип материалов
-@dp.callback_query(F.data.startswith("exam:"))
-async def process_exam_selection(callback: CallbackQuery, state: FSMContext):
-    exam = callback.data.split(":", 1)[1]
-    data = await state.get_data()
-    class_name = data.get("class_name")
-    semester = data.get("semester")
-    subject = data.get("subject")
+    text, keyboard = await render_node(path)
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    await callback.answer(notice)
 
-    await state.update_data(exam=exam)
 
-    material_types = get_unique_material_types(class_name, semester, subject, exam)
-    if not material_types:
-        await callback.message.edit_text("❌ Типы справочных материалов не найдены")
-        await callback.answer()
-        return
-
-    keyboard = create_keyboard(material_types, "material")
-    await callback.message.edit_text(
-        f"🏫 <b>Класс:</b> <code>{class_name}</code>\n"
-        f"📅 <b>Полугодие:</b> <code>{semester}</code>\n"
-        f"📚 <b>Предмет:</b> <code>{subject}</code>\n"
-        f"📝 <b>Экзамен:</b> <code>{exam}</code>\n\n"
-        f"📄 Выберите тип справочных материалов:",
-        reply_markup=keyboard,
-        parse_mode="HTML"
-    )
-    await state.set_state(ScheduleStates.choosing_material_type)
+# кнопки из сообщений, отправленных до перехода на токены навигации
+@dp.callback_query(
+    F.data.in_({"back", "back_to_materials", "back_to_start"}) |
+    F.data.regexp(r"^(class|semester|subject|exam|material):")
+)
+async def process_legacy_navigation(callback: CallbackQuery):
+    text, keyboard = await render_node(())
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
     await callback.answer()
 
 
-# выбор типа материалов -> карточка
-@dp.callback_query(F.data.startswith("material:"))
-async def process_material_selection(callback: CallbackQuery, state: FSMContext):
-    material_type = callback.data.split(":", 1)[1]
-    data = await state.get_data()
+# -------------------------
+# Подписки на разделы
+# -------------------------
+async def resolve_node_arg(data: str) -> Optional[Tuple[str, ...]]:
+    try:
+        nid = int(data.split(":", 1)[1], 36)
+    except (IndexError, ValueError):
+        return None
+    return await repo.resolve(nid)
 
-    record = get_full_info(
-        data.get("class_name"),
-        data.get("semester"),
-        data.get("subject"),
-        data.get("exam"),
-        material_type
-    )
 
-    if not record:
-        await callback.message.edit_text("❌ Информация не найдена")
-        await callback.answer()
+@dp.callback_query(F.data.startswith(f"{SUB_PREFIX}:"))
+async def process_subscribe(callback: CallbackQuery):
+    path = await resolve_node_arg(callback.data)
+    if not path:
+        await callback.answer("Раздел больше не существует", show_alert=True)
         return
-
-    # клавиатура
-    keyboard_buttons = [
-        [InlineKeyboardButton(text="⬅️ К типам материалов", callback_data="back_to_materials")],
-        [InlineKeyboardButton(text="🏠 В начало", callback_data="back_to_start")]
-    ]
-
-    if record.get('ссылка'):
-        keyboard_buttons.insert(0, [InlineKeyboardButton(text="🔗 Получить материалы", url=record['ссылка'])])
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
-
-    await callback.message.edit_text(
-        format_info_card(record),
-        reply_markup=keyboard,
-        parse_mode="HTML"
-    )
-    await state.set_state(ScheduleStates.choosing_material_type)
-    await callback.answer()
-
-
-# назад (универсальная кнопка)
-@dp.callback_query(F.data == "back")
-async def process_back(callback: CallbackQuery, state: FSMContext):
-    current_state = await state.get_state()
-    data = await state.get_data()
-
-    if current_state == ScheduleStates.choosing_semester.state:
-        classes = get_unique_classes()
-        keyboard = create_keyboard(classes, "class", add_back=False)
-        await callback.message.edit_text("📚 Выберите класс:", reply_markup=keyboard, parse_mode="HTML")
-        await state.set_state(ScheduleStates.choosing_class)
-
-    elif current_state == ScheduleStates.choosing_subject.state:
-        class_name = data.get("class_name")
-        semesters = get_unique_semesters(class_name)
-        keyboard = create_keyboard(semesters, "semester")
-        await callback.message.edit_text(
-            f"✅ <b>Выбран класс:</b> <code>{class_name}</code>\n\n📅 Выберите полугодие:",
-            reply_markup=keyboard,
-            parse_mode="HTML"
+    chat_id = callback.message.chat.id if callback.message else callback.from_user.id
+    title = " / ".join(path)
+    if await subscribers.unsubscribe(chat_id, path):
+        await callback.answer(f"🔕 Вы отписались от раздела {title}", show_alert=True)
+    else:
+        await subscribers.subscribe(chat_id, path)
+        await callback.answer(
+            f"🔔 Вы подписаны на раздел {title}. Сообщим о новых и изменённых материалах.\n"
+            "Список подписок — /subscriptions",
+            show_alert=True
         )
-        await state.set_state(ScheduleStates.choosing_semester)
-
-    elif current_state == ScheduleStates.choosing_exam.state:
-        class_name = data.get("class_name")
-        semester = data.get("semester")
-        subjects = get_unique_subjects(class_name, semester)
-        keyboard = create_keyboard(subjects, "subject")
-        await callback.message.edit_text(
-            f"🏫 <b>Класс:</b> <code>{class_name}</code>\n"
-            f"📅 <b>Полугодие:</b> <code>{semester}</code>\n\n📚 Выберите предмет:",
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
-        await state.set_state(ScheduleStates.choosing_subject)
-
-    elif current_state == ScheduleStates.choosing_material_type.state:
-        class_name = data.get("class_name")
-        semester = data.get("semester")
-        subject = data.get("subject")
-        exams = get_unique_exams(class_name, semester, subject)
-        keyboard = create_keyboard(exams, "exam")
-        await callback.message.edit_text(
-            f"🏫 <b>Класс:</b> <code>{class_name}</code>\n"
-            f"📅 <b>Полугодие:</b> <code>{semester}</code>\n"
-            f"📚 <b>Предмет:</b> <code>{subject}</code>\n\n📝 Выберите тип экзамена:",
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
-        await state.set_state(ScheduleStates.choosing_exam)
 
-    await callback.answer()
 
+def render_subscriptions(chat_id: int) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    paths = subscribers.subscriptions(chat_id)
+    if not paths:
+        return ("🔕 У вас нет подписок.\n\n"
+                "Откройте раздел через /start и нажмите «🔔 Подписка на раздел»."), None
+    keyboard = [[InlineKeyboardButton(text=f"❌ {' / '.join(path)}",
+                                      callback_data=f"{UNSUB_PREFIX}:{node_digits(path)}")]
+                for path in paths]
+    text = "🔔 <b>Ваши подписки</b>\n\nНажмите на раздел, чтобы отписаться."
+    return text, InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-@dp.callback_query(F.data == "back_to_materials")
-async def process_back_to_materials(callback: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    material_types = get_unique_material_types(
-        data.get("class_name"),
-        data.get("semester"),
-        data.get("subject"),
-        data.get("exam")
-    )
-    keyboard = create_keyboard(material_types, "material")
-    await callback.message.edit_text(
-        f"📄 Выберите тип справочных материалов:",
-        reply_markup=keyboard,
-        parse_mode="HTML"
-    )
-    await state.set_state(ScheduleStates.choosing_material_type)
-    await callback.answer()
 
+@dp.message(Command("subscriptions"))
+async def cmd_subscriptions(message: Message):
+    text, keyboard = render_subscriptions(message.chat.id)
+    await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
 
-@dp.callback_query(F.data == "back_to_start")
-async def process_back_to_start(callback: CallbackQuery, state: FSMContext):
-    classes = get_unique_classes()
-    keyboard = create_keyboard(classes, "class", add_back=False)
-    await callback.message.edit_text("📚 Выберите класс:", reply_markup=keyboard, parse_mode="HTML")
-    await state.set_state(ScheduleStates.choosing_class)
-    await callback.answer()
+
+@dp.callback_query(F.data.startswith(f"{UNSUB_PREFIX}:"))
+async def process_unsubscribe(callback: CallbackQuery):
+    chat_id = callback.message.chat.id
+    digits = callback.data.split(":", 1)[1]
+    # раздел мог исчезнуть из базы, поэтому ищем путь среди подписок чата
+    path = next((path for path in subscribers.subscriptions(chat_id) if node_digits(path) == digits), None)
+    if path is not None:
+        await subscribers.unsubscribe(chat_id, path)
+    text, keyboard = render_subscriptions(chat_id)
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    await callback.answer("🔕 Подписка отменена" if path is not None else None)
 
 
 # -------------------------
@@ -595,13 +733,13 @@ async def process_add_link(message: Message, state: FSMContext):
         "ссылка": link
     }
 
-    schedule_data.append(new_entry)
-    save_data()
+    added = await repo.add(new_entry)
 
     await message.answer(
         "╔═══════════════════════════╗\n"
         "║   ✅ <b>ЗАПИСЬ ДОБАВЛЕНА</b>   ║\n"
         "╚═══════════════════════════╝\n\n"
+        f"🆔 <b>ID:</b> <code>{added.id}</code>\n"
         f"🏫 <b>Класс:</b> <code>{new_entry['класс']}</code>\n"
         f"📅 <b>Полугодие:</b> <code>{new_entry['полугодие']}</code>\n"
         f"📚 <b>Предмет:</b> <code>{new_entry['предмет']}</code>\n"
@@ -617,48 +755,176 @@ async def process_add_link(message: Message, state: FSMContext):
 # -------------------------
 # АДМИН: LIST
 # -------------------------
+# Кнопки страниц: "lp:<режим>:<страница>:<id фильтра или ->:<a|b><id>" — страница
+# после (a) или перед (b) записью с этим id; номер страницы только для подписи
+LIST_PREFIX = "lp"
+LIST_PAGE_SIZE = 20
+LIST_HEADERS = {
+    "l": "╔═══════════════════════════╗\n║   📋 <b>ВСЕ ЗАПИСИ</b>   ║\n╚═══════════════════════════╝\n\n",
+    "d": "╔═══════════════════════════╗\n║   🗑️ <b>УДАЛЕНИЕ ЗАПИСИ</b>   ║\n╚═══════════════════════════╝\n\n"
+         "Введите ID записи для удаления (или 0 для отмены):\n\n",
+    "e": "╔═══════════════════════════╗\n║   ✏️ <b>РЕДАКТИРОВАНИЕ ЗАПИСИ</b>   ║\n╚═══════════════════════════╝\n\n"
+         "Введите ID записи для редактирования (или 0 для отмены):\n\n",
+}
+LIST_USAGE = "Фильтр: <code>/list 9А</code>, <code>/list 9А Математика</code>, <code>/list - Математика</code>"
+
+
+def parse_list_filter(text: str) -> Dict[str, str]:
+    """Аргументы команды: "[класс|-] [предмет]" -> {поле: значение}"""
+    parts = text.split(maxsplit=1)
+    filters = {}
+    if parts and parts[0] != "-":
+        filters["класс"] = parts[0]
+    if len(parts) > 1:
+        filters["предмет"] = parts[1]
+    return filters
+
+
+def listing_lines(rows):
+    for record_id, entry in rows:
+        yield (f"{record_id}. {entry['класс']} | {entry['предмет']} | "
+               f"{entry['экзамен']} | {entry['тип_материалов']}\n")
+
+
+async def render_list_page(mode: str, page: int, filter_text: str = "", after: Optional[int] = None,
+                           before: Optional[int] = None) -> Tuple[Optional[str], Optional[InlineKeyboardMarkup]]:
+    """Одна страница списка записей: строится только то, что на ней видно"""
+    filters = parse_list_filter(filter_text)
+    total, rows = await repo.list_page(LIST_PAGE_SIZE, filters, after=after, before=before)
+    if not total:
+        return None, None
+    pages = (total + LIST_PAGE_SIZE - 1) // LIST_PAGE_SIZE
+    if not rows and after is not None:
+        # записи после границы удалены, пока листали — показываем последнюю страницу
+        page = pages - 1
+        total, rows = await repo.list_page(LIST_PAGE_SIZE, filters, before=after + 1)
+    elif not rows:
+        page = 0
+        total, rows = await repo.list_page(LIST_PAGE_SIZE, filters)
+    if before is not None and len(rows) < LIST_PAGE_SIZE:
+        # перед страницей записей не осталось — это начало списка
+        page = 0
+    page = min(page, pages - 1)
+
+    footer = f"\n<b>Всего записей:</b> {total}"
+    if filters:
+        footer += " (фильтр: " + ", ".join(f"{field} = {value}" for field, value in filters.items()) + ")"
+    if pages > 1:
+        footer += f"\n<b>Страница:</b> {page + 1}/{pages}"
+        if not filters:
+            footer += "\n" + LIST_USAGE
+
+    parts = [LIST_HEADERS[mode]]
+    size = len(parts[0]) + len(footer)
+    shown = 0
+    for line in listing_lines(rows):
+        size += len(line)
+        if size > MESSAGE_LIMIT:
+            break
+        parts.append(line)
+        shown += 1
+    parts.append(footer)
+
+    if pages == 1:
+        return "".join(parts), None
+    fid = remember_arg(filter_text) if filters else "-"
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(
+            text="◀️", callback_data=f"{LIST_PREFIX}:{mode}:{page - 1}:{fid}:b{rows[0][0]}"))
+    if page < pages - 1:
+        # следующая страница начинается после последней показанной строки
+        buttons.append(InlineKeyboardButton(
+            text="▶️", callback_data=f"{LIST_PREFIX}:{mode}:{page + 1}:{fid}:a{rows[shown - 1][0]}"))
+    return "".join(parts), InlineKeyboardMarkup(inline_keyboard=[buttons])
+
+
+async def answer_list_page(message: Message, mode: str) -> bool:
+    """Первая страница списка для /list, /delete, /edit; False, если показывать нечего"""
+    args = message.text.split(maxsplit=1)
+    filter_text = args[1].strip() if len(args) > 1 else ""
+    text, keyboard = await render_list_page(mode, 0, filter_text)
+    if text is None:
+        await message.answer("🔍 Нет записей по этому фильтру" if filter_text else "📭 База данных пуста")
+        return False
+    await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+    return True
+
+
+@dp.callback_query(F.data.startswith(f"{LIST_PREFIX}:"))
+async def process_list_page(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет прав администратора", show_alert=True)
+        return
+    try:
+        _, mode, page, fid, anchor = callback.data.split(":")
+        page, anchor_id = int(page), int(anchor[1:])
+    except ValueError:
+        await callback.answer()
+        return
+    if mode not in LIST_HEADERS:
+        await callback.answer()
+        return
+
+    filter_text = "" if fid == "-" else callback_args.get(fid)
+    if filter_text is None:
+        await callback.answer("Список устарел, повторите команду", show_alert=True)
+        return
+
+    bounds = {"after": anchor_id} if anchor[:1] == "a" else {"before": anchor_id}
+    text, keyboard = await render_list_page(mode, max(page, 0), filter_text, **bounds)
+    if text is None:
+        await callback.answer("📭 Записей больше нет", show_alert=True)
+        return
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    await callback.answer()
+
+
 @dp.message(Command("list"))
 async def cmd_list(message: Message):
     if not is_admin(message.from_user.id):
         await message.answer("❌ У вас нет прав администратора")
         return
 
-    if not schedule_data:
-        await message.answer("📭 База данных пуста")
-        return
-
-    text = "╔═══════════════════════════╗\n║   📋 <b>ВСЕ ЗАПИСИ</b>   ║\n╚═══════════════════════════╝\n\n"
-    for i, entry in enumerate(schedule_data, 1):
-        text += (
-            f"{i}. {entry['класс']} | {entry['предмет']} | "
-            f"{entry['экзамен']} | {entry['тип_материалов']}\n"
-        )
-
-    text += f"\n<b>Всего записей:</b> {len(schedule_data)}"
-    await message.answer(text, parse_mode="HTML")
+    await answer_list_page(message, "l")
 
 
 # -------------------------
 # АДМИН: DELETE
 # -------------------------
+def format_conflict(current, action: str) -> str:
+    """Сообщение о том, что запись успел изменить другой администратор"""
+    return (
+        f"⚠️ <b>Запись #{current.id} уже изменил другой администратор.</b>\n"
+        f"{action}, чтобы не затереть чужую правку.\n\n"
+        "Сейчас в записи:\n"
+        f"🏫 <b>{current['класс']}</b> ({current['полугодие']} п/г) | {current['предмет']} | "
+        f"{current['экзамен']} | {current['тип_материалов']}\n\n"
+        "Проверьте данные и повторите команду."
+    )
+
+
+async def replaced_record(record_id: int, key) -> Optional[Record]:
+    """Текущая запись, если под id формы теперь другая запись (другой естественный ключ).
+
+    Версия одна не спасает: у восстановленной из копии или заново
+    импортированной записи с тем же id она снова может быть равна 1.
+    """
+    current = await repo.get_by_id(record_id)
+    if current is not None and key is not None and list(natural_key(current)) != key:
+        return current
+    return None
+
+
 @dp.message(Command("delete"))
 async def cmd_delete(message: Message, state: FSMContext):
     if not is_admin(message.from_user.id):
         await message.answer("❌ У вас нет прав администратора")
         return
 
-    if not schedule_data:
-        await message.answer("📭 База данных пуста")
-        return
-
     # Показываем список с номерами
-    text = "╔═══════════════════════════╗\n║   🗑️ <b>УДАЛЕНИЕ ЗАПИСИ</b>   ║\n╚═══════════════════════════╝\n\n"
-    text += "Введите номер записи для удаления (или 0 для отмены):\n\n"
-    for i, entry in enumerate(schedule_data, 1):
-        text += f"{i}. {entry['класс']} | {entry['предмет']} | {entry['экзамен']} | {entry['тип_материалов']}\n"
-
-    await message.answer(text, parse_mode="HTML")
-    await state.set_state(AdminStates.deleting_record)
+    if await answer_list_page(message, "d"):
+        await state.set_state(AdminStates.deleting_record)
 
 
 @dp.message(AdminStates.deleting_record)
@@ -669,17 +935,19 @@ async def process_delete_choice(message: Message, state: FSMContext):
         return
 
     try:
-        idx = int(message.text.strip())
+        record_id = int(message.text.strip())
     except ValueError:
-        await message.answer("❌ Введите корректный номер записи:")
+        await message.answer("❌ Введите корректный ID записи:")
         return
 
-    if not (1 <= idx <= len(schedule_data)):
-        await message.answer("❌ Номер вне диапазона. Попробуйте снова:")
+    entry = await repo.get_by_id(record_id)
+    if entry is None:
+        await message.answer("❌ Записи с таким ID нет. Попробуйте снова:")
         return
 
-    await state.update_data(delete_index=idx - 1)
-    entry = schedule_data[idx - 1]
+    # версия на момент показа: если запись успеют изменить, удаление не пройдёт
+    await state.update_data(delete_id=record_id, delete_version=entry.version,
+                            delete_key=list(natural_key(entry)))
     await message.answer(
         "⚠️ Вы подтверждаете удаление записи:\n\n"
         f"🏫 <b>{entry['класс']}</b> | {entry['предмет']} | {entry['экзамен']} | {entry['тип_материалов']}\n\n"
@@ -701,14 +969,23 @@ async def process_delete_confirm(message: Message, state: FSMContext):
         return
 
     data = await state.get_data()
-    idx = data.get("delete_index")
-    if idx is None or not (0 <= idx < len(schedule_data)):
+    record_id = data.get("delete_id")
+    current = await replaced_record(record_id, data.get("delete_key")) if record_id is not None else None
+    if current is not None:
+        await message.answer(format_conflict(current, "Удаление отменено"), parse_mode="HTML")
+        await state.clear()
+        return
+    try:
+        removed = await repo.delete(record_id, data.get("delete_version")) if record_id is not None else None
+    except VersionConflict as e:
+        await message.answer(format_conflict(e.current, "Удаление отменено"), parse_mode="HTML")
+        await state.clear()
+        return
+    if removed is None:
         await message.answer("❌ Ошибка. Запись не найдена.")
         await state.clear()
         return
 
-    removed = schedule_data.pop(idx)
-    save_data()
     await message.answer(
         "✅ Запись успешно удалена:\n"
         f"🏫 <b>{removed['класс']}</b> | {removed['предмет']} | {removed['экзамен']} | {removed['тип_материалов']}",
@@ -737,17 +1014,8 @@ async def cmd_edit(message: Message, state: FSMContext):
         await message.answer("❌ У вас нет прав администратора")
         return
 
-    if not schedule_data:
-        await message.answer("📭 База данных пуста")
-        return
-
-    text = "╔═══════════════════════════╗\n║   ✏️ <b>РЕДАКТИРОВАНИЕ ЗАПИСИ</b>   ║\n╚═══════════════════════════╝\n\n"
-    text += "Введите номер записи для редактирования (или 0 для отмены):\n\n"
-    for i, entry in enumerate(schedule_data, 1):
-        text += f"{i}. {entry['класс']} | {entry['предмет']} | {entry['экзамен']} | {entry['тип_материалов']}\n"
-
-    await message.answer(text, parse_mode="HTML")
-    await state.set_state(AdminStates.editing_select_record)
+    if await answer_list_page(message, "e"):
+        await state.set_state(AdminStates.editing_select_record)
 
 
 @dp.message(AdminStates.editing_select_record)
@@ -758,16 +1026,18 @@ async def process_edit_select(message: Message, state: FSMContext):
         return
 
     try:
-        idx = int(message.text.strip())
+        record_id = int(message.text.strip())
     except ValueError:
-        await message.answer("❌ Введите корректный номер записи:")
+        await message.answer("❌ Введите корректный ID записи:")
         return
 
-    if not (1 <= idx <= len(schedule_data)):
-        await message.answer("❌ Номер вне диапазона. Попробуйте снова:")
+    entry = await repo.get_by_id(record_id)
+    if entry is None:
+        await message.answer("❌ Записи с таким ID нет. Попробуйте снова:")
         return
 
-    await state.update_data(edit_index=idx - 1)
+    await state.update_data(edit_id=record_id, edit_version=entry.version,
+                            edit_key=list(natural_key(entry)))
     text = "Выберите поле для редактирования:\n"
     text += "1. класс\n2. полугодие\n3. предмет\n4. экзамен\n5. тип_материалов\n6. информация\n7. ссылка\n\nВведите цифру поля (или 0 для отмены):"
     await message.answer(text)
@@ -799,18 +1069,30 @@ async def process_edit_value(message: Message, state: FSMContext):
         return
 
     data = await state.get_data()
-    idx = data.get("edit_index")
+    record_id = data.get("edit_id")
     field = data.get("edit_field")
     new_value = message.text.strip()
 
-    if idx is None or field is None:
+    if record_id is None or field is None:
         await message.answer("❌ Ошибка состояния. Попробуйте снова.")
         await state.clear()
         return
 
-    old_value = schedule_data[idx].get(field, "")
-    schedule_data[idx][field] = new_value
-    save_data()
+    current = await replaced_record(record_id, data.get("edit_key"))
+    if current is not None:
+        await message.answer(format_conflict(current, "Изменение не сохранено"), parse_mode="HTML")
+        await state.clear()
+        return
+    try:
+        old_value = await repo.update(record_id, field, new_value, data.get("edit_version"))
+    except VersionConflict as e:
+        await message.answer(format_conflict(e.current, "Изменение не сохранено"), parse_mode="HTML")
+        await state.clear()
+        return
+    if old_value is None:
+        await message.answer("❌ Ошибка. Запись не найдена.")
+        await state.clear()
+        return
 
     await message.answer(
         "✅ Запись обновлена.\n\n"
@@ -825,6 +1107,58 @@ async def process_edit_value(message: Message, state: FSMContext):
 # -------------------------
 # SEARCH (улучшенный)
 # -------------------------
+# Кнопки страниц: "sp:<id запроса>:<страница>", запрос хранится в callback_args
+SEARCH_PREFIX = "sp"
+SEARCH_PAGE_SIZE = 10
+
+
+async def render_search_page(query: str, page: int) -> Tuple[Optional[str], Optional[InlineKeyboardMarkup]]:
+    """Текст и кнопки страницы результатов (None, если ничего не найдено)"""
+    total, found_records = await repo.search(query, page * SEARCH_PAGE_SIZE, SEARCH_PAGE_SIZE)
+    corrected = None
+    if not total:
+        # точных совпадений нет — пробуем исправить опечатку
+        for suggestion in await repo.suggest(query):
+            total, found_records = await repo.search(suggestion, page * SEARCH_PAGE_SIZE, SEARCH_PAGE_SIZE)
+            if total:
+                corrected = suggestion
+                break
+        else:
+            return None, None
+    search_query = corrected or query
+    pages = (total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+    page = min(page, pages - 1)
+    if not found_records:
+        # результатов стало меньше, чем было при листании
+        total, found_records = await repo.search(search_query, page * SEARCH_PAGE_SIZE, SEARCH_PAGE_SIZE)
+
+    text = ""
+    if corrected:
+        text += f"🤔 Точных совпадений нет. Показаны результаты для «{corrected}»\n\n"
+    text += f"🔎 <b>Найдено записей: {total}</b>"
+    if pages > 1:
+        text += f" (стр. {page + 1}/{pages})"
+    text += "\n\n"
+    for entry in found_records:
+        item = (
+            f"🔹 <b>{entry['класс']}</b> ({entry['полугодие']} п/г) — {entry['предмет']}\n"
+            f"   └ {entry['экзамен']} | {entry['тип_материалов']}\n\n"
+        )
+        if len(text) + len(item) > MESSAGE_LIMIT:
+            break
+        text += item
+
+    if pages == 1:
+        return text, None
+    sid = remember_arg(query)
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="◀️", callback_data=f"{SEARCH_PREFIX}:{sid}:{page - 1}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton(text="▶️", callback_data=f"{SEARCH_PREFIX}:{sid}:{page + 1}"))
+    return text, InlineKeyboardMarkup(inline_keyboard=[buttons])
+
+
 @dp.message(Command("search"))
 async def cmd_search(message: Message):
     args = message.text.split(maxsplit=1)
@@ -838,27 +1172,35 @@ async def cmd_search(message: Message):
         )
         return
 
-    query = args[1].lower()
-    found_records = []
-
-    for entry in schedule_data:
-        # Проверяем все поля, приводя к строке
-        concatenated = " ".join(str(v).lower() for v in entry.values())
-        if query in concatenated:
-            found_records.append(entry)
+    text, keyboard = await render_search_page(args[1], 0)
 
-    if not found_records:
+    if text is None:
         await message.answer(f"😔 По запросу «{args[1]}» ничего не найдено.")
         return
 
-    text = f"🔎 <b>Найдено записей: {len(found_records)}</b>\n\n"
-    for entry in found_records:
-        text += (
-            f"🔹 <b>{entry['класс']}</b> ({entry['полугодие']} п/г) — {entry['предмет']}\n"
-            f"   └ {entry['экзамен']} | {entry['тип_материалов']}\n\n"
-        )
+    await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
 
-    await message.answer(text, parse_mode="HTML")
+
+@dp.callback_query(F.data.startswith(f"{SEARCH_PREFIX}:"))
+async def process_search_page(callback: CallbackQuery):
+    try:
+        _, sid, page = callback.data.split(":")
+        page = int(page)
+    except ValueError:
+        await callback.answer()
+        return
+
+    query = callback_args.get(sid)
+    if query is None:
+        await callback.answer("Результаты поиска устарели, повторите /search", show_alert=True)
+        return
+
+    text, keyboard = await render_search_page(query, max(page, 0))
+    if text is None:
+        await callback.answer("😔 Записей по этому запросу больше нет", show_alert=True)
+        return
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    await callback.answer()
 
 
 # -------------------------
@@ -872,6 +1214,7 @@ async def cmd_help(message: Message):
         "╚═══════════════════════════╝\n\n"
         "/start - Начать работу\n"
         "/search - Поиск по базе\n"
+        "/subscriptions - Мои подписки на разделы\n"
         "/help - Эта справка\n"
     )
 
@@ -882,13 +1225,15 @@ async def cmd_help(message: Message):
         "/edit - Редактировать запись\n"
         "/list - Список всех записей\n"
         "/stats - Статистика базы\n"
-        "/export - Экспорт базы (JSON)\n"
-        "/import - Импорт базы (JSON)\n"
+        "/export - Экспорт базы (JSON; /export csv [класс|-] [полугодие] — таблица)\n"
+        "/import - Импорт базы (JSON или CSV)\n"
         "/backup - Создать резервную копию\n"
+        "/restore - Восстановить базу из резервной копии\n"
         "/addadmin - Добавить админа\n"
         "/listadmins - Список админов\n"
         "/analytics - Простая аналитика\n"
-        "/notify - Отправить тестовое уведомление (адм.)"
+        "/perf - Время ответа обработчиков и записи на диск\n"
+        "/notify - Рассылка всем пользователям бота"
     )
 
     text = user_text
@@ -907,15 +1252,15 @@ async def cmd_stats(message: Message):
         await message.answer("❌ Только для администраторов")
         return
 
-    total_records = len(schedule_data)
-    unique_classes = get_unique_classes()
-    unique_subjects = set(item['предмет'] for item in schedule_data)
-    unique_exams = set(item['экзамен'] for item in schedule_data)
+    total_records = await repo.count()
+    class_counts = await repo.count_by('класс')
+    unique_classes = sorted(class_counts)
+    unique_subjects = await repo.count_by('предмет')
+    unique_exams = await repo.count_by('экзамен')
 
     class_stats = ""
     for cls in unique_classes:
-        count = sum(1 for item in schedule_data if item['класс'] == cls)
-        class_stats += f"• {cls}: {count} записей\n"
+        class_stats += f"• {cls}: {class_counts[cls]} записей\n"
 
     text = (
         "╔═══════════════════════════╗\n"
@@ -934,15 +1279,73 @@ async def cmd_stats(message: Message):
 # -------------------------
 # EXPORT / IMPORT / BACKUP
 # -------------------------
+def parse_export_filter(text: str) -> Dict[str, str]:
+    """Аргументы /export csv: "[класс|-] [полугодие]" -> {поле: значение}"""
+    parts = text.split()
+    filters = {}
+    if parts and parts[0] != "-":
+        filters["класс"] = parts[0]
+    if len(parts) > 1:
+        filters["полугодие"] = parts[1]
+    return filters
+
+
+async def send_csv_export(message: Message, filter_text: str):
+    filters = parse_export_filter(filter_text)
+    payload, count = await export_csv(repo, run_io, filters)
+    if not count:
+        await message.answer("❌ Нет записей для экспорта.")
+        return
+    name = "_".join(["schedule", *filters.values()])
+    caption = f"📤 Экспорт базы (CSV), записей: {count}"
+    if filters:
+        caption += "\nФильтр: " + ", ".join(f"{field} = {value}" for field, value in filters.items())
+    await message.answer_document(BufferedInputFile(payload, filename=f"{name}.csv"), caption=caption)
+
+
 @dp.message(Command("export"))
 async def cmd_export(message: Message):
     if not is_admin(message.from_user.id):
         await message.answer("❌ Только для администраторов")
         return
 
-    # Убедимся, что данные сохранены
-    save_data()
-    await message.answer_document(InputFile(DATA_FILE), caption="📤 Экспорт базы данных (JSON)")
+    args = message.text.split()[1:]
+    if args and args[0].lower() == "csv":
+        await send_csv_export(message, " ".join(args[1:]))
+        return
+
+    # Выгружаем актуальное состояние хранилища (для любого бэкенда)
+    records = await repo.all_records()
+    payload = await run_io(dump_json_bytes, records)
+    await message.answer_document(
+        BufferedInputFile(payload, filename=DATA_FILE), caption="📤 Экспорт базы данных (JSON)"
+    )
+
+
+BACKUP_LABELS = {"manual": "вручную", "auto": "автоматически", "pre-restore": "перед восстановлением"}
+
+
+async def make_backup(label: str, skip_unchanged: bool = False):
+    """Снимок текущей базы и ротация старых снимков"""
+    records = await repo.all_records()
+    result = await run_io(backup_store.create, records, label, skip_unchanged)
+    await run_io(backup_store.prune, BACKUP_KEEP_LAST, BACKUP_KEEP_HOURLY, BACKUP_KEEP_DAILY)
+    return result
+
+
+async def backup_worker():
+    """Плановые резервные копии; если база не менялась, снимок не создаётся"""
+    while True:
+        await asyncio.sleep(BACKUP_INTERVAL)
+        try:
+            await make_backup("auto", skip_unchanged=True)
+        except Exception as e:
+            print(f"Ошибка автоматического резервного копирования: {e}")
+
+
+def format_snapshot(info) -> str:
+    return (f"<code>{info.name}</code> — {info.created:%d.%m.%Y %H:%M}, "
+            f"записей: {info.records}, {BACKUP_LABELS.get(info.label, info.label)}")
 
 
 @dp.message(Command("backup"))
@@ -951,15 +1354,135 @@ async def cmd_backup(message: Message):
         await message.answer("❌ Только для администраторов")
         return
 
-    ensure_backup_dir()
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_name = os.path.join(BACKUP_DIR, f"backup_{timestamp}.json")
     try:
-        with open(backup_name, 'w', encoding='utf-8') as f:
-            json.dump(schedule_data, f, ensure_ascii=False, indent=2)
-        await message.answer(f"✅ Резервная копия создана: <code>{backup_name}</code>", parse_mode="HTML")
+        result = await make_backup("manual")
     except Exception as e:
         await message.answer(f"❌ Ошибка при создании бэкапа: {e}")
+        return
+    await message.answer(
+        f"✅ Резервная копия создана: <code>{result.snapshot.name}</code>\n"
+        f"Записей: {result.snapshot.records}\n"
+        f"Новых блоков: {result.new_chunks} из {result.chunks} ({result.new_bytes // 1024} КБ)\n\n"
+        "Восстановление — /restore",
+        parse_mode="HTML"
+    )
+
+
+async def ask_restore_confirm(message: Message, state: FSMContext, name: str):
+    snapshots = {info.name: info for info in await run_io(backup_store.snapshots)}
+    info = snapshots.get(name)
+    if info is None:
+        await message.answer("❌ Такого снимка нет. Введите номер или имя из списка (0 для отмены):")
+        await state.set_state(AdminStates.restoring_select)
+        return
+    await state.update_data(restore_name=name)
+    await message.answer(
+        f"⚠️ База будет заменена снимком {format_snapshot(info)}.\n"
+        "Текущее состояние сохранится отдельной копией.\n\n"
+        "Напишите 'ДА' для подтверждения или 0 для отмены.",
+        parse_mode="HTML"
+    )
+    await state.set_state(AdminStates.restoring_confirm)
+
+
+@dp.message(Command("restore"))
+async def cmd_restore(message: Message, state: FSMContext):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Только для администраторов")
+        return
+
+    args = message.text.split()[1:]
+    if args:
+        await ask_restore_confirm(message, state, args[0])
+        return
+
+    snapshots = await run_io(backup_store.snapshots)
+    if not snapshots:
+        await message.answer("📭 Резервных копий пока нет. Создайте её командой /backup.")
+        return
+    lines = [f"{number}. {format_snapshot(info)}"
+             for number, info in enumerate(snapshots[:RESTORE_LIST_SIZE], 1)]
+    await state.update_data(restore_names=[info.name for info in snapshots[:RESTORE_LIST_SIZE]])
+    await message.answer(
+        "🗄 <b>Резервные копии</b> (от новых к старым):\n\n" + "\n".join(lines) +
+        "\n\nВведите номер или имя снимка (или 0 для отмены):",
+        parse_mode="HTML"
+    )
+    await state.set_state(AdminStates.restoring_select)
+
+
+@dp.message(AdminStates.restoring_select)
+async def process_restore_choice(message: Message, state: FSMContext):
+    choice = (message.text or "").strip()
+    if choice == "0":
+        await message.answer("❌ Восстановление отменено.")
+        await state.clear()
+        return
+
+    names = (await state.get_data()).get("restore_names", [])
+    if choice.isdigit() and 1 <= int(choice) <= len(names):
+        choice = names[int(choice) - 1]
+    await ask_restore_confirm(message, state, choice)
+
+
+@dp.message(AdminStates.restoring_confirm)
+async def process_restore_confirm(message: Message, state: FSMContext):
+    answer = (message.text or "").strip()
+    if answer == "0":
+        await message.answer("❌ Восстановление отменено.")
+        await state.clear()
+        return
+    if answer.lower() != "да":
+        await message.answer("❌ Для восстановления нужно написать 'ДА' или 0 для отмены.")
+        return
+
+    name = (await state.get_data()).get("restore_name")
+    await state.clear()
+    try:
+        records = await run_io(backup_store.load, name)
+        # текущее состояние тоже сохраняем, чтобы восстановление можно было отменить
+        safety = await make_backup("pre-restore")
+        result = await repo.restore(records)
+    except Exception as e:
+        await message.answer(f"❌ Ошибка при восстановлении: {e}")
+        return
+    await message.answer(
+        f"✅ База восстановлена из снимка <code>{name}</code>\n\n"
+        f"Добавлено: {result.added}\n"
+        f"Изменено: {result.updated}\n"
+        f"Удалено: {result.deleted}\n\n"
+        f"Прежнее состояние: <code>{safety.snapshot.name}</code>",
+        parse_mode="HTML"
+    )
+
+
+IMPORT_PROGRESS_INTERVAL = 2.0   # не чаще раза в столько секунд правим сообщение о ходе импорта
+IMPORT_PHASES = {"check": "Проверка", "apply": "Загрузка"}
+IMPORT_USAGE = (
+    "Режимы: <code>/import</code> — объединить (совпадающие записи обновляются), "
+    "<code>/import replace</code> — заменить базу содержимым файла, "
+    "<code>dry-run</code> — только посчитать изменения, например <code>/import replace dry-run</code>."
+)
+
+
+def format_import_report(report) -> str:
+    if report.failed:
+        text = f"❌ Импорт отменён: ошибок в файле — {report.error_count} из {report.total} записей.\n\n"
+        text += "\n".join(report.errors)
+        if report.error_count > len(report.errors):
+            text += "\n…"
+        return text
+    title = "🔎 Пробный импорт (данные не изменены)" if report.dry_run else "✅ Импорт завершён"
+    text = (
+        f"{title}\n\n"
+        f"Записей в файле: {report.total}\n"
+        f"Добавлено: {report.added}\n"
+        f"Обновлено: {report.updated}\n"
+        f"Без изменений: {report.unchanged}"
+    )
+    if report.mode == "replace":
+        text += f"\nУдалено: {report.deleted}"
+    return text
 
 
 @dp.message(Command("import"))
@@ -968,8 +1491,19 @@ async def cmd_import(message: Message, state: FSMContext):
         await message.answer("❌ Только для администраторов")
         return
 
+    args = message.text.split()[1:]
+    unknown = [arg for arg in args if arg not in IMPORT_MODES and arg != "dry-run"]
+    if unknown:
+        await message.answer(f"❌ Неизвестный режим: {' '.join(unknown)}\n\n{IMPORT_USAGE}", parse_mode="HTML")
+        return
+    mode = "replace" if "replace" in args else "merge"
+    await state.update_data(import_mode=mode, import_dry_run="dry-run" in args)
+
     await message.answer(
-        "📥 Отправьте JSON-файл для импорта (формат как у export). Или напишите 0 для отмены."
+        "📥 Отправьте файл для импорта: JSON (формат как у export), NDJSON — по записи в строке, "
+        "или CSV-таблицу с заголовком (столбцы как у /export csv). "
+        "Или напишите 0 для отмены.\n\n" + IMPORT_USAGE,
+        parse_mode="HTML"
     )
     await state.set_state(AdminStates.importing_data)
 
@@ -982,40 +1516,47 @@ async def process_import_file(message: Message, state: FSMContext):
         return
 
     if not message.document:
-        await message.answer("❌ Пожалуйста, прикрепите JSON-файл.")
+        await message.answer("❌ Пожалуйста, прикрепите файл.")
         return
 
-    # Скачиваем файл
-    try:
-        filename = "import_temp.json"
-        await message.document.download(destination_file=filename)
-        with open(filename, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        if not isinstance(data, list):
-            await message.answer("❌ Неверный формат файла. Ожидается список записей.")
-            os.remove(filename)
-            await state.clear()
+    data = await state.get_data()
+    await state.clear()
+    filename = message.document.file_name or ""
+    # у каждого импорта свой временный файл: параллельные загрузки не мешают друг другу
+    fd, path = tempfile.mkstemp(prefix="import_", suffix=os.path.splitext(filename)[1])
+    os.close(fd)
+    status = await message.answer("⏳ Файл получен, начинаю импорт…")
+    last_update, last_text = 0.0, status.text
+
+    async def progress(phase: str, done: int, total: int, records: int):
+        nonlocal last_update, last_text
+        now = time.monotonic()
+        if now - last_update < IMPORT_PROGRESS_INTERVAL:
             return
+        percent = done * 100 // total if total else 100
+        text = f"⏳ {IMPORT_PHASES[phase]}: {percent}% (записей: {records})"
+        if text == last_text:
+            return
+        last_update, last_text = now, text
+        try:
+            await status.edit_text(text)
+        except TelegramBadRequest:
+            pass
 
-        # Валидируем примерно структуру записей
-        for i, rec in enumerate(data):
-            if not all(k in rec for k in ("класс", "полугодие", "предмет", "экзамен", "тип_материалов", "информация")):
-                await message.answer(f"❌ Неверная структура в записи #{i+1}. Операция прервана.")
-                os.remove(filename)
-                await state.clear()
-                return
-
-        # Импортируем - объединяем (можно изменить логику на замену)
-        schedule_data.extend(data)
-        save_data()
-
-        os.remove(filename)
-        await message.answer(f"✅ Импорт завершен. Добавлено записей: {len(data)}")
+    try:
+        await bot.download(message.document, destination=path)
+        report = await import_file(
+            repo, path, data.get("import_mode", "merge"), run_io,
+            dry_run=data.get("import_dry_run", False), filename=filename, progress=progress,
+        )
+        await message.answer(format_import_report(report))
     except Exception as e:
         await message.answer(f"❌ Ошибка при импорте: {e}")
     finally:
-        await state.clear()
+        try:
+            await run_io(os.remove, path)
+        except OSError:
+            pass
 
 
 # -------------------------
@@ -1050,7 +1591,8 @@ async def process_addadmin(message: Message, state: FSMContext):
         return
 
     ADMIN_IDS.append(new_id)
-    # Сохранение ADMIN_IDS в файл не реализовано — можно добавить хранение конфигурации
+    await run_io(save_admins)
+    publish_to_peers({"type": "admins"})
     await message.answer(f"✅ Пользователь <code>{new_id}</code> добавлен в список администраторов.", parse_mode="HTML")
     await state.clear()
 
@@ -1078,9 +1620,7 @@ async def cmd_analytics(message: Message):
         return
 
     # Топ предметов
-    subject_count = {}
-    for rec in schedule_data:
-        subject_count[rec['предмет']] = subject_count.get(rec['предмет'], 0) + 1
+    subject_count = await repo.count_by('предмет')
 
     top = sorted(subject_count.items(), key=lambda x: x[1], reverse=True)[:10]
     text = "📈 <b>Простая аналитика</b>\n\nТоп предметов по количеству записей:\n"
@@ -1091,8 +1631,59 @@ async def cmd_analytics(message: Message):
 
 
 # -------------------------
-# NOTIFY (пример: отправка уведомления всем админам или подписанным)
+# Ошибки записи на диск
 # -------------------------
+STORAGE_ERROR_TEXT = "❌ Не удалось сохранить изменение на диск, оно отменено. Попробуйте ещё раз позже."
+
+
+@dp.error(ExceptionTypeFilter(PersistenceError))
+async def storage_error(event: ErrorEvent):
+    """Правка не записалась (диск переполнен, ошибка ввода-вывода): сообщаем администратору"""
+    update = event.update
+    try:
+        if update.callback_query is not None:
+            await update.callback_query.answer(STORAGE_ERROR_TEXT, show_alert=True)
+        elif update.message is not None:
+            await update.message.answer(STORAGE_ERROR_TEXT)
+    except TelegramBadRequest:
+        pass
+    return True
+
+
+# -------------------------
+# NOTIFY: рассылка всем пользователям бота
+# -------------------------
+def format_broadcast(job, final: bool) -> str:
+    if final and job.status == "done":
+        title = f"✅ Рассылка #{job.id} завершена за {int(job.finished - job.created)} с"
+    else:
+        title = f"📣 Рассылка #{job.id}: {job.done} из {job.total}"
+    return (
+        f"{title}\n\n"
+        f"Доставлено: {job.sent}\n"
+        f"Заблокировали бота: {job.blocked}\n"
+        f"Ошибок: {job.failed}"
+    )
+
+
+async def report_broadcast(job, final: bool):
+    """Ход рассылки — правкой сообщения у отправителя, итог — отдельным сообщением"""
+    text = format_broadcast(job, final)
+    if job.message_id is not None:
+        try:
+            await bot.edit_message_text(text, chat_id=job.sender, message_id=job.message_id)
+        except TelegramBadRequest:
+            pass
+    if final:
+        await bot.send_message(job.sender, text)
+
+
+broadcaster = Broadcaster(bot, subscribers, rate=BROADCAST_RATE, concurrency=BROADCAST_CONCURRENCY,
+                          report=report_broadcast)
+notifier = ChangeNotifier(subscribers, broadcaster, delay=NOTIFY_DELAY)
+repo.add_listener(notifier.record_changed)
+
+
 @dp.message(Command("notify"))
 async def cmd_notify(message: Message):
     if not is_admin(message.from_user.id):
@@ -1101,18 +1692,100 @@ async def cmd_notify(message: Message):
 
     args = message.text.split(maxsplit=1)
     if len(args) < 2:
-        await message.answer("Использование: /notify текст_уведомления")
+        await message.answer("Использование: /notify текст_уведомления\n\n"
+                             f"Сообщение получат все пользователи бота ({len(subscribers)}).")
         return
 
-    text = args[1]
-    # Для примера: отправляем всем админам
-    for aid in ADMIN_IDS:
-        try:
-            await bot.send_message(aid, f"🔔 Уведомление от администратора:\n\n{text}")
-        except Exception:
-            pass
+    status = await message.answer(f"📣 Рассылка запущена, получателей: {len(subscribers)}")
+    await broadcaster.broadcast(f"🔔 Уведомление от администратора:\n\n{args[1]}",
+                                sender=message.chat.id, message_id=status.message_id)
+
 
-    await message.answer("✅ Уведомления отправлены админам.")
+# -------------------------
+# PERF: метрики обработчиков
+# -------------------------
+PERF_TOP = 15
+
+
+def format_timings(series) -> List[str]:
+    """Строки "имя — вызовов, p50 / p95 мс" от самых затратных по суммарному времени"""
+    lines = []
+    for labels, histogram in sorted(series.items(), key=lambda item: item[1].sum, reverse=True)[:PERF_TOP]:
+        name = dict(labels).get("handler") or dict(labels).get("op", "")
+        lines.append(f"• <code>{name}</code> — {histogram.count}, "
+                     f"{histogram.quantile(0.5) * 1000:.1f} / {histogram.quantile(0.95) * 1000:.1f}")
+    return lines
+
+
+@dp.message(Command("perf"))
+async def cmd_perf(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Только для администраторов")
+        return
+
+    uptime = time.time() - metrics.started
+    updates = sum(metrics.counters("bot_updates_total").values())
+    errors = {dict(labels)["handler"]: count for labels, count in metrics.counters("bot_handler_errors_total").items()}
+    text = (
+        f"⏱ <b>Производительность</b> за {int(uptime // 3600)} ч {int(uptime % 3600 // 60)} мин\n"
+        f"Апдейтов: <b>{int(updates)}</b> ({updates / max(uptime, 1):.2f} в секунду), "
+        f"ошибок в обработчиках: <b>{int(sum(errors.values()))}</b>\n"
+    )
+    sections = (
+        ("Обработчики", "bot_handler_seconds"),
+        ("FSM-хранилище", "bot_fsm_seconds"),
+        ("Запись данных", "bot_storage_seconds"),
+    )
+    for title, name in sections:
+        lines = format_timings(metrics.histograms(name))
+        if lines:
+            text += f"\n<b>{title}</b> (вызовов, p50 / p95 мс):\n" + "\n".join(lines) + "\n"
+    if errors:
+        text += "\n<b>Ошибки:</b>\n" + "\n".join(
+            f"• <code>{name}</code> — {int(count)}" for name, count in sorted(errors.items(), key=lambda item: -item[1]))
+    if METRICS_PORT:
+        text += f"\n\nПодробно: http://{METRICS_HOST}:{METRICS_PORT + worker_index}/metrics"
+    await message.answer(text, parse_mode="HTML")
+
+
+# -------------------------
+# Запуск и остановка хранилища
+# -------------------------
+@dp.startup()
+async def on_startup():
+    global backup_task, metrics_runner
+    await repo.start()
+    if METRICS_PORT and metrics_runner is None:
+        try:
+            metrics_runner = await start_metrics_server(metrics, METRICS_HOST, METRICS_PORT + worker_index)
+        except OSError as e:
+            print(f"Сервер метрик не запущен: {e}")
+    if peers is not None:
+        peers.start()
+        subscribers.publish = peers.publish
+    if worker_index:
+        return
+    if BACKUP_INTERVAL > 0 and backup_task is None:
+        backup_task = asyncio.create_task(backup_worker())
+    await broadcaster.start()
+
+
+@dp.shutdown()
+async def on_shutdown():
+    global backup_task, metrics_runner
+    if backup_task is not None:
+        backup_task.cancel()
+        await asyncio.gather(backup_task, return_exceptions=True)
+        backup_task = None
+    await notifier.close()
+    await broadcaster.close()
+    await subscribers.close()
+    if peers is not None:
+        peers.close()
+    await repo.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+        metrics_runner = None
 
 
 # -------------------------
@@ -1129,12 +1802,100 @@ async def fallback_handler(message: Message):
 # -------------------------
 # Запуск
 # -------------------------
-if __name__ == "__main__":
-    print("Бот запущен...")
+def parse_args(argv=None) -> argparse.Namespace:
+    """Флаги командной строки переопределяют настройки из config.py"""
+    parser = argparse.ArgumentParser(description="Бот с материалами к экзаменам")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default=RUN_MODE,
+                        help="получать апдейты long polling или через webhook")
+    parser.add_argument("--host", default=WEBHOOK_HOST, help="адрес, на котором слушает webhook-сервер")
+    parser.add_argument("--port", type=int, default=WEBHOOK_PORT)
+    parser.add_argument("--path", default=WEBHOOK_PATH, help="путь webhook, например /webhook")
+    parser.add_argument("--webhook-url", default=WEBHOOK_URL,
+                        help="внешний адрес (https://bot.example.com); если задан, вызывается setWebhook")
+    parser.add_argument("--secret", default=WEBHOOK_SECRET,
+                        help="секрет для заголовка X-Telegram-Bot-Api-Secret-Token")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="число процессов webhook-сервера на одном порту")
+    # номер воркера: основной процесс передаёт его дочерним
+    parser.add_argument("--worker-index", type=int, default=0, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def check_workers(args: argparse.Namespace) -> Optional[str]:
+    """Почему нельзя запустить args.workers процессов (None — можно)"""
+    if args.workers <= 1:
+        return None
+    if args.mode != "webhook":
+        return "несколько воркеров работают только в режиме webhook"
+    if STORAGE_BACKEND != "sqlite":
+        return "несколько воркеров требуют STORAGE_BACKEND = \"sqlite\""
+    if FSM_STORAGE != "sqlite":
+        return "несколько воркеров требуют FSM_STORAGE = \"sqlite\""
+    return None
+
+
+def spawn_workers(args: argparse.Namespace, secret: str) -> List[subprocess.Popen]:
+    """Запустить воркеры 1..N-1; база к этому моменту уже создана основным процессом"""
+    # секрет передаём явно: случайный секрет этого запуска должен быть общим
+    argv = [sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--secret", secret]
+    return [subprocess.Popen([*argv, "--worker-index", str(index)]) for index in range(1, args.workers)]
+
+
+def stop_workers(workers: List[subprocess.Popen]):
+    for process in workers:
+        if process.poll() is None:
+            process.terminate()
+    for process in workers:
+        try:
+            process.wait(timeout=WEBHOOK_DRAIN_TIMEOUT + 5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def run_polling():
+    # webhook и getUpdates не работают одновременно
+    await bot.delete_webhook()
+    await dp.start_polling(bot)
+
+
+def run_webhook(args: argparse.Namespace):
+    global worker_index, peers
+    secret = args.secret
+    if not secret and args.webhook_url:
+        # webhook ставим сами — секрет можно выдумать на этот запуск
+        secret = secrets.token_urlsafe(32)
+    if not secret and not args.worker_index:
+        print("⚠️ WEBHOOK_SECRET не задан: апдейты принимаются без проверки отправителя")
+    workers: List[subprocess.Popen] = []
+    if args.workers > 1:
+        worker_index = args.worker_index
+        peers = PeerChannel(IPC_DIR, apply_peer_message)
+        storage.shared = True
+        # лимит Telegram общий на бота — делим его между процессами
+        broadcaster.bucket = TokenBucket(BROADCAST_RATE / args.workers)
+        if not worker_index:
+            workers = spawn_workers(args, secret)
+    # setWebhook вызывает только основной процесс
+    url = "" if worker_index else args.webhook_url
+    app = create_webhook_app(dp, bot, args.path, secret, url, drain_timeout=WEBHOOK_DRAIN_TIMEOUT)
     try:
-        import asyncio
-        from aiogram import exceptions
+        # run_app сам останавливает сервер по SIGINT/SIGTERM и вызывает on_shutdown
+        web.run_app(app, host=args.host, port=args.port, print=None, reuse_port=args.workers > 1)
+    finally:
+        stop_workers(workers)
+
 
-        asyncio.run(dp.start_polling(bot))
+if __name__ == "__main__":
+    args = parse_args()
+    problem = check_workers(args)
+    if problem:
+        raise SystemExit(f"❌ {problem}")
+    if not args.worker_index:
+        print(f"Бот запущен ({args.mode}, воркеров: {max(args.workers, 1)})...")
+    try:
+        if args.mode == "webhook":
+            run_webhook(args)
+        else:
+            asyncio.run(run_polling())
     except (KeyboardInterrupt, SystemExit):
         print("Останавливаем бота...")
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""Метрики бота: время обработчиков, счётчики апдейтов и ошибок, время записи на диск.
+
+Выдаются в текстовом формате Prometheus на локальном HTTP-адресе (/metrics)
+и кратко — командой /perf. Всё хранится в памяти процесса и обнуляется
+при перезапуске.
+"""
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+# Границы корзин гистограмм, секунды (от быстрого ответа из кэша до медленного импорта)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Число наблюдений по корзинам; последняя корзина — всё, что дольше BUCKETS[-1]"""
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по корзинам (как histogram_quantile в Prometheus)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if i == len(BUCKETS):
+                    return BUCKETS[-1]
+                lower = BUCKETS[i - 1] if i else 0.0
+                return lower + (BUCKETS[i] - lower) * (rank - seen) / count
+            seen += count
+        return BUCKETS[-1]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """Реестр метрик процесса: гистограммы времени и счётчики с метками"""
+
+    def __init__(self):
+        self.started = time.time()
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+
+    def describe(self, name: str, kind: str, text: str):
+        """Тип ("histogram" или "counter") и описание метрики для /metrics"""
+        self._help[name] = (kind, text)
+        target = self._histograms if kind == "histogram" else self._counters
+        target.setdefault(name, {})
+
+    def observe(self, name: str, seconds: float, **labels):
+        series = self._histograms.setdefault(name, {})
+        key = _labels(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(seconds)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        series = self._counters.setdefault(name, {})
+        key = _labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def observer(self, name: str, label: str = "op") -> Callable[[str, float], None]:
+        """Колбэк (операция, секунды) для хранилищ: пишет в гистограмму name"""
+        return lambda operation, seconds: self.observe(name, seconds, **{label: operation})
+
+    def histograms(self, name: str) -> Dict[Labels, Histogram]:
+        return self._histograms.get(name, {})
+
+    def counters(self, name: str) -> Dict[Labels, float]:
+        return self._counters.get(name, {})
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines: List[str] = []
+        for name, series in sorted(self._counters.items()):
+            self._header(lines, name, "counter")
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+        for name, series in sorted(self._histograms.items()):
+            self._header(lines, name, "histogram")
+            for labels, histogram in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', le))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum!r}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        lines.append("# TYPE bot_start_time_seconds gauge")
+        lines.append(f"bot_start_time_seconds {self.started!r}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines: List[str], name: str, kind: str):
+        kind, text = self._help.get(name, (kind, ""))
+        if text:
+            lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+# -------------------------
+# Middleware
+# -------------------------
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware апдейтов: число и полное время обработки по типу апдейта"""
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        metrics.describe("bot_updates_total", "counter", "Полученные апдейты по типу")
+        metrics.describe("bot_update_seconds", "histogram", "Полное время обработки апдейта")
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        kind = event.event_type if isinstance(event, Update) else type(event).__name__
+        self.metrics.inc("bot_updates_total", type=kind)
+        with self.metrics.timer("bot_update_seconds", type=kind):
+            return await handler(event, data)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: время и ошибки каждого обработчика (по имени функции)"""
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        metrics.describe("bot_handler_seconds", "histogram", "Время работы обработчика")
+        metrics.describe("bot_handler_errors_total", "counter", "Исключения в обработчиках")
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.metrics.inc("bot_handler_errors_total", handler=name)
+            raise
+        finally:
+            self.metrics.observe("bot_handler_seconds", time.perf_counter() - started, handler=name)
+
+
+# -------------------------
+# HTTP
+# -------------------------
+def create_metrics_app(metrics: Metrics, path: str = "/metrics") -> web.Application:
+    """aiohttp-приложение, отдающее метрики по GET path"""
+    async def handle(_: web.Request) -> web.Response:
+        return web.Response(body=metrics.render().encode("utf-8"),
+                            headers={"Content-Type": CONTENT_TYPE, "Cache-Control": "no-cache"})
+
+    app = web.Application()
+    app.router.add_get(path, handle)
+    return app
+
+
+async def start_metrics_server(metrics: Metrics, host: str, port: int) -> web.AppRunner:
+    """Запустить сервер метрик в текущем event loop; остановка — runner.cleanup()"""
+    runner = web.AppRunner(create_metrics_app(metrics), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,537 @@
+# -*- coding: utf-8 -*-
+"""Журнал изменений (append-only) со снимком и компактацией.
+
+На диске лежат два файла:
+  schedule_data.json      — снимок (обычный JSON-список записей, как раньше);
+  schedule_data.json.log  — журнал операций в формате NDJSON.
+
+Первая строка журнала — заголовок с sha256 снимка, к которому он относится.
+Если снимок подменили (вручную или при прерванной компактации), а журнал
+остался от старого снимка, такой журнал не применяется.
+
+В заголовке же хранится next_id — следующий свободный id. Он не уменьшается,
+поэтому id удалённой записи не достаётся новой.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor
+from contextlib import asynccontextmanager
+from itertools import islice
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from records import ID_FIELD, parse_id
+
+
+class PersistenceError(Exception):
+    """Изменение не записано на диск и отменено"""
+
+
+def _fsync_dir(path: str):
+    """fsync каталога, чтобы rename пережил падение (не везде поддерживается)"""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except (OSError, AttributeError):
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path: str, payload: bytes):
+    """Записать файл целиком: tmp + fsync + rename"""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(path)
+
+
+def index_records(records: List[Dict[str, Any]], next_id: int = 1) -> Dict[int, Dict[str, Any]]:
+    """Записи по id в исходном порядке; записям без id (старые файлы) выдаются новые,
+    не меньше next_id"""
+    ids, seen = [], set()
+    for record in records:
+        record_id = parse_id(record.get(ID_FIELD))
+        if record_id in seen:
+            record_id = None
+        elif record_id is not None:
+            seen.add(record_id)
+        ids.append(record_id)
+
+    next_id = max(next_id, max(seen, default=0) + 1)
+    by_id: Dict[int, Dict[str, Any]] = {}
+    for record, record_id in zip(records, ids):
+        if record_id is None:
+            record_id, next_id = next_id, next_id + 1
+        record[ID_FIELD] = record_id
+        by_id[record_id] = record
+    return by_id
+
+
+def _put(records: Dict[int, Dict[str, Any]], record: Dict[str, Any]):
+    record_id = parse_id(record.get(ID_FIELD))
+    if record_id is None:
+        # операция из журнала старого формата
+        record_id = max(records, default=0) + 1
+        record[ID_FIELD] = record_id
+    records[record_id] = record
+
+
+def _target(records: Dict[int, Dict[str, Any]], op: Dict[str, Any]) -> Optional[int]:
+    if "id" in op:
+        return op["id"]
+    # старый формат журнала: запись по позиции в списке
+    return next(islice(records, op["index"], None), None)
+
+
+def added_ids(op: Dict[str, Any]) -> Iterable[int]:
+    """id записей, добавленных операцией журнала"""
+    if op["op"] == "add":
+        items = [op["record"]]
+    elif op["op"] == "import":
+        items = op["records"]
+    else:
+        return []
+    return [record_id for record_id in (parse_id(item.get(ID_FIELD)) for item in items) if record_id is not None]
+
+
+def apply_op(records: Dict[int, Dict[str, Any]], op: Dict[str, Any]):
+    """Применить одну операцию журнала к записям (словарь id -> запись)"""
+    kind = op["op"]
+    if kind == "add":
+        _put(records, op["record"])
+    elif kind == "delete":
+        records.pop(_target(records, op), None)
+    elif kind == "edit":
+        record = records.get(_target(records, op))
+        if record is not None:
+            record[op["field"]] = op["value"]
+            if "version" in op:
+                record["version"] = op["version"]
+    elif kind == "import":
+        for record in op["records"]:
+            _put(records, record)
+    else:
+        raise ValueError(f"Неизвестная операция журнала: {kind}")
+
+
+class ChangeLog:
+    """Снимок + журнал операций с fsync и атомарной компактацией"""
+
+    def __init__(self, data_file: str):
+        self.data_file = data_file
+        self.log_file = data_file + ".log"
+        self._next_file = self.log_file + ".next"
+        self._lock = threading.Lock()
+        self._fh = None
+        self._seq = 0
+        self._tail: Optional[List[bytes]] = None  # операции, пришедшие во время компактации
+        self._compacted_ops = 0
+        self.pending_ops = 0                     # операций в журнале с последнего снимка
+        self.digest: Optional[str] = None        # sha256 снимка, к которому относится журнал
+        self.generation = 0                      # номер компактации: снимок переписан ботом
+        self.next_id = 1                         # следующий свободный id, только растёт
+
+    # -------------------------
+    # Загрузка
+    # -------------------------
+    def load(self, default: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Прочитать снимок и применить к нему журнал"""
+        if not os.path.exists(self.data_file):
+            records = list(index_records(default, self.next_id).values())
+            self._advance(record[ID_FIELD] for record in records)
+            self.compact(records)
+            return records
+
+        with open(self.data_file, "rb") as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        self.digest = digest
+
+        # компактация прервалась после замены снимка — подхватываем новый журнал
+        if os.path.exists(self._next_file):
+            if self._read_header(self._next_file).get("base") == digest:
+                os.replace(self._next_file, self.log_file)
+                _fsync_dir(self.log_file)
+            else:
+                os.remove(self._next_file)
+
+        # next_id берётся и из журнала чужого снимка: выданные id остаются занятыми
+        header = self._read_header(self.log_file)
+        self.next_id = max(self.next_id, parse_id(header.get("next_id")) or 1)
+        records = index_records(json.loads(raw.decode("utf-8")), self.next_id)
+        self._advance(records)
+
+        applied = 0
+        if header.get("base") == digest:
+            applied = self._replay(records)
+        else:
+            if os.path.exists(self.log_file):
+                print("Журнал изменений не соответствует снимку и будет пропущен")
+            write_atomic(self.log_file, self._header(digest, self.next_id))
+
+        self.pending_ops = applied
+        self._fh = open(self.log_file, "ab")
+        return list(records.values())
+
+    @staticmethod
+    def _header(digest: str, next_id: int) -> bytes:
+        return (json.dumps({"base": digest, "next_id": next_id}) + "\n").encode("utf-8")
+
+    @staticmethod
+    def _read_header(path: str) -> Dict[str, Any]:
+        try:
+            with open(path, "rb") as f:
+                header = json.loads(f.readline().decode("utf-8"))
+        except (OSError, ValueError):
+            return {}
+        return header if isinstance(header, dict) else {}
+
+    def _advance(self, ids: Iterable[int]):
+        self.next_id = max(self.next_id, max(ids, default=0) + 1)
+
+    def _replay(self, records: Dict[int, Dict[str, Any]]) -> int:
+        applied = 0
+        with open(self.log_file, "r+b") as f:
+            good_offset = len(f.readline())
+            for line in f:
+                try:
+                    op = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    # оборванная запись в конце журнала (падение во время записи)
+                    break
+                apply_op(records, op)
+                self._advance(added_ids(op))
+                self._seq = op.get("seq", self._seq)
+                good_offset += len(line)
+                applied += 1
+            f.truncate(good_offset)
+        return applied
+
+    # -------------------------
+    # Запись
+    # -------------------------
+    def append(self, op: Dict[str, Any]):
+        """Дописать операцию в журнал и дождаться fsync"""
+        self.append_many([op])
+
+    def append_many(self, ops: List[Dict[str, Any]]):
+        """Дописать пачку операций одним write + одним fsync"""
+        with self._lock:
+            lines = []
+            for op in ops:
+                self._seq += 1
+                lines.append((json.dumps(dict(op, seq=self._seq), ensure_ascii=False) + "\n").encode("utf-8"))
+            if self._fh is None:
+                self._seq -= len(lines)
+                raise OSError("журнал изменений не открыт")
+            offset = self._fh.tell()
+            try:
+                self._fh.write(b"".join(lines))
+                self._fh.flush()
+                os.fsync(self._fh.fileno())
+            except BaseException:
+                # недописанный хвост не должен применяться при следующей загрузке
+                self._seq -= len(lines)
+                self._truncate(offset)
+                raise
+            for op in ops:
+                self._advance(added_ids(op))
+            if self._tail is not None:
+                self._tail.extend(lines)
+            self.pending_ops += len(lines)
+
+    def _truncate(self, offset: int):
+        """Отрезать журнал до offset и открыть его заново (после ошибки записи)"""
+        try:
+            self._fh.close()
+        except OSError:
+            # буфер с несохранённым хвостом: файл всё равно закрыт
+            pass
+        self._fh = None
+        try:
+            with open(self.log_file, "r+b") as f:
+                f.truncate(offset)
+                f.flush()
+                os.fsync(f.fileno())
+            self._fh = open(self.log_file, "ab")
+        except OSError as e:
+            # журнал останется закрытым до перезагрузки данных
+            print(f"Не удалось восстановить журнал изменений: {e}")
+
+    # -------------------------
+    # Компактация
+    # -------------------------
+    @property
+    def compacting(self) -> bool:
+        return self._tail is not None
+
+    def start_compaction(self):
+        """Зафиксировать момент снимка; вызывать вместе с копированием записей"""
+        with self._lock:
+            self._tail = []
+            self._compacted_ops = self.pending_ops
+
+    def finish_compaction(self, records: List[Dict[str, Any]]):
+        """Записать снимок и начать новый журнал (блокирующая операция).
+
+        До замены снимка ошибка ничего не меняет: в силе остаются прежние
+        снимок и журнал, а временные файлы удаляются.
+        """
+        tmp = self.data_file + ".tmp"
+        committed = False
+        try:
+            payload = json.dumps(records, ensure_ascii=False, indent=2).encode("utf-8")
+            digest = hashlib.sha256(payload).hexdigest()
+            with open(tmp, "wb") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+
+            with self._lock:
+                # записи снимка могли получить id не через журнал (перечитанный файл)
+                self._advance(parse_id(record.get(ID_FIELD)) or 0 for record in records)
+                # новый журнал = заголовок нового снимка + операции, пришедшие за время записи
+                write_atomic(self._next_file, self._header(digest, self.next_id) + b"".join(self._tail))
+                os.replace(tmp, self.data_file)
+                committed = True
+                self.pending_ops -= self._compacted_ops
+                self.digest = digest
+                self.generation += 1
+                _fsync_dir(self.data_file)
+                # если переключиться на новый журнал не удастся, запись в старый
+                # тоже должна падать: при загрузке он не применится к новому снимку
+                fh, self._fh = self._fh, None
+                if fh is not None:
+                    fh.close()
+                os.replace(self._next_file, self.log_file)
+                _fsync_dir(self.log_file)
+                self._fh = open(self.log_file, "ab")
+        except BaseException:
+            if not committed:
+                for path in (tmp, self._next_file, self._next_file + ".tmp"):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            raise
+        finally:
+            with self._lock:
+                self._tail = None
+
+    def compact(self, records: List[Dict[str, Any]]):
+        self.start_compaction()
+        self.finish_compaction(records)
+
+    def close(self):
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+
+# -------------------------
+# Асинхронная очередь записи
+# -------------------------
+# Снимок для компактации: функция без аргументов, вызывается в пуле потоков.
+# Состояние, из которого она строит записи, должно быть зафиксировано заранее
+Snapshot = Callable[[], List[Dict[str, Any]]]
+
+
+class _Transaction:
+    __slots__ = ("ops", "snapshot", "barrier")
+
+    def __init__(self):
+        self.ops: List[Dict[str, Any]] = []
+        self.snapshot: Optional[Snapshot] = None
+        self.barrier = False
+
+    def log(self, op: Dict[str, Any]):
+        self.ops.append(op)
+
+
+class WriteQueue:
+    """Запись журнала вне event loop: ограниченная очередь + группировка fsync.
+
+    Изменение в памяти и постановка операции в очередь делаются внутри
+    ``transaction()`` без промежуточных await, поэтому порядок операций в
+    журнале совпадает с порядком изменений, а снимок для компактации
+    соответствует ровно тем операциям, что стоят перед ним в очереди.
+    """
+
+    def __init__(self, changelog: ChangeLog, executor: Executor,
+                 maxsize: int = 256, coalesce_delay: float = 0.02,
+                 on_timing: Optional[Callable[[str, float], None]] = None,
+                 on_failure: Optional[Callable[[PersistenceError], Awaitable[None]]] = None):
+        self.changelog = changelog
+        # колбэк (операция, секунды) для метрик: "journal" — запись пачки с fsync, "compaction" — снимок
+        self.on_timing = on_timing
+        # вызывается после неудачной записи журнала, пока очередь стоит:
+        # владелец откатывает состояние в памяти к тому, что на диске
+        self.on_failure = on_failure
+        self.executor = executor
+        self.coalesce_delay = coalesce_delay
+        self._slots = asyncio.Semaphore(maxsize)
+        self._items = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._compaction: Optional[asyncio.Future] = None
+        self.flushes = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Ждёт места в очереди (back-pressure), затем ждёт fsync операций"""
+        await self._slots.acquire()
+        tx = _Transaction()
+        try:
+            yield tx
+        except BaseException:
+            self._slots.release()
+            raise
+        if not tx.ops and tx.snapshot is None and not tx.barrier:
+            self._slots.release()
+            return
+        done = asyncio.get_running_loop().create_future()
+        self._items.append((tx, done))
+        self._wakeup.set()
+        await done
+
+    async def compact(self, snapshot: Callable[[], Snapshot], force: bool = False):
+        """Поставить компактацию в очередь и дождаться записи снимка.
+
+        snapshot() вызывается в event loop в момент постановки в очередь и
+        фиксирует состояние; записи из него строятся уже в пуле потоков.
+        """
+        await self.wait_compaction()
+        if not force and not self.changelog.pending_ops:
+            return
+        async with self.transaction() as tx:
+            tx.snapshot = snapshot()
+        await self.wait_compaction()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # даём накопиться соседним изменениям: пачка уходит одним fsync
+            if self.coalesce_delay:
+                await asyncio.sleep(self.coalesce_delay)
+
+            batch = []
+            while self._items:
+                batch.append(self._items.popleft())
+                self._slots.release()
+
+            ops, waiters = [], []
+            error = None
+            for position, (tx, done) in enumerate(batch):
+                if tx.snapshot is None:
+                    ops.extend(tx.ops)
+                    waiters.append(done)
+                    continue
+                error = await self._flush(loop, ops, waiters)
+                if error is not None:
+                    # дальнейшие изменения пачки сделаны поверх потерянных
+                    self._fail((done for _, done in batch[position:]), error)
+                    break
+                ops, waiters = [], []
+                await self.wait_compaction()
+                self._start_compaction(loop, tx.snapshot, done)
+            else:
+                error = await self._flush(loop, ops, waiters)
+            if error is not None and self.on_failure is not None:
+                try:
+                    await self.on_failure(error)
+                except Exception as e:
+                    print(f"Ошибка восстановления после сбоя записи: {e}")
+
+    async def _flush(self, loop, ops, waiters) -> Optional[PersistenceError]:
+        """Записать пачку; ошибка достаётся всем, кто её ждёт, и возвращается"""
+        error = None
+        try:
+            if ops:
+                started = time.perf_counter()
+                await loop.run_in_executor(self.executor, self.changelog.append_many, ops)
+                self.flushes += 1
+                if self.on_timing is not None:
+                    self.on_timing("journal", time.perf_counter() - started)
+        except Exception as e:
+            print(f"Ошибка сохранения данных: {e}")
+            error = PersistenceError(f"Изменения не записаны на диск: {e}")
+            self._fail(waiters, error)
+        for done in waiters:
+            if not done.done():
+                done.set_result(None)
+        return error
+
+    @staticmethod
+    def _fail(waiters, error: PersistenceError):
+        for done in waiters:
+            if not done.done():
+                done.set_exception(error)
+
+    def fail_pending(self, error: PersistenceError):
+        """Отказать всему, что ещё стоит в очереди (вызывается из on_failure)"""
+        while self._items:
+            _, done = self._items.popleft()
+            self._slots.release()
+            self._fail((done,), error)
+
+    async def wait_compaction(self):
+        """Дождаться идущей компактации; её ошибку получает тот, кто её заказал"""
+        if self._compaction is not None:
+            await asyncio.wait([self._compaction])
+
+    def _start_compaction(self, loop, snapshot: Snapshot, done):
+        # снимок пишется параллельно с дальнейшими операциями (они попадут в хвост журнала)
+        self.changelog.start_compaction()
+        started = time.perf_counter()
+        self._compaction = loop.run_in_executor(
+            self.executor, lambda: self.changelog.finish_compaction(snapshot()))
+
+        def finished(fut):
+            self._compaction = None
+            if self.on_timing is not None:
+                self.on_timing("compaction", time.perf_counter() - started)
+            if done.done():
+                return
+            if fut.cancelled():
+                done.cancel()
+            elif fut.exception() is not None:
+                print(f"Ошибка компактации данных: {fut.exception()}")
+                done.set_exception(PersistenceError(f"Снимок не записан: {fut.exception()}"))
+            else:
+                done.set_result(None)
+
+        self._compaction.add_done_callback(finished)
+
+    async def drain(self):
+        """Дождаться записи всего, что уже стоит в очереди"""
+        async with self.transaction() as tx:
+            tx.barrier = True
+
+    async def close(self):
+        """Дописать всё из очереди и остановить фоновую задачу"""
+        if self._task is not None:
+            await self.drain()
+        await self.wait_compaction()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Компактное представление записи расписания."""
+
+import sys
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from schedule_index import LEVELS
+
+# Все поля записи в порядке схемы JSON
+FIELDS = LEVELS + ("информация", "ссылка")
+# Постоянный идентификатор записи (в JSON — первый ключ объекта)
+ID_FIELD = "id"
+# Счётчик изменений записи для оптимистичных блокировок
+VERSION_FIELD = "version"
+
+_ATTRS = ("cls", "semester", "subject", "exam", "material", "info", "link")
+_ATTR_BY_FIELD = dict(zip(FIELDS, _ATTRS))
+# Категориальные поля повторяются тысячи раз — храним одну копию строки
+_INTERNED = frozenset(LEVELS)
+
+
+def parse_id(value) -> Optional[int]:
+    """id из JSON/CSV/ввода администратора (None, если это не положительное число)"""
+    if isinstance(value, bool):
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def _clean(field: str, value) -> str:
+    value = "" if value is None else str(value)
+    return sys.intern(value) if field in _INTERNED else value
+
+
+class Record:
+    """Запись со __slots__ вместо dict из семи кириллических ключей.
+
+    Поддерживает чтение в стиле словаря (record["класс"], record.get("ссылка")),
+    поэтому handlers работают с ней так же, как раньше со словарём.
+    В JSON-схему и обратно переводится на границе загрузки/сохранения/экспорта.
+    ``id`` — постоянный идентификатор, по нему записи правятся и удаляются;
+    ``version`` растёт при каждой правке (проверка конкурентных изменений).
+    """
+
+    __slots__ = _ATTRS + ("id", "version")
+
+    def __init__(self, cls="", semester="", subject="", exam="", material="", info="", link="",
+                 id: Optional[int] = None, version: int = 1):
+        self.id = id
+        self.version = version
+        self.cls = _clean("класс", cls)
+        self.semester = _clean("полугодие", semester)
+        self.subject = _clean("предмет", subject)
+        self.exam = _clean("экзамен", exam)
+        self.material = _clean("тип_материалов", material)
+        self.info = _clean("информация", info)
+        self.link = _clean("ссылка", link)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Record":
+        return cls(*(data.get(field, "") for field in FIELDS), id=parse_id(data.get(ID_FIELD)),
+                   version=parse_id(data.get(VERSION_FIELD)) or 1)
+
+    def copy(self) -> "Record":
+        return Record(*(getattr(self, attr) for attr in _ATTRS), id=self.id, version=self.version)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {} if self.id is None else {ID_FIELD: self.id}
+        data[VERSION_FIELD] = self.version
+        data.update((field, getattr(self, attr)) for field, attr in _ATTR_BY_FIELD.items())
+        return data
+
+    def __getitem__(self, field: str) -> str:
+        if field == ID_FIELD:
+            return self.id
+        if field == VERSION_FIELD:
+            return self.version
+        try:
+            return getattr(self, _ATTR_BY_FIELD[field])
+        except KeyError:
+            raise KeyError(field) from None
+
+    def __setitem__(self, field: str, value):
+        setattr(self, _ATTR_BY_FIELD[field], _clean(field, value))
+
+    def __contains__(self, field) -> bool:
+        return field in _ATTR_BY_FIELD
+
+    def get(self, field: str, default=None):
+        attr = _ATTR_BY_FIELD.get(field)
+        return getattr(self, attr) if attr is not None else default
+
+    def keys(self) -> Tuple[str, ...]:
+        return FIELDS
+
+    def values(self) -> Iterator[str]:
+        return (getattr(self, attr) for attr in _ATTRS)
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        return ((field, getattr(self, attr)) for field, attr in _ATTR_BY_FIELD.items())
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Record):
+            return NotImplemented
+        return all(getattr(self, attr) == getattr(other, attr) for attr in _ATTRS)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"Record({self.to_dict()!r})"
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""LRU-кэш готовых экранов навигации (текст + клавиатура) по узлам дерева."""
+
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from schedule_index import LEVELS, node_id
+
+
+class RenderCache:
+    """Экран узла одинаков для всех пользователей, поэтому строится один раз.
+
+    Запись при изменении данных сбрасывает только узлы на пути изменённой
+    записи (от корня до карточки). Версия кэша защищает от гонки, когда
+    экран считался по старым данным, а сохраняется уже после сброса.
+    """
+
+    def __init__(self, maxsize: int = 5000):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        value = self._items.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any, version: int):
+        """Сохранить экран, если с момента version кэш не сбрасывался"""
+        if version != self.version:
+            return
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def invalidate_record(self, record):
+        """Сбросить все узлы на пути записи"""
+        if record is None:
+            return
+        self.version += 1
+        path = tuple(record[level] for level in LEVELS)
+        for depth in range(len(path) + 1):
+            self._items.pop(node_id(path[:depth]), None)
+
+    def clear(self):
+        self.version += 1
+        self._items.clear()
@@ -0,0 +1,1234 @@
+# -*- coding: utf-8 -*-
+"""Хранилище записей: общий интерфейс и два бэкенда (JSON-файл и SQLite)."""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from persistence import ChangeLog, PersistenceError, Snapshot, WriteQueue, index_records
+from records import FIELDS, ID_FIELD, Record, parse_id
+from schedule_index import FILTER_FIELDS, ScheduleIndex, LEVELS, ROOT_ID, filter_key, node_id
+from search import FIELD_WEIGHTS, FUZZY_FIELDS, FuzzyMatcher, SearchIndex, normalize, tokenize
+
+
+# Поля, не входящие в естественный ключ записи (их обновляет импорт)
+DATA_FIELDS = tuple(field for field in FIELDS if field not in LEVELS)
+
+
+class UpsertResult(NamedTuple):
+    added: int
+    updated: int
+    unchanged: int
+    ids: List[int]      # id всех записей пачки (новых — только если это не dry_run)
+
+
+class RestoreResult(NamedTuple):
+    added: int
+    updated: int
+    deleted: int
+
+
+def natural_key(record) -> Tuple[str, ...]:
+    """Естественный ключ: класс, полугодие, предмет, экзамен, тип материалов"""
+    return tuple(record[level] for level in LEVELS)
+
+
+class VersionConflict(Exception):
+    """Запись изменилась с тех пор, как администратор её открыл"""
+
+    def __init__(self, current: Record):
+        super().__init__(f"Запись {current.id} уже изменена (версия {current.version})")
+        self.current = current
+
+
+class BaseRepository(ABC):
+    """Интерфейс хранилища, через который работают все handlers.
+
+    Изменения проходят под write_lock (проверка версии и фиксация идут одним
+    шагом), чтения блокировку не берут и видят последнее зафиксированное состояние.
+    """
+
+    def __init__(self):
+        self._listeners: List[Callable[[Optional[Record], Optional[Record]], None]] = []
+        # колбэк (операция, секунды) для метрик записи на диск
+        self.on_timing: Optional[Callable[[str, float], None]] = None
+        self.write_lock = asyncio.Lock()
+        # словарь значений для исправления опечаток в /search
+        self.fuzzy = FuzzyMatcher()
+
+    def add_listener(self, listener: Callable[[Optional[Record], Optional[Record]], None]):
+        """Подписаться на изменения: listener(старая запись, новая запись).
+
+        Добавление — (None, new), удаление — (old, None), правка — (old, new).
+        Вызывается в event loop сразу после изменения.
+        """
+        self._listeners.append(listener)
+
+    def _timing(self, operation: str, seconds: float):
+        if self.on_timing is not None:
+            self.on_timing(operation, seconds)
+
+    def _update_vocabulary(self, old: Optional[Record], new: Optional[Record]):
+        for field in FUZZY_FIELDS:
+            if old is not None:
+                self.fuzzy.remove(old[field])
+            if new is not None:
+                self.fuzzy.add(new[field])
+
+    def _changed(self, old: Optional[Record], new: Optional[Record]):
+        self._update_vocabulary(old, new)
+        for listener in self._listeners:
+            listener(old, new)
+
+    def apply_peer_change(self, old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]):
+        """Учесть изменение, сделанное другим процессом в общей базе.
+
+        Данные уже в базе; обновляется только словарь опечаток этого процесса.
+        """
+        self._update_vocabulary(old, new)
+
+    async def start(self):
+        """Запустить фоновые задачи (вызывается при старте бота)"""
+
+    async def close(self):
+        """Сбросить данные на диск и освободить ресурсы"""
+
+    @abstractmethod
+    async def children(self, *path) -> List[str]:
+        """Отсортированные значения следующего уровня навигации для префикса"""
+
+    @abstractmethod
+    async def get(self, *path) -> Optional[Record]:
+        """Запись по полному пути (класс, полугодие, предмет, экзамен, тип)"""
+
+    @abstractmethod
+    async def resolve(self, nid: int) -> Optional[Tuple[str, ...]]:
+        """Путь узла дерева по идентификатору из schedule_index.node_id"""
+
+    @abstractmethod
+    async def count(self) -> int:
+        """Количество записей"""
+
+    @abstractmethod
+    async def count_by(self, field: str) -> Dict[str, int]:
+        """Количество записей по значениям поля"""
+
+    @abstractmethod
+    async def get_by_id(self, record_id: int) -> Optional[Record]:
+        """Запись по постоянному идентификатору"""
+
+    @abstractmethod
+    async def list_page(self, limit: int, filters: Optional[Dict[str, str]] = None,
+                        after: Optional[int] = None,
+                        before: Optional[int] = None) -> Tuple[int, List[Tuple[int, Record]]]:
+        """Страница списка записей в порядке id: (всего подходящих, [(id, запись)]).
+
+        Страница берётся по границе, а не по смещению: after — первые limit
+        записей с id больше after, before — последние limit записей с id меньше
+        before; без них — первая страница. filters — {поле: значение} по
+        schedule_index.FILTER_FIELDS, без учёта регистра и ё/е.
+        """
+
+    @abstractmethod
+    async def all_records(self) -> List[Dict[str, Any]]:
+        """Все записи в JSON-схеме (экспорт, резервные копии)"""
+
+    @abstractmethod
+    def iter_records(self, filters: Optional[Dict[str, str]] = None,
+                     batch_size: int = 1000) -> AsyncIterator[List[Record]]:
+        """Записи пачками по batch_size в порядке id (фильтры — как в list_page)"""
+
+    @abstractmethod
+    async def add(self, record: Dict[str, Any]) -> Record:
+        """Добавить запись (id выдаётся хранилищем)"""
+
+    @abstractmethod
+    async def update(self, record_id: int, field: str, value: str,
+                     expected_version: Optional[int] = None) -> Optional[str]:
+        """Изменить поле записи; возвращает старое значение или None, если записи нет.
+
+        Если expected_version задана и не совпадает с текущей — VersionConflict.
+        """
+
+    @abstractmethod
+    async def delete(self, record_id: int, expected_version: Optional[int] = None) -> Optional[Record]:
+        """Удалить запись; возвращает удалённую запись или None (VersionConflict — как в update)"""
+
+    @abstractmethod
+    async def search(self, query: str, offset: int = 0,
+                     limit: Optional[int] = None) -> Tuple[int, List[Record]]:
+        """Полнотекстовый поиск: (всего найдено, страница записей по релевантности)"""
+
+    async def suggest(self, query: str, limit: int = 5) -> List[str]:
+        """Значения предмета, типа материалов или экзамена, похожие на запрос с опечаткой"""
+        return self.fuzzy.match(query, limit)
+
+    @abstractmethod
+    async def ids(self) -> List[int]:
+        """id всех записей"""
+
+    @abstractmethod
+    async def upsert(self, records: List[Dict[str, Any]], dry_run: bool = False) -> UpsertResult:
+        """Добавить или обновить записи по естественному ключу.
+
+        Новая запись сохраняет id из данных, если он свободен. У найденной
+        обновляются информация и ссылка. dry_run только считает изменения.
+        """
+
+    @abstractmethod
+    async def delete_many(self, ids: Iterable[int], dry_run: bool = False) -> int:
+        """Удалить записи по id; возвращает количество удалённых"""
+
+    @abstractmethod
+    async def restore(self, records: List[Dict[str, Any]]) -> RestoreResult:
+        """Привести базу к набору записей (резервная копия) с сохранением id.
+
+        Записи, которых нет в наборе, удаляются, отличающиеся — переписываются
+        целиком. Версия изменённой записи растёт, а не откатывается, чтобы
+        открытые формы правки заметили изменение.
+        """
+
+
+# -------------------------
+# JSON-файл (снимок + журнал изменений)
+# -------------------------
+class JsonRepository(BaseRepository):
+    """Все записи в памяти, на диске — снимок schedule_data.json и журнал.
+
+    Записи не меняются на месте: правка ставит в словарь и индексы новый
+    объект Record. Поэтому список из self.records.values() — неизменяемый
+    снимок, который можно отдать в пул потоков (сериализация, компактация).
+
+    write_lock держится до постановки операции в журнал, но не до fsync:
+    ожидание диска у соседних правок по-прежнему объединяется в один fsync.
+
+    Если снимок заменили вне бота (правка вручную, выгрузка из школьной
+    системы), он перечитывается раз в ``reload_interval`` секунд (0 — не следить).
+    """
+
+    def __init__(self, data_file: str, executor: Executor, default=(),
+                 write_queue_size: int = 256, coalesce_delay: float = 0.02,
+                 compact_interval: float = 300, compact_threshold: int = 1000,
+                 compact_check_period: float = 5, reload_interval: float = 0):
+        super().__init__()
+        self.executor = executor
+        self.changelog = ChangeLog(data_file)
+        self.write_queue = WriteQueue(self.changelog, executor, maxsize=write_queue_size,
+                                      coalesce_delay=coalesce_delay, on_timing=self._timing,
+                                      on_failure=self._recover)
+        self.compact_interval = compact_interval
+        self.compact_threshold = compact_threshold
+        self.compact_check_period = compact_check_period
+        self.reload_interval = reload_interval
+        self.default = [dict(item) for item in default]
+        self.records: Dict[int, Record] = {}   # по id, в порядке добавления
+        self._next_id = 1
+        self.index = ScheduleIndex()
+        self.search_index = SearchIndex()
+        self._compactor: Optional[asyncio.Task] = None
+        self._watcher: Optional[asyncio.Task] = None
+        self.load()
+        self._stamp = self._file_stamp()
+
+    def load(self):
+        """Загрузить данные из файла (снимок + журнал изменений)"""
+        try:
+            loaded = self.changelog.load(self.default)
+            self.records = {item[ID_FIELD]: Record.from_dict(item) for item in loaded}
+            # id удалённых записей не выдаются повторно
+            self._next_id = max(self._next_id, self.changelog.next_id, max(self.records, default=0) + 1)
+            items = self.records.values()
+            self.index.rebuild(items)
+            self.search_index.rebuild(items)
+            self.fuzzy.rebuild(item[field] for item in items for field in FUZZY_FIELDS)
+        except Exception as e:
+            print(f"Ошибка загрузки данных: {e}")
+
+    async def start(self):
+        self.write_queue.start()
+        if self._compactor is None:
+            self._compactor = asyncio.create_task(self._compaction_worker())
+        if self.reload_interval > 0 and self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch_worker())
+
+    async def close(self):
+        for task in (self._watcher, self._compactor):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._watcher = self._compactor = None
+        await self.save()
+        await self.write_queue.close()
+        self.changelog.close()
+
+    async def save(self):
+        """Дописать журнал и сохранить полный снимок данных в файл"""
+        try:
+            await self.write_queue.compact(self._snapshot)
+        except Exception as e:
+            print(f"Ошибка сохранения данных: {e}")
+
+    def _snapshot(self) -> Snapshot:
+        """Зафиксировать текущие записи; словари для снимка строятся потом, в пуле потоков"""
+        items = list(self.records.values())
+        return lambda: [item.to_dict() for item in items]
+
+    async def _compaction_worker(self):
+        last_compaction = time.monotonic()
+        while True:
+            await asyncio.sleep(self.compact_check_period)
+            pending = self.changelog.pending_ops
+            due = time.monotonic() - last_compaction >= self.compact_interval
+            if self.changelog.compacting or not pending:
+                continue
+            if pending >= self.compact_threshold or due:
+                await self.save()
+                last_compaction = time.monotonic()
+
+    # перечитывание снимка, изменённого вне бота
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.changelog.data_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def _match_ids(items: List[Dict[str, Any]], current: List[Tuple[int, Record]], next_id: int):
+        """Записям файла без id — id текущей записи с тем же естественным ключом.
+
+        Иначе им выдавались бы id по порядку, и перестановка строк в файле
+        выглядела бы как правка каждой записи. Остальным — новые id.
+        """
+        taken = {parse_id(item.get(ID_FIELD)) for item in items}
+        known: Dict[Tuple[str, ...], List[int]] = {}
+        for record_id, item in current:
+            if record_id not in taken:
+                known.setdefault(natural_key(item), []).append(record_id)
+        next_id = max(next_id, max((i for i in taken if i is not None), default=0) + 1)
+        for item in items:
+            if parse_id(item.get(ID_FIELD)) is not None:
+                continue
+            ids = known.get(natural_key(Record.from_dict(item)))
+            if ids:
+                item[ID_FIELD] = ids.pop(0)
+            else:
+                item[ID_FIELD], next_id = next_id, next_id + 1
+
+    def _read_snapshot(self, current: List[Tuple[int, Record]], next_id: int):
+        """Прочитать снимок и построить для него индексы (в пуле потоков)"""
+        with open(self.changelog.data_file, "rb") as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        if digest == self.changelog.digest:
+            return digest, None
+        items = json.loads(raw.decode("utf-8"))
+        self._match_ids(items, current, next_id)
+        return digest, self._build(index_records(items).values())
+
+    @staticmethod
+    def _build(items: Iterable[Dict[str, Any]]):
+        """Записи и индексы к ним (в пуле потоков)"""
+        records = {item[ID_FIELD]: Record.from_dict(item) for item in items}
+        index, search_index, fuzzy = ScheduleIndex(), SearchIndex(), FuzzyMatcher()
+        index.rebuild(records.values())
+        search_index.rebuild(records.values())
+        fuzzy.rebuild(item[field] for item in records.values() for field in FUZZY_FIELDS)
+        return records, index, search_index, fuzzy
+
+    async def _watch_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            stamp = self._file_stamp()
+            if stamp is None or stamp == self._stamp or self.changelog.compacting:
+                continue
+            generation = self.changelog.generation
+            try:
+                # список текущих записей — снимок для потока: словарь тем временем могут менять
+                digest, built = await loop.run_in_executor(
+                    self.executor, self._read_snapshot, list(self.records.items()), self._next_id)
+            except Exception as e:
+                # файл могут ещё дописывать — попробуем при следующем изменении
+                self._stamp = stamp
+                print(f"Ошибка перезагрузки данных: {e}")
+                continue
+            if self.changelog.compacting or self.changelog.generation != generation:
+                # пока читали, бот сам переписал снимок — прочитанное могло устареть
+                continue
+            self._stamp = stamp
+            if built is not None and digest != self.changelog.digest:
+                try:
+                    await self._swap(*built)
+                except PersistenceError as e:
+                    # снимок с новыми id не записан: повторим при следующей проверке
+                    self._stamp = None
+                    print(f"Ошибка перезагрузки данных: {e}")
+
+    async def _swap(self, records: Dict[int, Record], index: ScheduleIndex,
+                    search_index: SearchIndex, fuzzy: FuzzyMatcher):
+        """Подменить данные целиком; обработчики до подмены дорабатывают со старыми"""
+        async with self.write_queue.transaction() as tx, self.write_lock:
+            changes = self._replace(records, index, search_index, fuzzy)
+            # новый снимок с id и версиями; журнал начинается заново
+            tx.snapshot = self._snapshot()
+        print(f"Данные перечитаны из {self.changelog.data_file}: записей {len(records)}, изменений {len(changes)}")
+
+    def _replace(self, records: Dict[int, Record], index: ScheduleIndex,
+                 search_index: SearchIndex, fuzzy: FuzzyMatcher) -> List[Tuple[Optional[Record], Optional[Record]]]:
+        """Поставить новые записи и индексы и разослать изменения подписчикам (под write_lock)"""
+        changes = []
+        for record_id, item in records.items():
+            before = self.records.get(record_id)
+            if before is None:
+                changes.append((None, item))
+            elif before != item:
+                # правка мимо бота или откат: устаревшие формы редактирования должны получить конфликт
+                item.version = max(item.version, before.version + 1)
+                changes.append((before, item))
+            else:
+                item.version = before.version
+        changes.extend((item, None) for record_id, item in self.records.items() if record_id not in records)
+        self.records, self.index, self.search_index, self.fuzzy = records, index, search_index, fuzzy
+        self._next_id = max(self._next_id, self.changelog.next_id, max(records, default=0) + 1)
+        for old, new in changes:
+            for listener in self._listeners:
+                listener(old, new)
+        return changes
+
+    def _reload_durable(self):
+        """Заново открыть журнал и прочитать то, что реально на диске (в пуле потоков)"""
+        self.changelog.close()
+        return self._build(self.changelog.load(self.default))
+
+    async def _recover(self, error: PersistenceError):
+        """Журнал не записался: в памяти остались изменения, которых нет на диске.
+
+        Очередь записи стоит, пока это выполняется. Всё, что успели поставить
+        в неё после сбоя, сделано поверх потерянных изменений и отменяется,
+        затем данные перечитываются со снимка и журнала.
+        """
+        async with self.write_lock:
+            self.write_queue.fail_pending(error)
+            await self.write_queue.wait_compaction()
+            loop = asyncio.get_running_loop()
+            try:
+                built = await loop.run_in_executor(self.executor, self._reload_durable)
+            except Exception as e:
+                print(f"Не удалось перечитать данные после ошибки записи: {e}")
+                return
+            changes = self._replace(*built)
+        print(f"Данные после ошибки записи перечитаны с диска: отменено изменений {len(changes)}")
+
+    # чтение
+    async def children(self, *path) -> List[str]:
+        return self.index.children(*path)
+
+    async def get(self, *path) -> Optional[Record]:
+        return self.index.find(*path)
+
+    async def resolve(self, nid: int) -> Optional[Tuple[str, ...]]:
+        return self.index.resolve(nid)
+
+    async def count(self) -> int:
+        return len(self.records)
+
+    async def count_by(self, field: str) -> Dict[str, int]:
+        return dict(Counter(item[field] for item in self.records.values()))
+
+    async def get_by_id(self, record_id: int) -> Optional[Record]:
+        return self.records.get(record_id)
+
+    async def list_page(self, limit: int, filters: Optional[Dict[str, str]] = None,
+                        after: Optional[int] = None,
+                        before: Optional[int] = None) -> Tuple[int, List[Tuple[int, Record]]]:
+        ids = self.index.ids(filters)
+        if before is not None:
+            end = bisect_left(ids, before)
+            start = max(0, end - limit)
+        else:
+            start = bisect_right(ids, after) if after is not None else 0
+            end = start + limit
+        return len(ids), [(record_id, self.records[record_id]) for record_id in ids[start:end]]
+
+    async def all_records(self) -> List[Dict[str, Any]]:
+        snapshot = self._snapshot()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, snapshot)
+
+    async def iter_records(self, filters: Optional[Dict[str, str]] = None,
+                           batch_size: int = 1000) -> AsyncIterator[List[Record]]:
+        # снимок id: правки между пачками не ломают обход
+        ids = list(self.index.ids(filters))
+        for start in range(0, len(ids), batch_size):
+            batch = [self.records[record_id] for record_id in ids[start:start + batch_size]
+                     if record_id in self.records]
+            if batch:
+                yield batch
+            await asyncio.sleep(0)
+
+    async def search(self, query: str, offset: int = 0,
+                     limit: Optional[int] = None) -> Tuple[int, List[Record]]:
+        found = self.search_index.search(query)
+        end = None if limit is None else offset + limit
+        return len(found), found[offset:end]
+
+    # запись
+    def _take_id(self, wanted=None) -> int:
+        record_id = parse_id(wanted)
+        if record_id is None or record_id in self.records:
+            record_id = self._next_id
+        self._next_id = max(self._next_id, record_id + 1)
+        return record_id
+
+    async def add(self, record: Dict[str, Any]) -> Record:
+        record = {field: value for field, value in record.items() if field != ID_FIELD}
+        async with self.write_queue.transaction() as tx, self.write_lock:
+            return self._insert(tx, Record.from_dict(record))
+
+    async def update(self, record_id: int, field: str, value: str,
+                     expected_version: Optional[int] = None) -> Optional[str]:
+        async with self.write_queue.transaction() as tx, self.write_lock:
+            record = self.records.get(record_id)
+            if record is None:
+                return None
+            if expected_version is not None and record.version != expected_version:
+                raise VersionConflict(record.copy())
+            old_value = record.get(field, "")
+            self._rewrite(tx, record, {field: value})
+        return old_value
+
+    async def delete(self, record_id: int, expected_version: Optional[int] = None) -> Optional[Record]:
+        async with self.write_queue.transaction() as tx, self.write_lock:
+            record = self.records.get(record_id)
+            if record is None:
+                return None
+            if expected_version is not None and record.version != expected_version:
+                raise VersionConflict(record.copy())
+            removed = self.records.pop(record_id)
+            self.index.remove(removed)
+            self.search_index.remove(removed)
+            tx.log({"op": "delete", "id": record_id})
+            self._changed(removed, None)
+        return removed
+
+    async def ids(self) -> List[int]:
+        return list(self.records)
+
+    def _insert(self, tx, item: Record, terms: Optional[Dict[str, float]] = None) -> Record:
+        item.id = self._take_id(item.id)
+        item.version = 1
+        self.records[item.id] = item
+        self.index.add(item)
+        self.search_index.add(item, terms)
+        tx.log({"op": "add", "record": item.to_dict()})
+        self._changed(None, item)
+        return item
+
+    @staticmethod
+    def _diff(item: Record, record: Dict[str, Any], fields) -> Dict[str, str]:
+        """Поля, которые record меняет в item"""
+        return {f: str(record.get(f) or "") for f in fields if str(record.get(f) or "") != item[f]}
+
+    def _rewrite(self, tx, item: Record, changes: Dict[str, str],
+                 terms: Optional[Dict[str, float]] = None) -> bool:
+        """Заменить запись копией с новыми значениями полей; False — менять нечего"""
+        if not changes:
+            return False
+        new = item.copy()
+        for field, value in changes.items():
+            new[field] = value
+        new.version += 1
+        self.records[new.id] = new
+        self.index.replace(item, new)
+        self.search_index.add(new, terms)
+        self.search_index.remove(item)
+        for field, value in changes.items():
+            tx.log({"op": "edit", "id": new.id, "field": field, "value": value, "version": new.version})
+        self._changed(item, new)
+        return True
+
+    def _plan_upsert(self, records: List[Dict[str, Any]]):
+        """Разбор пачки upsert (в пуле потоков, под write_lock): что добавить, что переписать.
+
+        Повтор естественного ключа внутри пачки сравнивается с предыдущим
+        вариантом из той же пачки — так же при dry_run, как и при записи.
+        Слова для поискового индекса считаются здесь же.
+        """
+        plan = []           # (ключ, новая запись или None, изменения, слова для поиска)
+        latest: Dict[Tuple[str, ...], Record] = {}
+        added = updated = unchanged = 0
+        ids = []
+        for record in records:
+            item = Record.from_dict(record)
+            key = natural_key(item)
+            found = self.index.find(*key)
+            if found is not None:
+                ids.append(found.id)
+            current = latest.get(key) or found
+            if current is None:
+                latest[key] = item
+                plan.append((key, item, None, SearchIndex.record_terms(item)))
+                added += 1
+                continue
+            changes = self._diff(current, record, DATA_FIELDS)
+            if not changes:
+                plan.append((key, None, None, None))
+                unchanged += 1
+                continue
+            after = current.copy()
+            for field, value in changes.items():
+                after[field] = value
+            latest[key] = after
+            plan.append((key, None, changes, SearchIndex.record_terms(after)))
+            updated += 1
+        return plan, UpsertResult(added, updated, unchanged, ids)
+
+    async def upsert(self, records: List[Dict[str, Any]], dry_run: bool = False) -> UpsertResult:
+        loop = asyncio.get_running_loop()
+        if dry_run:
+            async with self.write_lock:
+                _, result = await loop.run_in_executor(self.executor, self._plan_upsert, records)
+            return result
+
+        ids = []
+        async with self.write_queue.transaction() as tx, self.write_lock:
+            # до конца разбора память не меняется, поэтому порядок операций в журнале сохраняется
+            plan, result = await loop.run_in_executor(self.executor, self._plan_upsert, records)
+            for key, item, changes, terms in plan:
+                if item is not None:
+                    item = self._insert(tx, item, terms)
+                else:
+                    item = self.index.find(*key)
+                    if changes:
+                        self._rewrite(tx, item, changes, terms)
+                ids.append(item.id)
+        return result._replace(ids=ids)
+
+    async def delete_many(self, ids: Iterable[int], dry_run: bool = False) -> int:
+        if dry_run:
+            return sum(1 for record_id in ids if record_id in self.records)
+        deleted = 0
+        async with self.write_queue.transaction() as tx, self.write_lock:
+            for record_id in ids:
+                removed = self.records.pop(record_id, None)
+                if removed is None:
+                    continue
+                self.index.remove(removed)
+                self.search_index.remove(removed)
+                tx.log({"op": "delete", "id": record_id})
+                self._changed(removed, None)
+                deleted += 1
+        return deleted
+
+    async def restore(self, records: List[Dict[str, Any]]) -> RestoreResult:
+        wanted = {parse_id(record.get(ID_FIELD)) for record in records}
+        added = updated = 0
+        async with self.write_queue.transaction() as tx, self.write_lock:
+            stale = [record_id for record_id in self.records if record_id not in wanted]
+            for record_id in stale:
+                removed = self.records.pop(record_id)
+                self.index.remove(removed)
+                self.search_index.remove(removed)
+                tx.log({"op": "delete", "id": record_id})
+                self._changed(removed, None)
+            for record in records:
+                item = self.records.get(parse_id(record.get(ID_FIELD)))
+                if item is None:
+                    self._insert(tx, Record.from_dict(record))
+                    added += 1
+                elif self._rewrite(tx, item, self._diff(item, record, FIELDS)):
+                    updated += 1
+        return RestoreResult(added, updated, len(stale))
+
+
+# -------------------------
+# SQLite
+# -------------------------
+# Имена колонок в таблице (ASCII, чтобы не экранировать кириллицу в SQL)
+COLUMNS = {
+    "класс": "cls",
+    "полугодие": "semester",
+    "предмет": "subject",
+    "экзамен": "exam",
+    "тип_материалов": "material",
+    "информация": "info",
+    "ссылка": "link",
+}
+# Нормализованные (регистр, ё/е) копии полей фильтра списков — по ним идёт сравнение через индекс
+KEY_COLUMNS = {field: COLUMNS[field] + "_key" for field in FILTER_FIELDS}
+# id и version последними: строка выборки — это аргументы конструктора Record
+_SELECT = "SELECT " + ", ".join(COLUMNS[f] for f in FIELDS) + ", id, version FROM records"
+
+# AUTOINCREMENT: id удалённой записи не достаётся новой (иначе открытая
+# форма удаления или правки попала бы в чужую запись)
+RECORDS_TABLE = f"""(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    {", ".join(f"{COLUMNS[f]} TEXT NOT NULL DEFAULT ''" for f in FIELDS)},
+    version INTEGER NOT NULL DEFAULT 1,
+    {", ".join(f"{column} TEXT NOT NULL DEFAULT ''" for column in KEY_COLUMNS.values())}
+)"""
+RECORDS_COPY = ", ".join(["id", *(COLUMNS[f] for f in FIELDS), "version", *KEY_COLUMNS.values()])
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS records {RECORDS_TABLE};
+CREATE INDEX IF NOT EXISTS idx_records_path
+    ON records ({", ".join(COLUMNS[f] for f in LEVELS)});
+-- узлы дерева навигации: идентификатор из node_id -> путь (JSON-массив)
+CREATE TABLE IF NOT EXISTS nodes (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL
+);
+-- полнотекстовый индекс: нормализованный текст записи, rowid = records.id
+CREATE VIRTUAL TABLE IF NOT EXISTS records_fts USING fts5 (
+    {", ".join(COLUMNS[f] for f in FIELDS)}, tokenize = 'unicode61'
+);
+-- тот же текст по триграммам: поиск по части слова («гебр» -> «алгебра»)
+CREATE VIRTUAL TABLE IF NOT EXISTS records_trigram USING fts5 (
+    {", ".join(COLUMNS[f] for f in FIELDS)}, tokenize = 'trigram'
+);
+"""
+# Индексы списков: внутри одного значения ключа строки идут по id, поэтому
+# «key = ? AND id > ? ORDER BY id LIMIT n» читает ровно страницу. Создаются
+# после миграции: в базе прошлой версии колонок *_key ещё нет
+KEY_INDEXES = f"""
+CREATE INDEX IF NOT EXISTS idx_records_cls_key ON records ({KEY_COLUMNS["класс"]});
+CREATE INDEX IF NOT EXISTS idx_records_semester_key ON records ({KEY_COLUMNS["полугодие"]});
+CREATE INDEX IF NOT EXISTS idx_records_subject_key ON records ({KEY_COLUMNS["предмет"]});
+CREATE INDEX IF NOT EXISTS idx_records_cls_subject_key
+    ON records ({KEY_COLUMNS["класс"]}, {KEY_COLUMNS["предмет"]});
+"""
+# Полнотекстовые таблицы: слова (префиксы, bm25) и триграммы (подстроки)
+TEXT_TABLES = ("records_fts", "records_trigram")
+# С какой длины слово запроса ищется и внутри слов (как триграммы в search.SearchIndex)
+INFIX_MIN_LENGTH = 3
+# веса колонок для bm25 в порядке FIELDS
+_BM25 = ", ".join(str(FIELD_WEIGHTS[f]) for f in FIELDS)
+
+
+def _row_to_record(row) -> Record:
+    return Record(*row)
+
+
+def _record_values(record: Dict[str, Any]) -> tuple:
+    return tuple(str(record.get(f) or "") for f in FIELDS)
+
+
+def _prefixes(records) -> set:
+    prefixes = set()
+    for record in records:
+        path = tuple(str(record.get(level) or "") for level in LEVELS)
+        prefixes.update(path[:depth] for depth in range(1, len(path) + 1))
+    return prefixes
+
+
+def _normalize(value):
+    return normalize(value) if value else ""
+
+
+def _quote(token: str) -> str:
+    return '"' + token.replace('"', '""') + '"'
+
+
+def _fts_query(tokens: List[str]) -> str:
+    """Запрос FTS5: все слова обязательны, каждое — как префикс"""
+    return " ".join(_quote(token) + "*" for token in tokens)
+
+
+def _trigram_query(tokens: List[str]) -> str:
+    """Запрос к records_trigram: каждое слово — подстрока (не короче INFIX_MIN_LENGTH)"""
+    return " ".join(_quote(token) for token in tokens)
+
+
+class SqliteRepository(BaseRepository):
+    """Записи в локальной базе SQLite; в памяти ничего не держится.
+
+    Чтения идут из пула ввода-вывода (у каждого потока своё соединение),
+    записи — через отдельный однопоточный исполнитель.
+    """
+
+    def __init__(self, path: str, executor: Executor, seed_file: Optional[str] = None, default=()):
+        super().__init__()
+        self.path = path
+        self.executor = executor
+        self.write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._init_schema(seed_file, default)
+        self._load_vocabulary()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.create_function("pynormalize", 1, _normalize, deterministic=True)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _init_schema(self, seed_file, default):
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(records)")}
+        if "version" not in columns:
+            # база из предыдущей версии: добавляем счётчик изменений
+            with conn:
+                conn.execute("ALTER TABLE records ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+        missing = [column for column in KEY_COLUMNS.values() if column not in columns]
+        if missing:
+            # база из предыдущей версии: нормализованные ключи фильтров
+            with conn:
+                for column in missing:
+                    conn.execute(f"ALTER TABLE records ADD COLUMN {column} TEXT NOT NULL DEFAULT ''")
+                self._index_keys(conn, "", ())
+        table_sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'records'").fetchone()[0]
+        if "AUTOINCREMENT" not in table_sql.upper():
+            # база из предыдущей версии: таблица без AUTOINCREMENT выдаёт id удалённых записей
+            self._in_transaction(conn, self._rebuild_records)
+            conn.executescript(SCHEMA)
+        conn.executescript(KEY_INDEXES)
+        if conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]:
+            if not conn.execute("SELECT 1 FROM nodes LIMIT 1").fetchone():
+                # база из предыдущей версии: заполняем таблицу узлов
+                rows = conn.execute(f"{_SELECT}").fetchall()
+                with conn:
+                    self._register_nodes(conn, [_row_to_record(row) for row in rows])
+            total = conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+            if any(conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] != total
+                   for table in TEXT_TABLES):
+                # полнотекстового индекса ещё нет или он разошёлся с таблицей
+                with conn:
+                    for table in TEXT_TABLES:
+                        conn.execute(f"DELETE FROM {table}")
+                    self._index_text(conn, "", ())
+            return
+        # первая настройка: переносим данные из JSON-файла, если он есть
+        seed = list(default)
+        if seed_file and os.path.exists(seed_file):
+            try:
+                with open(seed_file, "r", encoding="utf-8") as f:
+                    seed = json.load(f)
+            except Exception as e:
+                print(f"Ошибка загрузки данных: {e}")
+        self._insert_many(conn, seed)
+
+    @staticmethod
+    def _rebuild_records(conn):
+        # id переносятся как есть; sqlite_sequence сам встанет на наибольший
+        conn.execute(f"CREATE TABLE records_new {RECORDS_TABLE}")
+        conn.execute(f"INSERT INTO records_new ({RECORDS_COPY}) SELECT {RECORDS_COPY} FROM records")
+        conn.execute("DROP TABLE records")
+        conn.execute("ALTER TABLE records_new RENAME TO records")
+
+    def _load_vocabulary(self):
+        conn = self._connect()
+        for field in FUZZY_FIELDS:
+            column = COLUMNS[field]
+            for value, count in conn.execute(f"SELECT {column}, COUNT(*) FROM records GROUP BY {column}"):
+                self.fuzzy.add(value, count)
+
+    async def _read(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: func(self._connect(), *args))
+
+    @staticmethod
+    def _in_transaction(conn, func, *args):
+        # BEGIN IMMEDIATE берёт блокировку записи до первого SELECT: проверка
+        # версии и UPDATE атомарны и тогда, когда базу правят несколько процессов
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn, *args)
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        if conn.in_transaction:
+            conn.commit()
+        return result
+
+    async def _write(self, func, *args):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self.write_executor,
+                                              lambda: self._in_transaction(self._connect(), func, *args))
+        except (sqlite3.OperationalError, OSError) as e:
+            # транзакция откачена, в памяти ничего не менялось
+            raise PersistenceError(f"Изменения не записаны в базу: {e}") from e
+        finally:
+            self._timing("transaction", time.perf_counter() - started)
+
+    async def close(self):
+        self.write_executor.shutdown(wait=True)
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+    @staticmethod
+    def _path_filter(path) -> str:
+        return " AND ".join(f"{COLUMNS[level]} = ?" for level in LEVELS[:len(path)])
+
+    # чтение
+    async def children(self, *path) -> List[str]:
+        column = COLUMNS[LEVELS[len(path)]]
+        sql = f"SELECT DISTINCT {column} FROM records"
+        if path:
+            sql += " WHERE " + self._path_filter(path)
+        sql += f" ORDER BY {column}"
+        rows = await self._read(lambda conn: conn.execute(sql, path).fetchall())
+        return [row[0] for row in rows]
+
+    async def get(self, *path) -> Optional[Record]:
+        sql = f"{_SELECT} WHERE {self._path_filter(path)} ORDER BY id LIMIT 1"
+        row = await self._read(lambda conn: conn.execute(sql, path).fetchone())
+        return _row_to_record(row) if row else None
+
+    async def resolve(self, nid: int) -> Optional[Tuple[str, ...]]:
+        if nid == ROOT_ID:
+            return ()
+        row = await self._read(lambda conn: conn.execute("SELECT path FROM nodes WHERE id = ?", (nid,)).fetchone())
+        return tuple(json.loads(row[0])) if row else None
+
+    async def count(self) -> int:
+        return await self._read(lambda conn: conn.execute("SELECT COUNT(*) FROM records").fetchone()[0])
+
+    async def count_by(self, field: str) -> Dict[str, int]:
+        column = COLUMNS[field]
+        sql = f"SELECT {column}, COUNT(*) FROM records GROUP BY {column}"
+        return dict(await self._read(lambda conn: conn.execute(sql).fetchall()))
+
+    async def get_by_id(self, record_id: int) -> Optional[Record]:
+        row = await self._read(lambda conn: conn.execute(f"{_SELECT} WHERE id = ?", (record_id,)).fetchone())
+        return _row_to_record(row) if row else None
+
+    @staticmethod
+    def _key_filter(filters) -> Tuple[List[str], List[str]]:
+        conditions, params = [], []
+        for field, value in zip(FILTER_FIELDS, filter_key(filters)):
+            if value is not None:
+                conditions.append(f"{KEY_COLUMNS[field]} = ?")
+                params.append(value)
+        return conditions, params
+
+    async def list_page(self, limit: int, filters: Optional[Dict[str, str]] = None,
+                        after: Optional[int] = None,
+                        before: Optional[int] = None) -> Tuple[int, List[Tuple[int, Record]]]:
+        conditions, params = self._key_filter(filters)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        if before is not None:
+            bound, order = "id < ?", "DESC"
+        else:
+            bound, order = "id > ?", "ASC"
+        page_sql = f"{_SELECT} WHERE {' AND '.join(conditions + [bound])} ORDER BY id {order} LIMIT ?"
+        page_params = (*params, before if before is not None else (after if after is not None else 0), limit)
+
+        def run(conn):
+            # подсчёт идёт только по индексу ключей, страница — keyset без OFFSET
+            total = conn.execute(f"SELECT COUNT(*) FROM records{where}", params).fetchone()[0]
+            return total, conn.execute(page_sql, page_params).fetchall()
+
+        total, rows = await self._read(run)
+        if before is not None:
+            rows.reverse()
+        records = [_row_to_record(row) for row in rows]
+        return total, [(record.id, record) for record in records]
+
+    async def iter_records(self, filters: Optional[Dict[str, str]] = None,
+                           batch_size: int = 1000) -> AsyncIterator[List[Record]]:
+        conditions, params = self._key_filter(filters)
+        sql = f"{_SELECT} WHERE {' AND '.join(conditions + ['id > ?'])} ORDER BY id LIMIT ?"
+        last_id = 0
+        while True:
+            # постраничный обход по id: каждая пачка — короткое чтение без долгой транзакции
+            rows = await self._read(lambda conn: conn.execute(sql, (*params, last_id, batch_size)).fetchall())
+            if not rows:
+                return
+            batch = [_row_to_record(row) for row in rows]
+            yield batch
+            last_id = batch[-1].id
+
+    async def all_records(self) -> List[Dict[str, Any]]:
+        return await self._read(lambda conn: [_row_to_record(row).to_dict()
+                                              for row in conn.execute(f"{_SELECT} ORDER BY id")])
+
+    async def search(self, query: str, offset: int = 0,
+                     limit: Optional[int] = None) -> Tuple[int, List[Record]]:
+        tokens = tokenize(query)
+        if not tokens:
+            return 0, []
+        # как в search.SearchIndex: длинное слово может быть и частью слова записи,
+        # короткое — только началом; выше те, где все слова нашлись как префиксы
+        words = [token for token in tokens if len(token) >= INFIX_MIN_LENGTH]
+        short = [token for token in tokens if len(token) < INFIX_MIN_LENGTH]
+        if words:
+            hits = (f"SELECT rowid, bm25(records_trigram, {_BM25}) AS infix_rank FROM records_trigram "
+                    "WHERE records_trigram MATCH ?")
+            params: List[str] = [_trigram_query(words)]
+            if short:
+                hits += " AND rowid IN (SELECT rowid FROM records_fts WHERE records_fts MATCH ?)"
+                params.append(_fts_query(short))
+        else:
+            hits = "SELECT rowid, 0 AS infix_rank FROM records_fts WHERE records_fts MATCH ?"
+            params = [_fts_query(short)]
+        columns = ", ".join(f"r.{COLUMNS[f]}" for f in FIELDS)
+        sql = (f"WITH hits AS ({hits}), "
+               f"ranked AS (SELECT rowid, bm25(records_fts, {_BM25}) AS rank FROM records_fts "
+               "WHERE records_fts MATCH ?) "
+               f"SELECT {columns}, r.id, r.version FROM hits JOIN records r ON r.id = hits.rowid "
+               "LEFT JOIN ranked ON ranked.rowid = hits.rowid "
+               "ORDER BY ranked.rank IS NULL, ranked.rank, hits.infix_rank, r.id LIMIT ? OFFSET ?")
+
+        def run(conn):
+            total = conn.execute(f"WITH hits AS ({hits}) SELECT COUNT(*) FROM hits", params).fetchone()[0]
+            rows = conn.execute(sql, (*params, _fts_query(tokens), -1 if limit is None else limit,
+                                      offset)).fetchall()
+            return total, rows
+
+        total, rows = await self._read(run)
+        return total, [_row_to_record(row) for row in rows]
+
+    # запись
+    @staticmethod
+    def _register_nodes(conn, records):
+        conn.executemany("INSERT OR IGNORE INTO nodes (id, path) VALUES (?, ?)",
+                         [(node_id(path), json.dumps(path, ensure_ascii=False))
+                          for path in _prefixes(records)])
+
+    @staticmethod
+    def _index_keys(conn, where: str, params: tuple):
+        """Пересчитать нормализованные ключи фильтров у записей, подходящих под условие"""
+        assignments = ", ".join(f"{column} = pynormalize({COLUMNS[field]})" for field, column in KEY_COLUMNS.items())
+        conn.execute(f"UPDATE records SET {assignments} {where}", params)
+
+    @classmethod
+    def _index_text(cls, conn, where: str, params: tuple):
+        """Добавить в полнотекстовый индекс записи, подходящие под условие (и обновить их ключи)"""
+        cls._index_keys(conn, where, params)
+        columns = ", ".join(COLUMNS[f] for f in FIELDS)
+        normalized = ", ".join(f"pynormalize({COLUMNS[f]})" for f in FIELDS)
+        for table in TEXT_TABLES:
+            conn.execute(f"INSERT INTO {table} (rowid, {columns}) "
+                         f"SELECT id, {normalized} FROM records {where}", params)
+
+    @staticmethod
+    def _unindex_text(conn, record_id: int):
+        for table in TEXT_TABLES:
+            conn.execute(f"DELETE FROM {table} WHERE rowid = ?", (record_id,))
+
+    @classmethod
+    def _insert_one(cls, conn, record: Dict[str, Any]) -> Record:
+        """Вставить запись без фиксации; id из данных сохраняется, если он свободен"""
+        placeholders = ", ".join("?" for _ in FIELDS)
+        columns = ", ".join(COLUMNS[f] for f in FIELDS)
+        values = _record_values(record)
+        record_id = parse_id(record.get(ID_FIELD))
+        if record_id is not None and conn.execute(
+                "SELECT 1 FROM records WHERE id = ?", (record_id,)).fetchone():
+            record_id = None
+        cursor = conn.execute(f"INSERT INTO records (id, {columns}) VALUES (?, {placeholders})",
+                              (record_id, *values))
+        cls._index_text(conn, "WHERE id = ?", (cursor.lastrowid,))
+        return Record(*values, id=cursor.lastrowid)
+
+    @classmethod
+    def _insert_many(cls, conn, records) -> List[Record]:
+        with conn:
+            inserted = [cls._insert_one(conn, record) for record in records]
+            cls._register_nodes(conn, inserted)
+        return inserted
+
+    async def add(self, record: Dict[str, Any]) -> Record:
+        record = {field: value for field, value in record.items() if field != ID_FIELD}
+        async with self.write_lock:
+            inserted = await self._write(self._insert_many, [record])
+        self._changed(None, inserted[0])
+        return inserted[0]
+
+    async def update(self, record_id: int, field: str, value: str,
+                     expected_version: Optional[int] = None) -> Optional[str]:
+        column = COLUMNS[field]
+
+        def run(conn):
+            with conn:
+                row = conn.execute(f"{_SELECT} WHERE id = ?", (record_id,)).fetchone()
+                if row is None:
+                    return None
+                before = _row_to_record(row)
+                if expected_version is not None and before.version != expected_version:
+                    raise VersionConflict(before)
+                conn.execute(f"UPDATE records SET {column} = ?, version = version + 1 WHERE id = ?",
+                             (value, record_id))
+                self._unindex_text(conn, record_id)
+                self._index_text(conn, "WHERE id = ?", (record_id,))
+                after = _row_to_record(conn.execute(f"{_SELECT} WHERE id = ?", (record_id,)).fetchone())
+                if field in LEVELS:
+                    self._register_nodes(conn, [after])
+                return before, after
+
+        async with self.write_lock:
+            result = await self._write(run)
+        if result is None:
+            return None
+        before, after = result
+        self._changed(before, after)
+        return before[field]
+
+    async def delete(self, record_id: int, expected_version: Optional[int] = None) -> Optional[Record]:
+        def run(conn):
+            with conn:
+                row = conn.execute(f"{_SELECT} WHERE id = ?", (record_id,)).fetchone()
+                if row is None:
+                    return None
+                if expected_version is not None and row[-1] != expected_version:
+                    raise VersionConflict(_row_to_record(row))
+                conn.execute("DELETE FROM records WHERE id = ?", (record_id,))
+                self._unindex_text(conn, record_id)
+                return _row_to_record(row)
+
+        async with self.write_lock:
+            removed = await self._write(run)
+        if removed is not None:
+            self._changed(removed, None)
+        return removed
+
+    async def ids(self) -> List[int]:
+        rows = await self._read(lambda conn: conn.execute("SELECT id FROM records ORDER BY id").fetchall())
+        return [row[0] for row in rows]
+
+    async def upsert(self, records: List[Dict[str, Any]], dry_run: bool = False) -> UpsertResult:
+        path_filter = self._path_filter(LEVELS)
+        assignments = ", ".join(f"{COLUMNS[f]} = ?" for f in DATA_FIELDS)
+
+        def run(conn):
+            added = updated = unchanged = 0
+            ids, changes, inserted = [], [], []
+            try:
+                for record in records:
+                    key = natural_key(record)
+                    row = conn.execute(f"{_SELECT} WHERE {path_filter} ORDER BY id LIMIT 1", key).fetchone()
+                    if row is None:
+                        item = self._insert_one(conn, record)
+                        inserted.append(item)
+                        changes.append((None, item))
+                        added += 1
+                        ids.append(item.id)
+                        continue
+                    before = _row_to_record(row)
+                    ids.append(before.id)
+                    values = [record.get(f, "") for f in DATA_FIELDS]
+                    if values == [before[f] for f in DATA_FIELDS]:
+                        unchanged += 1
+                        continue
+                    conn.execute(f"UPDATE records SET {assignments}, version = version + 1 WHERE id = ?",
+                                 (*values, before.id))
+                    self._unindex_text(conn, before.id)
+                    self._index_text(conn, "WHERE id = ?", (before.id,))
+                    after = _row_to_record(conn.execute(f"{_SELECT} WHERE id = ?", (before.id,)).fetchone())
+                    changes.append((before, after))
+                    updated += 1
+                self._register_nodes(conn, inserted)
+            except BaseException:
+                conn.rollback()
+                raise
+            if dry_run:
+                # всё посчитано внутри транзакции — откатываем
+                conn.rollback()
+                new_ids = {item.id for item in inserted}
+                return UpsertResult(added, updated, unchanged, [i for i in ids if i not in new_ids]), []
+            conn.commit()
+            return UpsertResult(added, updated, unchanged, ids), changes
+
+        async with self.write_lock:
+            result, changes = await self._write(run)
+        for old, new in changes:
+            self._changed(old, new)
+        return result
+
+    async def delete_many(self, ids: Iterable[int], dry_run: bool = False) -> int:
+        ids = list(ids)
+
+        def run(conn):
+            removed = []
+            with conn:
+                for record_id in ids:
+                    row = conn.execute(f"{_SELECT} WHERE id = ?", (record_id,)).fetchone()
+                    if row is None:
+                        continue
+                    removed.append(_row_to_record(row))
+                    if not dry_run:
+                        conn.execute("DELETE FROM records WHERE id = ?", (record_id,))
+                        self._unindex_text(conn, record_id)
+            return removed
+
+        async with self.write_lock:
+            removed = await self._write(run)
+        if not dry_run:
+            for record in removed:
+                self._changed(record, None)
+        return len(removed)
+
+    async def restore(self, records: List[Dict[str, Any]]) -> RestoreResult:
+        assignments = ", ".join(f"{COLUMNS[f]} = ?" for f in FIELDS)
+        wanted = {parse_id(record.get(ID_FIELD)) for record in records}
+
+        def run(conn):
+            changes, touched = [], []
+            with conn:
+                stale = [row for row in conn.execute(_SELECT).fetchall() if row[-2] not in wanted]
+                for row in stale:
+                    conn.execute("DELETE FROM records WHERE id = ?", (row[-2],))
+                    self._unindex_text(conn, row[-2])
+                    changes.append((_row_to_record(row), None))
+                added = updated = 0
+                for record in records:
+                    record_id = parse_id(record.get(ID_FIELD))
+                    row = conn.execute(f"{_SELECT} WHERE id = ?", (record_id,)).fetchone()
+                    if row is None:
+                        item = self._insert_one(conn, record)
+                        touched.append(item)
+                        changes.append((None, item))
+                        added += 1
+                        continue
+                    before = _row_to_record(row)
+                    values = _record_values(record)
+                    if values == tuple(before.values()):
+                        continue
+                    conn.execute(f"UPDATE records SET {assignments}, version = version + 1 WHERE id = ?",
+                                 (*values, record_id))
+                    self._unindex_text(conn, record_id)
+                    self._index_text(conn, "WHERE id = ?", (record_id,))
+                    after = _row_to_record(conn.execute(f"{_SELECT} WHERE id = ?", (record_id,)).fetchone())
+                    touched.append(after)
+                    changes.append((before, after))
+                    updated += 1
+                self._register_nodes(conn, touched)
+            return RestoreResult(added, updated, len(stale)), changes
+
+        async with self.write_lock:
+            result, changes = await self._write(run)
+        for old, new in changes:
+            self._changed(old, new)
+        return result
+
+
+def create_repository(backend: str, executor: Executor, data_file: str, sqlite_path: str,
+                      default=(), **json_options) -> BaseRepository:
+    """Создать хранилище по имени бэкенда из config.py"""
+    if backend == "json":
+        return JsonRepository(data_file, executor, default=default, **json_options)
+    if backend == "sqlite":
+        return SqliteRepository(sqlite_path, executor, seed_file=data_file, default=default)
+    raise ValueError(f"Неизвестный бэкенд хранилища: {backend}")
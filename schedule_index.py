@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Иерархический индекс записей: класс → полугодие → предмет → экзамен → тип материалов."""
+
+import hashlib
+from bisect import bisect_left, insort
+from itertools import product
+from typing import Any, Dict, List, Optional, Tuple
+
+from search import normalize
+
+# Порядок уровней навигации (ключи записи)
+LEVELS = ("класс", "полугодие", "предмет", "экзамен", "тип_материалов")
+
+# Поля, по которым фильтруются списки записей (/list, /delete, /edit, /export)
+FILTER_FIELDS = ("класс", "полугодие", "предмет")
+
+ROOT_ID = 0
+
+
+def node_id(path) -> int:
+    """Стабильный числовой идентификатор узла дерева по его пути.
+
+    Не зависит от порядка загрузки, перезапусков и процесса, поэтому ссылки
+    на узел (например, в callback_data) остаются действительными.
+    """
+    if not path:
+        return ROOT_ID
+    digest = hashlib.blake2b("\x1f".join(path).encode("utf-8"), digest_size=8).digest()
+    # 63 бита: помещается в INTEGER SQLite и никогда не совпадает с ROOT_ID
+    return (int.from_bytes(digest, "big") >> 1) or 1
+
+
+def filter_key(filters: Optional[Dict[str, str]]) -> Tuple[Optional[str], ...]:
+    """Фильтры {поле: значение} -> нормализованное значение или None для каждого из FILTER_FIELDS"""
+    filters = filters or {}
+    unknown = set(filters) - set(FILTER_FIELDS)
+    if unknown:
+        raise ValueError(f"Фильтр по полю не поддерживается: {', '.join(sorted(unknown))}")
+    return tuple(normalize(filters[field]) if field in filters else None for field in FILTER_FIELDS)
+
+
+class _Node:
+    __slots__ = ("children", "keys", "records")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.keys: List[str] = []       # отсортированные имена дочерних узлов
+        self.records: List[Any] = []    # только у листьев (уровень типа материалов)
+
+
+class ScheduleIndex:
+    """Вложенный индекс с заранее отсортированными дочерними узлами.
+
+    Каждый шаг навигации стоит O(число дочерних узлов), а не O(N) по всей базе.
+    Для списков записей держатся отсортированные списки id на каждое сочетание
+    фильтров по FILTER_FIELDS: страница — срез списка, O(размер страницы).
+    """
+
+    def __init__(self, records=None):
+        self.root = _Node()
+        self.paths: Dict[int, Tuple[str, ...]] = {ROOT_ID: ()}
+        # (нормализованное значение или None для каждого из FILTER_FIELDS) -> id по возрастанию
+        self.listing: Dict[Tuple[Optional[str], ...], List[int]] = {}
+        if records is not None:
+            self.rebuild(records)
+
+    @staticmethod
+    def path_of(record) -> tuple:
+        return tuple(record[level] for level in LEVELS)
+
+    @staticmethod
+    def _listing_keys(record):
+        values = [(normalize(record[field]), None) for field in FILTER_FIELDS]
+        return product(*values)
+
+    def rebuild(self, records):
+        """Полностью перестроить индекс по списку записей"""
+        root = _Node()
+        paths = {ROOT_ID: ()}
+        listing: Dict[Tuple[Optional[str], ...], List[int]] = {}
+        for record in records:
+            for key in self._listing_keys(record):
+                listing.setdefault(key, []).append(record.id)
+            node = root
+            path = self.path_of(record)
+            for depth, key in enumerate(path, 1):
+                child = node.children.get(key)
+                if child is None:
+                    child = node.children[key] = _Node()
+                    paths[node_id(path[:depth])] = path[:depth]
+                node = child
+            node.records.append(record)
+        self._sort(root)
+        for ids in listing.values():
+            ids.sort()
+        self.root = root
+        self.paths = paths
+        self.listing = listing
+
+    def _sort(self, node: _Node):
+        node.keys = sorted(node.children)
+        for child in node.children.values():
+            self._sort(child)
+
+    def add(self, record):
+        """Добавить запись в индекс"""
+        node = self.root
+        path = self.path_of(record)
+        for depth, key in enumerate(path, 1):
+            child = node.children.get(key)
+            if child is None:
+                child = node.children[key] = _Node()
+                insort(node.keys, key)
+                self.paths[node_id(path[:depth])] = path[:depth]
+            node = child
+        node.records.append(record)
+        for key in self._listing_keys(record):
+            insort(self.listing.setdefault(key, []), record.id)
+
+    def replace(self, old, new):
+        """Поставить новую версию записи (тот же id) на место старой"""
+        path = self.path_of(old)
+        if self.path_of(new) != path:
+            self.remove(old)
+            self.add(new)
+            return
+        leaf = self._node(path)
+        for i, item in enumerate(leaf.records if leaf is not None else ()):
+            if item is old:
+                leaf.records[i] = new
+                return
+
+    def remove(self, record) -> bool:
+        """Удалить запись из индекса (по её текущим значениям полей)"""
+        path = self.path_of(record)
+        trail = [self.root]
+        for key in path:
+            child = trail[-1].children.get(key)
+            if child is None:
+                return False
+            trail.append(child)
+
+        leaf = trail[-1]
+        for i, item in enumerate(leaf.records):
+            if item is record:
+                del leaf.records[i]
+                break
+        else:
+            return False
+        for key in self._listing_keys(record):
+            ids = self.listing[key]
+            del ids[bisect_left(ids, record.id)]
+            if not ids:
+                del self.listing[key]
+
+        # подчищаем опустевшие узлы снизу вверх
+        for depth in range(len(path), 0, -1):
+            node = trail[depth]
+            if node.records or node.children:
+                break
+            parent = trail[depth - 1]
+            del parent.children[path[depth - 1]]
+            del parent.keys[bisect_left(parent.keys, path[depth - 1])]
+            self.paths.pop(node_id(path[:depth]), None)
+        return True
+
+    def _node(self, path) -> Optional[_Node]:
+        node = self.root
+        for key in path:
+            node = node.children.get(key)
+            if node is None:
+                return None
+        return node
+
+    def resolve(self, nid: int) -> Optional[Tuple[str, ...]]:
+        """Путь узла по его идентификатору (None, если узла больше нет)"""
+        return self.paths.get(nid)
+
+    def children(self, *path) -> List[str]:
+        """Отсортированные значения следующего уровня для префикса пути"""
+        node = self._node(path)
+        return list(node.keys) if node is not None else []
+
+    def find(self, *path):
+        """Первая запись с полным путём из пяти уровней (или None)"""
+        node = self._node(path)
+        if node is None or not node.records:
+            return None
+        return node.records[0]
+
+    def ids(self, filters: Optional[Dict[str, str]] = None) -> List[int]:
+        """id записей под фильтры по возрастанию (без копирования — только для чтения)"""
+        return self.listing.get(filter_key(filters), [])
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""Полнотекстовый поиск по записям: инвертированный индекс с ранжированием."""
+
+import math
+import re
+from bisect import bisect_left, insort
+from itertools import count
+from typing import Dict, List, Optional, Set, Tuple
+
+# Вес совпадения в зависимости от поля
+FIELD_WEIGHTS = {
+    "класс": 3.0,
+    "полугодие": 1.0,
+    "предмет": 3.0,
+    "экзамен": 2.0,
+    "тип_материалов": 2.0,
+    "информация": 1.0,
+    "ссылка": 0.5,
+}
+
+# Насколько ценится неполное совпадение слова
+PREFIX_FACTOR = 0.8
+INFIX_FACTOR = 0.5
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    """Регистр и ё/е не различаются"""
+    return str(text).casefold().replace("ё", "е")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def _trigrams(term: str) -> Set[str]:
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+
+class _Doc:
+    __slots__ = ("record", "terms", "seq")
+
+    def __init__(self, record, terms: Dict[str, float], seq: int):
+        self.record = record
+        self.terms = terms
+        self.seq = seq
+
+
+class SearchIndex:
+    """Инвертированный индекс по текстовым полям записей.
+
+    Слова запроса ищутся точно, по префиксу (отсортированный словарь + bisect)
+    и по подстроке длиной от трёх букв (триграммы словаря). Запись должна
+    содержать все слова запроса; результаты упорядочены по весу tf-idf с
+    учётом поля, где нашлось слово.
+    """
+
+    def __init__(self, records=()):
+        self.rebuild(records)
+
+    def rebuild(self, records):
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._docs: Dict[int, _Doc] = {}
+        self._vocabulary: List[str] = []
+        self._trigram_index: Dict[str, Set[str]] = {}
+        self._seq = count()
+        for record in records:
+            self.add(record)
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    @staticmethod
+    def record_terms(record) -> Dict[str, float]:
+        """Слова записи с весами полей (можно считать заранее, вне event loop)"""
+        terms: Dict[str, float] = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(record.get(field) or ""):
+                terms[token] = terms.get(token, 0.0) + weight
+        return terms
+
+    def add(self, record, terms: Optional[Dict[str, float]] = None):
+        key = id(record)
+        if key in self._docs:
+            self.remove(record)
+        if terms is None:
+            terms = self.record_terms(record)
+        self._docs[key] = _Doc(record, terms, next(self._seq))
+        for term, weight in terms.items():
+            posting = self._postings.get(term)
+            if posting is None:
+                posting = self._postings[term] = {}
+                insort(self._vocabulary, term)
+                for gram in _trigrams(term):
+                    self._trigram_index.setdefault(gram, set()).add(term)
+            posting[key] = weight
+
+    def remove(self, record):
+        doc = self._docs.pop(id(record), None)
+        if doc is None:
+            return
+        for term in doc.terms:
+            posting = self._postings[term]
+            posting.pop(id(record), None)
+            if posting:
+                continue
+            del self._postings[term]
+            del self._vocabulary[bisect_left(self._vocabulary, term)]
+            for gram in _trigrams(term):
+                terms = self._trigram_index[gram]
+                terms.discard(term)
+                if not terms:
+                    del self._trigram_index[gram]
+
+    def _expand(self, token: str) -> Dict[str, float]:
+        """Слова словаря, подходящие под слово запроса, с коэффициентом совпадения"""
+        matches: Dict[str, float] = {}
+        start = bisect_left(self._vocabulary, token)
+        for term in self._vocabulary[start:]:
+            if not term.startswith(token):
+                break
+            matches[term] = 1.0 if term == token else PREFIX_FACTOR
+
+        grams = _trigrams(token)
+        if grams:
+            candidates = None
+            for gram in grams:
+                terms = self._trigram_index.get(gram, set())
+                candidates = terms if candidates is None else candidates & terms
+                if not candidates:
+                    break
+            for term in candidates or ():
+                if term not in matches and token in term:
+                    matches[term] = INFIX_FACTOR
+        return matches
+
+    def search(self, query: str) -> List:
+        """Записи, содержащие все слова запроса, от самых релевантных"""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        total = len(self._docs)
+        scores = None
+        for token in tokens:
+            token_scores: Dict[int, float] = {}
+            for term, factor in self._expand(token).items():
+                posting = self._postings[term]
+                idf = math.log(1 + total / len(posting))
+                for key, weight in posting.items():
+                    score = factor * idf * weight
+                    if score > token_scores.get(key, 0.0):
+                        token_scores[key] = score
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {key: scores[key] + score for key, score in token_scores.items() if key in scores}
+            if not scores:
+                return []
+
+        ranked: List[Tuple[float, int, int]] = sorted(
+            (-score, self._docs[key].seq, key) for key, score in scores.items()
+        )
+        return [self._docs[key].record for _, _, key in ranked]
+
+
+# -------------------------
+# Нечёткий поиск (опечатки и сокращения)
+# -------------------------
+# Поля, по значениям которых исправляются опечатки
+FUZZY_FIELDS = ("предмет", "тип_материалов", "экзамен")
+
+_ABBREVIATION_RE = re.compile(r"(\w+)-(\w+)")
+
+
+def max_typos(word: str) -> int:
+    """Сколько опечаток допускается в слове такой длины"""
+    if len(word) < 3:
+        return 0
+    return 1 if len(word) < 6 else 2
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Расстояние Левенштейна; если оно больше limit, возвращает limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+
+def _deletes(word: str, depth: int) -> Set[str]:
+    """Все варианты слова без depth или меньше букв (включая само слово)"""
+    variants = {word}
+    frontier = {word}
+    for _ in range(depth):
+        frontier = {item[:i] + item[i + 1:] for item in frontier for i in range(len(item))}
+        variants |= frontier
+    return variants
+
+
+class FuzzyMatcher:
+    """Словарь значений полей с поиском по опечаткам.
+
+    Для каждого слова словаря заранее построены его варианты без одной-двух
+    букв (как в SymSpell), поэтому поиск похожих слов — несколько обращений
+    к словарю, а не перебор всего словаря. Кроме опечаток понимает начало
+    слова («матем») и сокращения через дефис («физ-ра»). Значения считаются
+    по ссылкам: слово уходит из словаря вместе с последней записью.
+    """
+
+    def __init__(self, values=()):
+        self.rebuild(values)
+
+    def rebuild(self, values):
+        self._refs: Dict[str, int] = {}
+        self._words: Dict[str, Set[str]] = {}
+        self._vocabulary: List[str] = []
+        self._deletes: Dict[str, Set[str]] = {}
+        for value in values:
+            self.add(value)
+
+    def add(self, value: str, count: int = 1):
+        if not value:
+            return
+        refs = self._refs.get(value, 0)
+        self._refs[value] = refs + count
+        if refs:
+            return
+        for word in set(tokenize(value)):
+            values = self._words.get(word)
+            if values is None:
+                values = self._words[word] = set()
+                insort(self._vocabulary, word)
+                for variant in _deletes(word, max_typos(word)):
+                    self._deletes.setdefault(variant, set()).add(word)
+            values.add(value)
+
+    def remove(self, value: str):
+        refs = self._refs.get(value, 0)
+        if refs > 1:
+            self._refs[value] = refs - 1
+            return
+        if not refs:
+            return
+        del self._refs[value]
+        for word in set(tokenize(value)):
+            values = self._words.get(word)
+            if values is None:
+                continue
+            values.discard(value)
+            if values:
+                continue
+            del self._words[word]
+            del self._vocabulary[bisect_left(self._vocabulary, word)]
+            for variant in _deletes(word, max_typos(word)):
+                words = self._deletes[variant]
+                words.discard(word)
+                if not words:
+                    del self._deletes[variant]
+
+    def _similar_words(self, token: str, limit: int) -> Dict[str, int]:
+        found: Dict[str, int] = {}
+        for variant in _deletes(token, limit):
+            for word in self._deletes.get(variant, ()):
+                if word not in found:
+                    found[word] = edit_distance(token, word, limit)
+        return {word: distance for word, distance in found.items() if distance <= limit}
+
+    def _word_scores(self, token: str) -> Dict[str, float]:
+        scores: Dict[str, float] = {}
+        limit = max_typos(token)
+        if limit:
+            for word, distance in self._similar_words(token, limit).items():
+                scores[word] = 1.0 - distance / (len(token) + 1)
+            start = bisect_left(self._vocabulary, token)
+            for word in self._vocabulary[start:]:
+                if not word.startswith(token):
+                    break
+                scores[word] = max(scores.get(word, 0.0), PREFIX_FACTOR)
+        return scores
+
+    def match(self, query: str, limit: int = 10) -> List[str]:
+        """Значения полей, похожие на запрос, от самых похожих"""
+        text = normalize(query)
+        value_scores: Dict[str, float] = {}
+
+        def credit(word_scores: Dict[str, float]):
+            best: Dict[str, float] = {}
+            for word, score in word_scores.items():
+                for value in self._words.get(word, ()):
+                    if score > best.get(value, 0.0):
+                        best[value] = score
+            for value, score in best.items():
+                value_scores[value] = value_scores.get(value, 0.0) + score
+
+        # «физ-ра» — начало и конец одного слова
+        for head, tail in _ABBREVIATION_RE.findall(text):
+            start = bisect_left(self._vocabulary, head)
+            abbreviated = {}
+            for word in self._vocabulary[start:]:
+                if not word.startswith(head):
+                    break
+                if word.endswith(tail) and len(word) > len(head) + len(tail):
+                    abbreviated[word] = 1.0
+            credit(abbreviated)
+        for token in _TOKEN_RE.findall(_ABBREVIATION_RE.sub(" ", text)):
+            credit(self._word_scores(token))
+
+        ranked = sorted(value_scores.items(), key=lambda item: (-item[1], item[0]))
+        return [value for value, _ in ranked[:limit]]
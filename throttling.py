@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Защита от флуда: ограничение частоты апдейтов от одного пользователя."""
+
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+SWEEP_INTERVAL = 60.0   # секунд между очистками устаревших записей
+
+
+class RateLimiter:
+    """Token bucket на пользователя в виде GCRA: вместо (токены, время) хранится
+    одно число — момент, когда ведро снова станет полным.
+
+    Пользователь, у которого ведро уже полное, из словаря удаляется при
+    очистке, поэтому память занимают только недавно активные.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.interval = 1.0 / rate
+        self.tolerance = self.interval * (max(burst, 1) - 1)
+        self._full_at: Dict[int, float] = {}
+        self._next_sweep = 0.0
+
+    def allow(self, user_id: int, now: float) -> bool:
+        full_at = max(self._full_at.get(user_id, now), now)
+        if full_at - now > self.tolerance:
+            return False
+        self._full_at[user_id] = full_at + self.interval
+        if now >= self._next_sweep:
+            self._full_at = {key: moment for key, moment in self._full_at.items() if moment > now}
+            self._next_sweep = now + SWEEP_INTERVAL
+        return True
+
+    def __len__(self) -> int:
+        return len(self._full_at)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Внешний middleware сообщений или callback'ов: лишние апдейты не доходят до обработчиков.
+
+    Повторное нажатие той же кнопки того же сообщения в течение
+    ``double_tap_window`` секунд отбрасывается сразу. Callback сверх лимита
+    получает только answerCallbackQuery, сообщение — предупреждение не чаще
+    раза в ``warn_interval`` секунд (ответ на каждое лишнее сообщение сам был бы флудом).
+    """
+
+    def __init__(self, rate: float, burst: int, notice: str, double_tap_window: float = 0.0,
+                 warn_interval: float = 10.0, exempt: Optional[Callable[[int], bool]] = None,
+                 on_drop: Optional[Callable[[str], None]] = None):
+        self.limiter = RateLimiter(rate, burst)
+        self.notice = notice
+        self.double_tap_window = double_tap_window
+        self.warn_interval = warn_interval
+        self.exempt = exempt
+        # колбэк для метрик: причина отброса ("double_tap" или "rate")
+        self.on_drop = on_drop
+        self._taps: Dict[Tuple[int, int, str], float] = {}
+        self._warned: Dict[int, float] = {}
+        self._next_sweep = 0.0
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        if user is None or (self.exempt is not None and self.exempt(user.id)):
+            return await handler(event, data)
+        now = time.monotonic()
+        self._sweep(now)
+
+        if isinstance(event, CallbackQuery) and self.double_tap_window and self._repeated(event, user.id, now):
+            self._dropped("double_tap")
+            await self._answer(event, None)
+            return None
+        if not self.limiter.allow(user.id, now):
+            self._dropped("rate")
+            if isinstance(event, CallbackQuery):
+                await self._answer(event, self.notice)
+            elif isinstance(event, Message) and now - self._warned.get(user.id, -self.warn_interval) >= self.warn_interval:
+                self._warned[user.id] = now
+                try:
+                    await event.answer(self.notice)
+                except TelegramAPIError:
+                    pass
+            return None
+        return await handler(event, data)
+
+    def _repeated(self, callback: CallbackQuery, user_id: int, now: float) -> bool:
+        message_id = callback.message.message_id if callback.message else 0
+        key = (user_id, message_id, callback.data or "")
+        if self._taps.get(key, 0.0) > now:
+            return True
+        self._taps[key] = now + self.double_tap_window
+        return False
+
+    async def _answer(self, callback: CallbackQuery, text: Optional[str]):
+        try:
+            await callback.answer(text)
+        except TelegramAPIError:
+            # callback мог устареть — ответ не важен
+            pass
+
+    def _dropped(self, reason: str):
+        if self.on_drop is not None:
+            self.on_drop(reason)
+
+    def _sweep(self, now: float):
+        if now < self._next_sweep:
+            return
+        self._taps = {key: until for key, until in self._taps.items() if until > now}
+        self._warned = {key: moment for key, moment in self._warned.items() if now - moment < self.warn_interval}
+        self._next_sweep = now + SWEEP_INTERVAL
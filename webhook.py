@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Режим webhook: апдейты принимает aiohttp-сервер вместо long polling."""
+
+import asyncio
+from typing import Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+
+class DrainingRequestHandler(SimpleRequestHandler):
+    """Апдейты обрабатываются в фоне: Telegram сразу получает ответ 200,
+    а всплеск апдейтов обрабатывается параллельно.
+
+    При остановке сервер дожидается уже начатых апдейтов (не дольше
+    drain_timeout секунд) и только потом закрываются хранилища.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: Optional[str] = None,
+                 drain_timeout: float = 10.0, **data):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.drain_timeout = drain_timeout
+
+    async def close(self):
+        # сессию бота закрываем в on_cleanup: обработчикам остановки она ещё нужна
+        tasks = set(self._background_feed_update_tasks)
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=self.drain_timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            print(f"Прервано необработанных апдейтов: {len(pending)}")
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+def create_webhook_app(dp: Dispatcher, bot: Bot, path: str, secret: Optional[str] = None,
+                       url: Optional[str] = None, drain_timeout: float = 10.0) -> web.Application:
+    """aiohttp-приложение с webhook по адресу path.
+
+    secret проверяется в заголовке X-Telegram-Bot-Api-Secret-Token. Если задан
+    url (внешний адрес за reverse proxy), при запуске вызывается setWebhook;
+    без него сервер просто принимает POST с JSON апдейта — так его удобно
+    проверять локально.
+    """
+    app = web.Application()
+    handler = DrainingRequestHandler(dp, bot, secret_token=secret or None, drain_timeout=drain_timeout)
+    # порядок on_shutdown: сначала дождаться апдейтов, затем остановить бота (dp.shutdown)
+    handler.register(app, path=path)
+    setup_application(app, dp, bot=bot)
+
+    if url:
+        async def set_webhook(_):
+            await bot.set_webhook(url.rstrip("/") + path, secret_token=secret or None,
+                                  allowed_updates=dp.resolve_used_update_types())
+        app.on_startup.append(set_webhook)
+
+    async def close_session(_):
+        await bot.session.close()
+    app.on_cleanup.append(close_session)
+    return app